@@ -1,40 +1,1197 @@
 '''cache_remote -- cache answers to remote queries
+-------------------------------------------------
+
+A query thunk returns a time-to-live along with its answer::
+
+  >>> from datetime import timedelta
+  >>> logged = rtconfig._printLogs()
+  >>> ts = rtconfig.MockClock()
+
+  >>> c = Cache(ts.now, max_entries=3)
+  >>> def ask(k, ttl=10):
+  ...     return c._query(k, lambda: (timedelta(seconds=ttl), k.upper()),
+  ...                     'Sample')
+  >>> ask('a')
+  'A'
+  >>> print(logged())
+  INFO:cache_remote:Cache@1 cache initialized
+  INFO:cache_remote:Sample query for a
+  INFO:cache_remote:... cached until 2011-09-02 00:00:10.500000
+
+Until then, the answer comes from the cache::
+
+  >>> ask('a')
+  'A'
+  >>> print(logged())
+  <BLANKLINE>
+
+See :meth:`Cache._query` for eviction and concurrent misses,
+:meth:`Cache._revalidate` for serving stale answers, :class:`SQLiteStore`
+for sharing answers among worker processes, :class:`CacheStats`,
+:meth:`CachePolicy.save_snapshot` and :meth:`Cache.invalidate`.
 '''
 
+from ConfigParser import NoSectionError
+from collections import OrderedDict, deque, namedtuple
+from datetime import timedelta
+from itertools import count
+from threading import Event, Lock, RLock
+import cPickle as pickle
+import heapq
 import logging
+import math
+import sqlite3
+import time
+import weakref
+import zlib
+
+from injector import provides, singleton
+
+import periodic
+import rtconfig
 
 log = logging.getLogger(__name__)
 
+CONFIG_SECTION = 'cache'
+OPTIONS = ('max_entries', 'stale_grace', 'backend', 'sqlite_path',
+           'snapshot_path', 'snapshot_interval', 'snapshot_max_age')
+SNAPSHOT_VERSION = 1
+SNAPSHOT_MAGIC = b'heron_admin cache snapshot %d\n' % SNAPSHOT_VERSION
+
+
+def _spawn_thread(work):
+    periodic.start('cache-refresh', work)
+
+
+@singleton
+class CachePolicy(object):
+    '''Tuning shared by the caches in an application.
+    '''
+    def __init__(self, max_entries=None, stale_grace=None,
+                 spawn=_spawn_thread, store=None, timer=time.time):
+        '''
+        :param max_entries: bound on the number of entries in each cache
+        :param stale_grace: dict from query label to a timedelta during
+                            which expired answers may be served
+        :param spawn: run a background refresh
+        :param store: shared store such as :class:`SQLiteStore`, or
+                      `None` to keep answers only in this process
+        :param timer: access to elapsed time, in seconds, for
+                      measuring remote queries
+        '''
+        self.max_entries = max_entries
+        self._grace = dict(stale_grace or {})
+        self.spawn = spawn
+        self.store = store
+        self.timer = timer
+        self.stats = CacheStats()
+        self._caches = weakref.WeakSet()
+        self._restored = {}  # cache class name -> [entry blob]
+
+    def _register(self, cache):
+        self._caches.add(cache)
+        return self._restored.pop(cache.__class__.__name__, [])
+
+    def save_snapshot(self, out, tnow):
+        '''Write unexpired entries of registered caches.
+
+        :param out: binary output stream
+        :return: number of entries written
+
+        >>> ts = rtconfig.MockClock()
+        >>> logged = rtconfig._printLogs()
+
+        To survive a restart, the unexpired entries of the caches that share a
+        policy can be saved to a file and loaded into the caches of the next
+        process:
+
+        >>> from io import BytesIO
+        >>> before = CachePolicy()
+        >>> lc = Cache(ts.now, policy=before)
+        >>> for k in ['a', 'b']:
+        ...     _ = lc._query(
+        ...         k, lambda: (timedelta(minutes=10), k.upper()), 'LDAP')
+        >>> snap = BytesIO()
+        >>> before.save_snapshot(snap, ts.now())
+        2
+        >>> after = CachePolicy()
+        >>> after.load_snapshot(BytesIO(snap.getvalue()), ts.now(),
+        ...                     max_age=timedelta(hours=1))
+        2
+        >>> lc2 = Cache(ts.now, policy=after)
+        >>> lc2._query('a', lambda: 1 / 0, 'LDAP')
+        'A'
+        >>> print(logged())
+        ... # doctest: +ELLIPSIS
+        INFO:cache_remote:Cache@1 cache initialized
+        ...
+        INFO:cache_remote:Cache@1 cache initialized
+        INFO:cache_remote:Cache: 2 entries from snapshot
+
+        Old snapshots are refused, as are snapshots in another format:
+
+        >>> CachePolicy().load_snapshot(BytesIO(snap.getvalue()),
+        ...                             ts.now() + timedelta(days=1),
+        ...                             max_age=timedelta(hours=1))
+        0
+        >>> CachePolicy().load_snapshot(BytesIO(b'junk'), ts.now(),
+        ...                             max_age=timedelta(hours=1))
+        0
+        >>> print(logged())
+        ... # doctest: +ELLIPSIS
+        WARNING:cache_remote:cache snapshot from ... is too old; ignoring it
+        WARNING:cache_remote:not a cache snapshot (version 1); ignoring it
+        '''
+        caches = {}
+        qty = 0
+        for cache in list(self._caches):
+            blobs = caches.setdefault(cache.__class__.__name__, [])
+            for entry in cache._live_entries(tnow):
+                try:
+                    blobs.append(pickle.dumps(entry, 2))
+                except (pickle.PicklingError, TypeError):
+                    continue
+                qty += 1
+        out.write(SNAPSHOT_MAGIC)
+        out.write(zlib.compress(pickle.dumps((tnow, caches), 2)))
+        return qty
+
+    def load_snapshot(self, inp, tnow, max_age):
+        '''Read a snapshot for caches yet to be registered.
+
+        :param inp: binary input stream
+        :param timedelta max_age: refuse snapshots older than this
+        :return: number of entries read
+        '''
+        if inp.readline() != SNAPSHOT_MAGIC:
+            log.warn('not a cache snapshot (version %d); ignoring it',
+                     SNAPSHOT_VERSION)
+            return 0
+        saved, caches = pickle.loads(zlib.decompress(inp.read()))
+        if tnow - saved > max_age:
+            log.warn('cache snapshot from %s is too old; ignoring it', saved)
+            return 0
+        self._restored = caches
+        return sum(len(blobs) for blobs in caches.values())
+
+    def grace(self, label):
+        return self._grace.get(label)
+
+    @classmethod
+    def from_options(cls, rt, store=None):
+        '''Grace periods are configured per label in the `[cache]` section:
+
+        >>> p = CachePolicy.from_options(rtconfig.TestTimeOptions(dict(
+        ...     max_entries='500',
+        ...     stale_grace='Sponsorship: 3600, in DROC?: 300')))
+        >>> p.max_entries
+        500
+        >>> p.grace('in DROC?')
+        datetime.timedelta(0, 300)
+        >>> p.grace('LDAP') is None
+        True
+        '''
+        grace = [(label.strip(), timedelta(seconds=int(secs)))
+                 for item in (rt.stale_grace or '').split(',')
+                 if item.strip()
+                 for (label, secs) in [item.rsplit(':', 1)]]
+        return cls(max_entries=(int(rt.max_entries) if rt.max_entries
+                                else None),
+                   stale_grace=dict(grace), store=store)
+
+
+LabelStats = namedtuple('LabelStats',
+                        ['label', 'hits', 'misses', 'coalesced', 'stale',
+                         'expirations', 'evictions', 'hit_ratio',
+                         'p50', 'p90', 'p99'])
+
+
+class CacheStats(object):
+    '''Hit, miss, and remote latency counts by query label.
+
+    >>> ts = rtconfig.MockClock()
+    >>> logged = rtconfig._printLogs()
+
+    Each policy keeps :class:`CacheStats` on the queries of the caches
+    that share it, by label, so that time-to-live settings can be tuned
+    from data:
+
+    >>> ticks = iter(range(0, 1000, 25))
+    >>> measured = CachePolicy(timer=lambda: next(ticks) / 1000.0)
+    >>> mc = Cache(ts.now, max_entries=2, policy=measured)
+    >>> def lookup(k, ttl=60):
+    ...     return mc._query(k, lambda: (timedelta(seconds=ttl), k), 'LDAP')
+    >>> for k in ['a', 'a', 'b', 'c', 'a']:
+    ...     _ = lookup(k)
+    >>> _ = mc._query('x', lambda: (timedelta(seconds=1), 'x'), 'in DROC?')
+    >>> ts.wait(5)
+    >>> _ = mc._query('x', lambda: (timedelta(seconds=1), 'x'), 'in DROC?')
+    >>> for row in measured.stats.report():
+    ...     print(row)
+    ... # doctest: +NORMALIZE_WHITESPACE
+    LabelStats(label='LDAP', hits=1, misses=4, coalesced=0, stale=0,
+               expirations=0, evictions=3, hit_ratio=0.2,
+               p50=25.0, p90=25.0, p99=25.0)
+    LabelStats(label='in DROC?', hits=0, misses=2, coalesced=0, stale=0,
+               expirations=1, evictions=0, hit_ratio=0.0,
+               p50=25.0, p90=25.0, p99=25.0)
+    >>> _ = logged()
+    '''
+    counters = ('hits', 'misses', 'coalesced', 'stale',
+                'expirations', 'evictions')
+    samples = 1000  # latencies kept per label
+
+    def __init__(self):
+        self._lock = Lock()
+        self._counts = {}
+        self._latency = {}
+
+    def count(self, label, counter):
+        with self._lock:
+            counts = self._counts.get(label)
+            if counts is None:
+                counts = self._counts[label] = dict.fromkeys(
+                    self.counters, 0)
+            counts[counter] += 1
+
+    def latency(self, label, seconds):
+        with self._lock:
+            recent = self._latency.get(label)
+            if recent is None:
+                recent = self._latency[label] = deque(maxlen=self.samples)
+            recent.append(round(seconds * 1000, 1))
+
+    def report(self):
+        '''Summarize by label, with latency percentiles in milliseconds.
+        '''
+        with self._lock:
+            counts = dict((label, dict(c))
+                          for (label, c) in self._counts.items())
+            latency = dict((label, sorted(l))
+                           for (label, l) in self._latency.items())
+        rows = []
+        for label in sorted(counts):
+            c = counts[label]
+            ms = latency.get(label, [])
+            asked = c['hits'] + c['misses'] + c['coalesced']
+            rows.append(LabelStats(
+                label=label,
+                hit_ratio=(float(c['hits'] + c['coalesced']) / asked
+                           if asked else None),
+                p50=_percentile(ms, 50),
+                p90=_percentile(ms, 90),
+                p99=_percentile(ms, 99),
+                **c))
+        return rows
+
+
+def _percentile(ordered, pct):
+    '''Nearest-rank percentile.
+
+    >>> _percentile([10, 20, 30, 40], 50), _percentile([10, 20], 99)
+    (20, 20)
+    >>> _percentile([], 50) is None
+    True
+    '''
+    if not ordered:
+        return None
+    rank = int(math.ceil(pct / 100.0 * len(ordered)))
+    return ordered[max(rank, 1) - 1]
+
+
+def connect_local(path):  # pragma: nocover
+    '''Open a sqlite database on this host for use by many threads
+    and processes.
+    '''
+    conn = sqlite3.connect(path, timeout=5, check_same_thread=False)
+    conn.execute('pragma journal_mode=wal')
+    return conn
+
+
+class SQLiteStore(object):
+    '''Cache entries shared by the processes on a host.
+
+    Values are pickled and compressed; pickles are trusted, so the
+    database file must only be writable by the application account.
+
+    >>> ts = rtconfig.MockClock()
+    >>> logged = rtconfig._printLogs()
+
+    Each worker process has its own caches. To let the workers on a host
+    reuse one another's answers, give the policy a shared store such as
+    :class:`SQLiteStore`:
+
+    >>> import sqlite3
+    >>> store = SQLiteStore(sqlite3.connect(':memory:',
+    ...                                     check_same_thread=False))
+    >>> shared = CachePolicy(store=store)
+    >>> worker1 = Cache(ts.now, policy=shared)
+    >>> worker2 = Cache(ts.now, policy=shared)
+    >>> def badge():
+    ...     return timedelta(seconds=60), dict(cn=['bill'], sn=['Student'])
+    >>> sorted(worker1._query('bill', badge, 'LDAP').items())
+    [('cn', ['bill']), ('sn', ['Student'])]
+    >>> sorted(worker2._query('bill', badge, 'LDAP').items())
+    [('cn', ['bill']), ('sn', ['Student'])]
+    >>> print(logged())
+    INFO:cache_remote:Cache@1 cache initialized
+    INFO:cache_remote:Cache@1 cache initialized
+    INFO:cache_remote:LDAP query for bill
+    INFO:cache_remote:... cached until 2011-09-02 00:01:00.500000
+    INFO:cache_remote:LDAP shared answer for bill
+
+    Expired entries in the store are not used:
+
+    >>> ts.wait(120)
+    >>> worker1._query('bill', badge, 'LDAP')['cn']
+    ['bill']
+    >>> print(logged())
+    INFO:cache_remote:LDAP query for bill
+    INFO:cache_remote:... cached until 2011-09-02 00:03:01.500000
+    '''
+    prune_interval = 100  # puts
+    invalidation_log = 1000  # most recent invalidations to keep
+
+    def __init__(self, conn):
+        '''
+        :param conn: sqlite3 connection, as from :func:`connect_local`
+        '''
+        self._conn = conn
+        self._lock = Lock()
+        self._puts = 0
+        with self._lock:
+            conn.execute('create table if not exists cache_entry ('
+                         ' k text primary key,'
+                         ' expire text not null,'
+                         ' hard text not null,'
+                         ' v blob not null)')
+            conn.execute('create index if not exists cache_entry_hard'
+                         ' on cache_entry (hard)')
+            conn.execute('create table if not exists cache_invalidation ('
+                         ' seq integer primary key autoincrement,'
+                         ' k text not null)')
+            conn.commit()
+
+    @classmethod
+    def at(cls, path):  # pragma: nocover
+        return cls(connect_local(path))
+
+    @classmethod
+    def _t(cls, t):
+        return t.strftime('%Y-%m-%d %H:%M:%S.%f')
+
+    def delete(self, k_prefix):
+        '''Delete entries whose keys start with `k_prefix`, and log
+        the deletion for other processes to apply to their caches.
+
+        :return: sequence number of the logged invalidation
+        '''
+        with self._lock:
+            conn = self._conn
+            conn.execute(
+                'delete from cache_entry where substr(k, 1, ?) = ?',
+                (len(k_prefix), k_prefix))
+            seq = conn.execute(
+                'insert into cache_invalidation (k) values (?)',
+                (k_prefix,)).lastrowid
+            conn.commit()
+        return seq
+
+    def invalidations(self, after):
+        '''Find invalidations logged since sequence number `after`.
+
+        :param after: sequence number, or `None` to start from now
+        :return: (latest sequence number, [(seq, k_prefix)])
+        '''
+        with self._lock:
+            if after is None:
+                latest = self._conn.execute(
+                    'select max(seq) from cache_invalidation').fetchone()[0]
+                return latest or 0, []
+            rows = self._conn.execute(
+                'select seq, k from cache_invalidation where seq > ?'
+                ' order by seq', (after,)).fetchall()
+        return (rows[-1][0] if rows else after), rows
+
+    def get(self, k, tnow):
+        '''Get an answer that has not expired as of `tnow`.
+
+        :return: (expire, value) or `None`
+        '''
+        with self._lock:
+            row = self._conn.execute(
+                'select v from cache_entry where k = ? and expire > ?',
+                (k, self._t(tnow))).fetchone()
+        if row is None:
+            return None
+        return pickle.loads(zlib.decompress(row[0]))
+
+    def put(self, k, tnow, expire, hard, v):
+        try:
+            blob = zlib.compress(pickle.dumps((expire, v), 2))
+        except (pickle.PicklingError, TypeError):
+            log.debug('cannot pickle answer for %s', k, exc_info=True)
+            return
+        with self._lock:
+            conn = self._conn
+            conn.execute('insert or replace into cache_entry'
+                         ' (k, expire, hard, v) values (?, ?, ?, ?)',
+                         (k, self._t(expire), self._t(hard),
+                          sqlite3.Binary(blob)))
+            self._puts += 1
+            if self._puts % self.prune_interval == 0:
+                conn.execute('delete from cache_entry where hard <= ?',
+                             (self._t(tnow),))
+                conn.execute('delete from cache_invalidation where seq <='
+                             ' (select max(seq) from cache_invalidation)'
+                             ' - ?', (self.invalidation_log,))
+            conn.commit()
+
 
 class Cache(object):
-    def __init__(self, now):
+    max_entries = 10000
+    # how long to keep expired answers for :meth:`_stale`, if at all
+    keep_stale = None
+    # how often to look for invalidations by other processes
+    sync_interval = timedelta(seconds=1)
+
+    def __init__(self, now, max_entries=None, policy=None):
+        '''
+        :param now: access to the current time
+        :param max_entries: bound on the number of cached answers
+                            (default: from `policy` or
+                            `Cache.max_entries`)
+        :param CachePolicy policy: per-label tuning
+        '''
         self.__now = now
-        self._cache = {}
+        self._policy = policy = policy or CachePolicy()
+        if max_entries is None:
+            max_entries = policy.max_entries
+        if max_entries is not None:
+            self.max_entries = max_entries
+        # key -> (expire, seq, value, hard expire, label), LRU first
+        self._cache = OrderedDict()
+        # (hard expire, seq, key) min-heap; stale items are skipped lazily
+        self._expiry = []
+        self._seq = count()
+        self._lock = RLock()
+        # key -> _Flight for queries in progress
+        self._inflight = {}
+        # Writes to the shared store check, under _store_lock, that no
+        # invalidation has happened since their answer landed.
+        self._store_lock = Lock()
+        self._generation = 0
+        # Position in the shared store's invalidation log, and our
+        # own entries there, which we needn't apply twice.
+        self._seen = None
+        self._next_sync = None
+        self._mine = set()
+        self.coalesced = 0
         ix = 1  # was global mutable state. ew.
         log.info('%s@%s cache initialized',
                  self.__class__.__name__, ix)
+        restored = policy._register(self)
+        if restored:
+            self._restore(restored)
+
+    def _live_entries(self, tnow):
+        with self._lock:
+            return [(k, expire, hard, label, v)
+                    for (k, (expire, _, v, hard, label))
+                    in self._cache.items()
+                    if hard > tnow]
+
+    def _restore(self, blobs):
+        tnow = self.__now()
+        qty = 0
+        with self._lock:
+            for blob in blobs:
+                try:
+                    k, expire, hard, label, v = pickle.loads(blob)
+                except Exception:  # e.g. a class was renamed
+                    continue
+                if hard > tnow:
+                    self._put(k, expire, v, label, hard)
+                    qty += 1
+        log.info('%s: %d entries from snapshot',
+                 self.__class__.__name__, qty)
 
     def _query(self, k, thunk, label=None):
+        '''Get the answer for `k` from the cache, or else from `thunk`.
+
+        :param thunk: access to (time-to-live, answer)
+        :param label: kind of query, for logs, tuning and stats
+
+        >>> ts = rtconfig.MockClock()
+        >>> c = Cache(ts.now, max_entries=3)
+        >>> def ask(k, ttl=10):
+        ...     return c._query(
+        ...         k, lambda: (timedelta(seconds=ttl), k.upper()), 'Sample')
+        >>> ask('a')
+        'A'
+        >>> logged = rtconfig._printLogs()
+
+        Expired entries are pruned from a heap ordered by expiration time,
+        so we don't have to scan the whole cache on each miss:
+
+        >>> ask('b', ttl=1)
+        'B'
+        >>> ts.wait(5)
+        >>> ask('c')
+        'C'
+        >>> sorted(c._cache.keys())
+        ['a', 'c']
+
+        The number of entries is bounded; when the cache is full, the least
+        recently used entry is evicted:
+
+        >>> ask('a') and ask('d')
+        'D'
+        >>> ask('e')
+        'E'
+        >>> list(c._cache.keys())
+        ['a', 'd', 'e']
+        >>> _ = logged()
+
+        Concurrent misses on the same key share one remote query: the first
+        thread fetches while the others wait for its answer:
+
+        >>> from threading import Event, Thread
+        >>> import time
+        >>> started, release = Event(), Event()
+        >>> def slow():
+        ...     started.set()
+        ...     release.wait()
+        ...     return timedelta(seconds=10), 'slow answer'
+        >>> answers = []
+        >>> def ask_slowly():
+        ...     answers.append(c._query('k', slow, 'Slow'))
+        >>> leader = Thread(target=ask_slowly)
+        >>> leader.start()
+        >>> started.wait()
+        True
+        >>> followers = [Thread(target=ask_slowly) for n in range(3)]
+        >>> for t in followers:
+        ...     t.start()
+        >>> while c.coalesced < 3:
+        ...     time.sleep(0.01)
+        >>> release.set()
+        >>> for t in [leader] + followers:
+        ...     t.join()
+        >>> answers
+        ['slow answer', 'slow answer', 'slow answer', 'slow answer']
+        >>> print(logged())
+        INFO:cache_remote:Slow query for k
+        INFO:cache_remote:... cached until 2011-09-02 00:00:18.500000
+
+        Waiting threads see the same exception if the query fails:
+
+        >>> started.clear(); release.clear()
+        >>> def fail():
+        ...     started.set()
+        ...     release.wait()
+        ...     raise IOError('LDAP server down')
+        >>> errors = []
+        >>> def try_query():
+        ...     try:
+        ...         c._query('x', fail, 'Failing')
+        ...     except IOError as ex:
+        ...         errors.append(ex)
+        >>> leader = Thread(target=try_query)
+        >>> leader.start()
+        >>> started.wait()
+        True
+        >>> follower = Thread(target=try_query)
+        >>> follower.start()
+        >>> while c.coalesced < 4:
+        ...     time.sleep(0.01)
+        >>> release.set()
+        >>> leader.join(); follower.join()
+        >>> [str(ex) for ex in errors]
+        ['LDAP server down', 'LDAP server down']
+        >>> _ = logged()
+        '''
         tnow = self.__now()
+        self._sync(tnow)
+        stats = self._policy.stats
+        leader = False
+        with self._lock:
+            entry = self._cache.pop(k, None)
+            if entry is not None:
+                expire, _, v, hard, _ = entry
+                self._cache[k] = entry  # now most recently used
+                grace = self._policy.grace(label) or timedelta(0)
+                if min(hard, expire + grace) > tnow:
+                    stats.count(label, 'hits')
+                    if expire <= tnow:
+                        stats.count(label, 'stale')
+                        if k not in self._inflight:
+                            self._revalidate(k, thunk, label)
+                    return v
+                if hard <= tnow:
+                    del self._cache[k]
+                stats.count(label, 'expirations')
+
+            flight = self._inflight.get(k)
+            if flight is not None:
+                self.coalesced += 1
+                stats.count(label, 'coalesced')
+            else:
+                flight = self._inflight[k] = _Flight()
+                leader = True
+                stats.count(label, 'misses')
+                # We're taking the time to go over the network; now is
+                # a good time to prune the cache.
+                self._prune(tnow)
+
+        if not leader:
+            return flight.wait()
+
+        return self._fetch(k, thunk, label, flight, tnow)
+
+    def _cached(self, k, label=None):
+        '''Get a fresh cached answer, perhaps from the shared store,
+        without querying.
+
+        :raises: :exc:`KeyError` if there is none
+        '''
+        tnow = self.__now()
+        self._sync(tnow)
+        with self._lock:
+            entry = self._cache.get(k)
+            if entry is not None and entry[0] > tnow:
+                self._cache[k] = self._cache.pop(k)  # now most recently used
+                self._policy.stats.count(label, 'hits')
+                return entry[2]
+            generation = self._generation
+
+        store = self._policy.store
         try:
-            expire, v = self._cache[k]
-        except KeyError:
-            pass
-        else:
-            if expire > tnow:
-                return v
+            shared = store and store.get(self._shared_key(k, label), tnow)
+        except sqlite3.Error:
+            log.warn('cannot get shared %s answer for %s', label, k)
+            log.debug('store error detail', exc_info=True)
+            shared = None
+        if not shared:
+            raise KeyError(k)
+        log.info('%s shared answer for %s', label, k)
+        expire, v = shared
+        with self._lock:
+            if generation == self._generation:
+                self._put(k, expire, v, label)
+        self._policy.stats.count(label, 'hits')
+        return v
+
+    def _stale(self, k):
+        '''Get a cached answer, however stale, without querying.
+
+        Expired answers are kept for `keep_stale`:
+
+        >>> ts = rtconfig.MockClock()
+        >>> sc = Cache(ts.now)
+        >>> sc.keep_stale = timedelta(hours=1)
+        >>> sc._query('a', lambda: (timedelta(seconds=10), 'A'))
+        'A'
+        >>> ts.wait(60)
+        >>> sc._cached('a')
+        Traceback (most recent call last):
+          ...
+        KeyError: 'a'
+        >>> sc._stale('a')
+        'A'
+        >>> ts.wait(3600)
+        >>> print(sc._stale('a'))
+        None
+
+        :return: the answer, or `None` if none is kept
+        '''
+        tnow = self.__now()
+        with self._lock:
+            entry = self._cache.get(k)
+        if entry is None or entry[3] <= tnow:
+            return None
+        return entry[2]
 
-        # We're taking the time to go over the network; now is
-        # a good time to prune the cache.
-        self._prune(tnow)
+    def _bulk(self):
+        '''Note when a bulk query starts, for :meth:`_fill`.
+        '''
+        with self._lock:
+            return _Bulk(self._generation, self._policy.timer())
 
-        log.info('%s query for %s', label, k)
-        ttl, v = thunk()
+    def _fill(self, answers, ttl, label=None, bulk=None):
+        '''Cache answers fetched in bulk, and share them.
+
+        :param answers: iterable of (key, value) pairs
+        :param bulk: from :meth:`_bulk` before the query; answers
+                     are not cached if anything was invalidated since
+        :return: expiration time
+
+        As with :meth:`_query`, an invalidation while the query is
+        out wins:
+
+        >>> ts = rtconfig.MockClock()
+        >>> store = SQLiteStore(sqlite3.connect(
+        ...     ':memory:', check_same_thread=False))
+        >>> bc = Cache(ts.now, policy=CachePolicy(store=store))
+        >>> bulk = bc._bulk()
+        >>> answers = [(('sponsorship', 'bill'), 'yes')]  # (long query)
+        >>> bc.invalidate(('sponsorship', 'bill'))
+        0
+        >>> _ = bc._fill(answers, timedelta(minutes=10), 'Sponsorship', bulk)
+        >>> bc._cached(('sponsorship', 'bill'), 'Sponsorship')
+        Traceback (most recent call last):
+          ...
+        KeyError: ('sponsorship', 'bill')
+
+        Otherwise, other processes get the answers from the shared
+        store:
+
+        >>> bulk = bc._bulk()
+        >>> _ = bc._fill(answers, timedelta(minutes=10), 'Sponsorship', bulk)
+        >>> other = Cache(ts.now, policy=CachePolicy(store=store))
+        >>> other._cached(('sponsorship', 'bill'), 'Sponsorship')
+        'yes'
+        '''
+        tnow = self.__now()
+        policy = self._policy
+        stats = policy.stats
+        if bulk is not None and bulk.started is not None:
+            stats.latency(label, policy.timer() - bulk.started)
+            bulk.started = None  # count one latency per query
+        landed = []
+        with self._lock:
+            current = bulk is None or bulk.generation == self._generation
+            for k, v in answers:
+                stats.count(label, 'misses')
+                if current:
+                    landed.append((k, self._put(k, tnow + ttl, v, label), v))
+            generation = self._generation
+
+        store = policy.store
+        if store and landed:
+            with self._store_lock:
+                self._sync(tnow, force=True)
+                if generation == self._generation:
+                    for k, hard, v in landed:
+                        self._share(store, k, label, tnow, tnow + ttl,
+                                    hard, v)
         log.info('... cached until %s', tnow + ttl)
-        self._cache[k] = (tnow + ttl, v)
+        return tnow + ttl
+
+    def _fetch(self, k, thunk, label, flight, tnow):
+        store = self._policy.store
+        try:
+            shared = store and store.get(self._shared_key(k, label), tnow)
+            if shared:
+                log.info('%s shared answer for %s', label, k)
+                expire, v = shared
+            else:
+                log.info('%s query for %s', label, k)
+                timer = self._policy.timer
+                t0 = timer()
+                ttl, v = thunk()
+                self._policy.stats.latency(label, timer() - t0)
+                expire = tnow + ttl
+                log.info('... cached until %s', expire)
+        except BaseException as ex:
+            with self._lock:
+                del self._inflight[k]
+            flight.fail(ex)
+            raise
+
+        with self._lock:
+            if not flight.invalidated:
+                hard = self._put(k, expire, v, label)
+            del self._inflight[k]
+            generation = self._generation
+        flight.land(v)
+        if store and not shared and not flight.invalidated:
+            with self._store_lock:
+                self._sync(tnow, force=True)
+                if generation == self._generation:
+                    self._share(store, k, label, tnow, expire, hard, v)
         return v
 
+    def _share(self, store, k, label, tnow, expire, hard, v):
+        try:
+            store.put(self._shared_key(k, label), tnow, expire, hard, v)
+        except sqlite3.Error:
+            log.warn('cannot share %s answer for %s', label, k)
+            log.debug('store error detail', exc_info=True)
+
+    def _shared_key(self, k, label):
+        '''Keys in the shared store are the same whether their strings are
+        `str` or `unicode`:
+
+        >>> rc = Cache(rtconfig.MockClock().now)
+        >>> rc._shared_key((u'SAA', u'bill'), u'LDAP') == rc._shared_key(
+        ...     ('SAA', 'bill'), 'LDAP')
+        True
+        '''
+        return repr(_normal((self.__class__.__name__, k, label)))
+
+    def invalidate(self, key=None, prefix=None):
+        '''Drop cached answers by exact key or by tuple key prefix.
+
+        Queries in progress for matching keys are not cached.
+
+        Matching answers leave this process's cache at once. Other
+        processes that share the store drop theirs when they next
+        consult their caches, at most `sync_interval` later; see
+        :meth:`_sync`.
+
+        :return: number of entries dropped from this process's cache
+
+        >>> ts = rtconfig.MockClock()
+        >>> logged = rtconfig._printLogs()
+
+        When the application changes something that a cached answer depends
+        on, it can drop the answer by exact key or by key prefix:
+
+        >>> ic = Cache(ts.now)
+        >>> for k in [('SAA', 'bill@example'), ('SAA', 'bill'),
+        ...           ('sponsorship', 'bill')]:
+        ...     _ = ic._query(
+        ...         k, lambda: (timedelta(minutes=10), 'ok'), 'Sample')
+        >>> ic.invalidate(('sponsorship', 'bill'))
+        1
+        >>> ic.invalidate(prefix=('SAA',))
+        2
+        >>> len(ic._cache)
+        0
+        >>> print(logged())
+        ... # doctest: +ELLIPSIS
+        INFO:cache_remote:Cache@1 cache initialized
+        ...
+        INFO:cache_remote:Cache: invalidated 1 entries for ('sponsorship', ...)
+        INFO:cache_remote:Cache: invalidated 2 entries for ('SAA', ...)
+
+        An invalidation that arrives while an answer is being written to the
+        shared store wins there, too:
+
+        >>> from threading import Thread
+        >>> class SlowStore(SQLiteStore):
+        ...     def put(self, *args):
+        ...         time.sleep(0.05)
+        ...         SQLiteStore.put(self, *args)
+        >>> slow = SlowStore(
+        ...     sqlite3.connect(':memory:', check_same_thread=False))
+        >>> rc = Cache(ts.now, policy=CachePolicy(store=slow))
+        >>> k = ('sponsorship', 'bill')
+        >>> started, go = Event(), Event()
+        >>> def sponsored():
+        ...     started.set()
+        ...     go.wait(5)
+        ...     return timedelta(minutes=10), 'yes'
+        >>> def decide():  # e.g. a DROC decision, made as the answer lands
+        ...     rc._query(k, sponsored, 'Sample')
+        ...     rc.invalidate(k)
+        >>> leader = Thread(target=rc._query, args=(k, sponsored, 'Sample'))
+        >>> leader.start()
+        >>> started.wait(5)
+        True
+        >>> waiter = Thread(target=decide)
+        >>> waiter.start()
+        >>> while not rc.coalesced:
+        ...     time.sleep(0.001)
+        >>> go.set()
+        >>> leader.join()
+        >>> waiter.join()
+        >>> print(slow.get(rc._shared_key(k, 'Sample'), ts.now()))
+        None
+        '''
+        if prefix is not None:
+            n = len(prefix)
+
+            def match(k):
+                return isinstance(k, tuple) and k[:n] == prefix
+            # The shared store may drop a few more; that's harmless.
+            shared = repr(_normal((self.__class__.__name__, prefix)))[:-2]
+        else:
+            def match(k):
+                return k == key
+            shared = repr(_normal((self.__class__.__name__, key)))[:-1] + ','
+
+        doomed = self._drop(match)
+
+        store = self._policy.store
+        if store:
+            with self._store_lock:
+                try:
+                    self._mine.add(store.delete(shared))
+                except sqlite3.Error:
+                    log.warn('cannot invalidate shared answers for %s',
+                             key if prefix is None else prefix)
+                    log.debug('store error detail', exc_info=True)
+        if doomed:
+            log.info('%s: invalidated %d entries for %s',
+                     self.__class__.__name__, doomed,
+                     key if prefix is None else prefix + ('...',))
+        return doomed
+
+    def _drop(self, match):
+        with self._lock:
+            doomed = [k for k in self._cache if match(k)]
+            for k in doomed:
+                del self._cache[k]
+            for k, flight in self._inflight.items():
+                if match(k):
+                    flight.invalidated = True
+            # Answers that already landed mustn't be shared after this.
+            self._generation += 1
+        return len(doomed)
+
+    def _sync(self, tnow, force=False):
+        '''Apply invalidations logged in the shared store by other
+        processes.
+
+        >>> ts = rtconfig.MockClock()
+        >>> shared = SQLiteStore(sqlite3.connect(
+        ...     ':memory:', check_same_thread=False))
+        >>> w1, w2 = [Cache(ts.now, policy=CachePolicy(store=shared))
+        ...           for worker in [1, 2]]
+        >>> def signed(answer):
+        ...     return lambda: (timedelta(minutes=10), answer)
+        >>> w1._query(('SAA', 'bill'), signed('no'), 'SAA')
+        'no'
+        >>> w2._query(('SAA', 'bill'), signed('no'), 'SAA')
+        'no'
+        >>> logged = rtconfig._printLogs()
+        >>> w1.invalidate(('SAA', 'bill'))
+        1
+
+        Within `sync_interval`, the other worker drops its answer, too:
+
+        >>> ts.wait(1)
+        >>> w2._query(('SAA', 'bill'), signed('yes'), 'SAA')
+        'yes'
+        >>> print(logged())
+        INFO:cache_remote:Cache: invalidated 1 entries for ('SAA', 'bill')
+        INFO:cache_remote:Cache: 1 entries invalidated by another process
+        INFO:cache_remote:SAA query for ('SAA', 'bill')
+        INFO:cache_remote:... cached until 2011-09-02 00:10:02.500000
+        '''
+        store = self._policy.store
+        if not store or not (force or self._next_sync is None or
+                             tnow >= self._next_sync):
+            return
+        self._next_sync = tnow + self.sync_interval
+        try:
+            latest, logged = store.invalidations(self._seen)
+        except sqlite3.Error:
+            log.warn('cannot check for shared invalidations')
+            log.debug('store error detail', exc_info=True)
+            return
+
+        doomed = 0
+        with self._lock:
+            if self._seen is not None and latest <= self._seen:
+                return
+            self._seen = latest
+            for seq, shared in logged:
+                if seq in self._mine:
+                    self._mine.discard(seq)
+                    continue
+                doomed += self._drop(
+                    lambda k: self._shared_key(k, None).startswith(shared))
+        if doomed:
+            log.info('%s: %d entries invalidated by another process',
+                     self.__class__.__name__, doomed)
+
+    def _revalidate(self, k, thunk, label):
+        '''Refresh a stale answer in the background.
+
+        >>> ts = rtconfig.MockClock()
+        >>> logged = rtconfig._printLogs()
+
+        A :class:`CachePolicy` can give answers with a given label a grace
+        period past their time-to-live. During the grace period, the stale
+        answer is returned at once while a background worker refreshes it:
+
+        >>> versions = iter(['v1', 'v2', 'v3'])
+        >>> def sponsor():
+        ...     return timedelta(seconds=10), next(versions)
+        >>> policy = CachePolicy(
+        ...     stale_grace={'Sponsorship': timedelta(minutes=1)},
+        ...     spawn=lambda work: work())  # no threads in tests
+        >>> sc = Cache(ts.now, policy=policy)
+        >>> sc._query('bill', sponsor, 'Sponsorship')
+        'v1'
+        >>> ts.wait(15)
+        >>> sc._query('bill', sponsor, 'Sponsorship')
+        'v1'
+        >>> print(logged())
+        ... # doctest: +NORMALIZE_WHITESPACE
+        INFO:cache_remote:Cache@1 cache initialized
+        INFO:cache_remote:Sponsorship query for bill
+        INFO:cache_remote:... cached until 2011-09-02 00:00:10.500000
+        INFO:cache_remote:Sponsorship answer for bill is stale;
+          refreshing in the background
+        INFO:cache_remote:Sponsorship query for bill
+        INFO:cache_remote:... cached until 2011-09-02 00:00:26.500000
+        >>> sc._query('bill', sponsor, 'Sponsorship')
+        'v2'
+
+        Only past the hard deadline does a request wait for the remote query:
+
+        >>> ts.wait(120)
+        >>> sc._query('bill', sponsor, 'Sponsorship')
+        'v3'
+        >>> print(logged())
+        INFO:cache_remote:Sponsorship query for bill
+        INFO:cache_remote:... cached until 2011-09-02 00:02:27.500000
+        '''
+        flight = self._inflight[k] = _Flight()
+        log.info('%s answer for %s is stale; refreshing in the background',
+                 label, k)
+
+        def refresh():
+            try:
+                self._fetch(k, thunk, label, flight, self.__now())
+            except Exception:
+                log.warn('%s refresh for %s failed; keeping stale answer',
+                         label, k)
+                log.debug('refresh error detail', exc_info=True)
+
+        self._policy.spawn(refresh)
+
+    def _put(self, k, expire, v, label=None, hard=None):
+        if hard is None:
+            grace = self._policy.grace(label)
+            hard = expire + grace if grace else expire
+            if self.keep_stale is not None:
+                hard = max(hard, expire + self.keep_stale)
+        seq = next(self._seq)
+        self._cache.pop(k, None)
+        self._cache[k] = (expire, seq, v, hard, label)
+        heapq.heappush(self._expiry, (hard, seq, k))
+
+        while len(self._cache) > self.max_entries:
+            evicted = self._cache.popitem(last=False)[1]
+            self._policy.stats.count(evicted[4], 'evictions')
+
+        # Replaced and evicted entries leave stale items in the heap.
+        if len(self._expiry) > 2 * len(self._cache) + 16:
+            self._expiry = [(h, s, key)
+                            for (key, (_, s, _, h, _)) in self._cache.items()]
+            heapq.heapify(self._expiry)
+        return hard
+
     def _prune(self, tnow):
-        for k, (t, _) in self._cache.items():
-            if t <= tnow:
+        heap = self._expiry
+        while heap and heap[0][0] <= tnow:
+            _, seq, k = heapq.heappop(heap)
+            entry = self._cache.get(k)
+            if entry is not None and entry[1] == seq:
                 del self._cache[k]
+                self._policy.stats.count(entry[4], 'expirations')
+
+
+def _normal(x):
+    '''Spell strings in keys the same way, whether str or unicode.
+
+    >>> _normal((u'SAA', (u'bill@example', 1)))
+    ('SAA', ('bill@example', 1))
+    '''
+    if isinstance(x, unicode):
+        return x.encode('utf-8')
+    if isinstance(x, tuple):
+        return tuple(_normal(item) for item in x)
+    return x
+
+
+class _Bulk(object):
+    '''A bulk query in progress; see :meth:`Cache._fill`.
+    '''
+    def __init__(self, generation, started):
+        self.generation = generation
+        self.started = started
+
+
+class _Flight(object):
+    '''A remote query in progress, awaited by any number of threads.
+    '''
+    def __init__(self):
+        self._done = Event()
+        self._value = None
+        self._error = None
+        self.invalidated = False
+
+    def land(self, value):
+        self._value = value
+        self._done.set()
+
+    def fail(self, error):
+        self._error = error
+        self._done.set()
+
+    def wait(self):
+        self._done.wait()
+        if self._error is not None:
+            raise self._error
+        return self._value
+
+
+class RunTime(rtconfig.IniModule):  # pragma: nocover
+    @singleton
+    @provides(CachePolicy)
+    def policy(self):
+        try:
+            rt = self.get_options(OPTIONS, CONFIG_SECTION)
+        except NoSectionError:
+            log.info('no [%s] section; using default cache policy',
+                     CONFIG_SECTION)
+            return CachePolicy()
+        backend = rt.backend or 'memory'
+        if backend == 'sqlite':
+            store = SQLiteStore.at(rt.sqlite_path)
+        elif backend == 'memory':
+            store = None
+        else:
+            raise ValueError('unknown cache backend: %s' % backend)
+        log.info('cache backend: %s', backend)
+        policy = CachePolicy.from_options(rt, store=store)
+        if rt.snapshot_path:
+            _keep_snapshots(policy, rt.snapshot_path,
+                            timedelta(seconds=int(rt.snapshot_interval or
+                                                  300)),
+                            timedelta(seconds=int(rt.snapshot_max_age or
+                                                  3600)))
+        return policy
+
+
+def _keep_snapshots(policy, path, interval, max_age):  # pragma: nocover
+    '''Load a snapshot at startup; save one periodically and at exit.
+    '''
+    from atexit import register
+    from datetime import datetime
+    from io import open as io_open
+    from os import rename
+    from os.path import exists
+
+    if exists(path):
+        try:
+            with io_open(path, 'rb') as inp:
+                qty = policy.load_snapshot(inp, datetime.now(), max_age)
+            log.info('loaded %d cache entries from %s', qty, path)
+        except Exception:
+            log.warn('cannot load cache snapshot %s', path)
+            log.debug('snapshot error detail', exc_info=True)
+
+    def save():
+        try:
+            with io_open(path + '.tmp', 'wb') as out:
+                qty = policy.save_snapshot(out, datetime.now())
+            rename(path + '.tmp', path)
+            log.info('saved %d cache entries to %s', qty, path)
+        except Exception:
+            log.warn('cannot save cache snapshot %s', path)
+            log.debug('snapshot error detail', exc_info=True)
+
+    def keep_saving():
+        time.sleep(interval.total_seconds())
+        periodic.every(time.sleep, interval.total_seconds(), save,
+                       'cache snapshot')
+
+    periodic.start('cache-snapshot', keep_saving)
+    register(save)
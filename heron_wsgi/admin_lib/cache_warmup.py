@@ -0,0 +1,111 @@
+'''cache_warmup -- preload caches for users likely to log in
+------------------------------------------------------------
+
+After a restart, the first login for each user pays for LDAP and
+REDCap queries. A :class:`CacheWarmer` fills the caches ahead of time
+for recent i2b2 users, most active first::
+
+  >>> from collections import namedtuple
+  >>> Session = namedtuple('Session', 'full_name user_id entry_date')
+  >>> Volume = namedtuple('Volume', 'user_id two_weeks last_month all_time')
+  >>> class MockUsage(object):
+  ...     def current_sessions(self):
+  ...         return [Session('Bill Student', 'bill.student', None)]
+  ...     def query_volume(self):
+  ...         return [Volume('big.wig', None, 1, 100),
+  ...                 Volume('john.smith', 5, 10, 20),
+  ...                 Volume('bill.student', 1, 2, 2),
+  ...                 Volume('ex.employee', None, None, 3)]
+
+  >>> hr, = heron_policy.Mock.make([heron_policy.HeronRecords])
+  >>> warmer = CacheWarmer(MockUsage(), hr)
+  >>> warmer.likely_users()
+  ['bill.student', 'john.smith', 'big.wig', 'ex.employee']
+
+Lookups are spaced out so as not to swamp LDAP::
+
+  >>> import rtconfig
+  >>> naps = []
+  >>> logged = rtconfig._printLogs()
+  >>> warmer.run(naps.append, rate=4, progress_every=2)
+  4
+  >>> naps
+  [0.25, 0.25, 0.25, 0.25]
+  >>> print('\\n'.join(line for line in logged().split('\\n')
+  ...                 if 'cache_warmup' in line))
+  INFO:cache_warmup:cache warm-up: 4 likely users
+  INFO:cache_warmup:cache warm-up: 2 of 4 users (0 not found)
+  INFO:cache_warmup:cache warm-up: 4 of 4 users (1 not found)
+  INFO:cache_warmup:cache warm-up done: 3 users warmed, 0 failed
+
+The warm-up runs in the background; a failure for one user is
+logged and does not stop it.
+
+'''
+
+import logging
+
+from injector import inject
+
+from audit_usage import I2B2AggregateUsage
+import heron_policy
+
+log = logging.getLogger(__name__)
+
+
+class CacheWarmer(object):
+    @inject(usage=I2B2AggregateUsage,
+            hr=heron_policy.HeronRecords)
+    def __init__(self, usage, hr):
+        self._usage = usage
+        self._hr = hr
+
+    def __repr__(self):
+        return '%s()' % self.__class__.__name__
+
+    def likely_users(self, max_users=200):
+        '''Users with current sessions, then by recent query volume.
+        '''
+        volume = sorted(self._usage.query_volume(),
+                        key=lambda r: (r.two_weeks or 0, r.last_month or 0,
+                                       r.all_time or 0),
+                        reverse=True)
+        uids = []
+        for r in list(self._usage.current_sessions()) + volume:
+            if r.user_id not in uids:
+                uids.append(r.user_id)
+        return uids[:max_users]
+
+    def run(self, sleep, rate=2.0, max_users=200, progress_every=25):
+        '''Warm the caches for likely users.
+
+        :param sleep: access to pause between users
+        :param rate: users per second
+        :return: number of users attempted
+        '''
+        try:
+            uids = self.likely_users(max_users)
+        except Exception:
+            log.warn('cache warm-up: cannot get recent users')
+            log.debug('warm-up error detail', exc_info=True)
+            return 0
+
+        log.info('cache warm-up: %d likely users', len(uids))
+        pause = 1.0 / rate
+        missing = failed = 0
+        for ix, uid in enumerate(uids, 1):
+            try:
+                self._hr.warm_cache(uid)
+            except KeyError:
+                missing += 1
+            except Exception:
+                failed += 1
+                log.warn('cache warm-up failed for %s', uid)
+                log.debug('warm-up error detail', exc_info=True)
+            sleep(pause)
+            if ix % progress_every == 0 or ix == len(uids):
+                log.info('cache warm-up: %d of %d users (%d not found)',
+                         ix, len(uids), missing)
+        log.info('cache warm-up done: %d users warmed, %d failed',
+                 len(uids) - missing - failed, failed)
+        return len(uids)
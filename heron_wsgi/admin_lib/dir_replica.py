@@ -0,0 +1,209 @@
+'''dir_replica -- local, indexed copy of the people directory
+-------------------------------------------------------------
+
+Team builders search the directory by name prefix as they type. A
+:class:`DirectoryReplica` keeps a copy of the people OU in memory,
+indexed by sorted prefix arrays over cn, sn and givenname, so such
+searches need not go to LDAP::
+
+  >>> import rtconfig, ldaplib
+  >>> records = [dict(r, modifyTimestamp='20110801000000Z')
+  ...            for r in ldaplib.MockDirectory.records]
+  >>> records[-1]['modifyTimestamp'] = '20110815000000Z'
+  >>> clock = rtconfig.MockClock()
+  >>> svc = ldaplib.LDAPService(clock.now, ttl=60,
+  ...                           rt=ldaplib._sample_settings,
+  ...                           ldap=ldaplib.MockLDAP(records),
+  ...                           flags=ldaplib.MockLDAP)
+  >>> replica = DirectoryReplica(clock.now, svc,
+  ...                            ['cn', 'sn', 'givenname', 'mail'],
+  ...                            refresh=300, max_age=900)
+
+Until it is loaded, the replica has no answers; callers fall back to
+LDAP::
+
+  >>> replica.search(10, '', 'Stu', '') is None
+  True
+
+  >>> logged = rtconfig._printLogs()
+  >>> replica.refresh()
+  >>> print(logged())
+  INFO:dir_replica:directory replica: loaded 10 entries
+
+  >>> [dn for (dn, _) in replica.search(10, '', 'stu', '')]
+  ['(cn=bill.student)', '(cn=carol.student)', '(cn=jill.student)']
+  >>> [(dn, sorted(attrs.items()))
+  ...  for (dn, attrs) in replica.search(10, '', 'Stu', 'c')]
+  ... # doctest: +NORMALIZE_WHITESPACE
+  [('(cn=carol.student)',
+    [('cn', ['carol.student']), ('givenname', ['Carol']),
+     ('mail', ['carol.student@js.example']), ('sn', ['Student'])])]
+  >>> len(replica.search(2, '', 'stu', ''))
+  2
+  >>> replica.search(10, '**goofy name**', '', '')
+  []
+
+Later refreshes only fetch entries modified since the latest
+`modifyTimestamp` seen::
+
+  >>> records.append(dict(records[1], cn='dan.student', givenname='Dan',
+  ...                     modifyTimestamp='20110902000000Z'))
+  >>> replica.refresh()
+  >>> print(logged())
+  INFO:dir_replica:directory replica: 2 entries changed since 20110815000000Z
+  >>> [dn for (dn, _) in replica.search(10, '', '', 'd')]
+  ['(cn=dan.student)']
+
+Deletions only show up in a full reload; :meth:`DirectoryReplica.run`
+does one every so often.
+
+If refreshes stop succeeding, the replica goes stale and declines to
+answer::
+
+  >>> clock.wait(1000)
+  >>> replica.search(10, '', 'stu', '') is None
+  True
+
+Entries without a `cn` can't be indexed; they're skipped and logged::
+
+  >>> class OddDirectory(object):
+  ...     def search_paged(self, query, attrs, page_size):
+  ...         return [('(ou=printers)', dict(sn=['Printer'])),
+  ...                 ('(cn=pat)', dict(cn=['pat'], sn=['Pat']))]
+  >>> odd = DirectoryReplica(clock.now, OddDirectory(), ['cn', 'sn'])
+  >>> odd.refresh()
+  >>> print(logged())
+  WARNING:dir_replica:directory replica: skipping (ou=printers): no cn
+  INFO:dir_replica:directory replica: loaded 1 entries
+
+'''
+
+from bisect import bisect_left
+from datetime import timedelta
+from itertools import count
+import logging
+
+from periodic import every
+
+log = logging.getLogger(__name__)
+
+INDEXED = ('cn', 'sn', 'givenname')
+
+
+class DirectoryReplica(object):
+    def __init__(self, now, svc, attrs, refresh=None, max_age=None,
+                 page_size=500):
+        '''
+        :param now: access to the current time
+        :param svc: an :class:`ldaplib.LDAPService`
+        :param attrs: attributes to copy
+        :param refresh: seconds between refreshes; None to disable
+        :param max_age: seconds after the last refresh to keep answering
+        '''
+        self._now = now
+        self._svc = svc
+        self._attrs = tuple(attrs) + ('modifyTimestamp',)
+        self._refresh = refresh
+        self._max_age = timedelta(seconds=max_age or 2 * (refresh or 0))
+        self._page_size = page_size
+        self._state = None  # (entries, index, watermark)
+        self._loaded_at = None
+
+    def __repr__(self):
+        return '%s(refresh=%s)' % (self.__class__.__name__, self._refresh)
+
+    @property
+    def enabled(self):
+        return self._refresh is not None
+
+    def refresh(self, full=False):
+        '''Load the whole people OU, or just what changed since last time.
+        '''
+        state = self._state
+        delta = not (full or state is None)
+        if not delta:
+            entries = {}
+            changes = self._svc.search_paged(
+                '(cn=*)', self._attrs, self._page_size)
+            watermark = ''
+        else:
+            entries, _, watermark = state
+            entries = dict(entries)
+            changes = self._svc.search_paged(
+                '(modifyTimestamp>=%s)' % watermark, self._attrs,
+                self._page_size)
+
+        for dn, ldapattrs in changes:
+            watermark = max([watermark] +
+                            ldapattrs.get('modifyTimestamp', [])[:1])
+            cns = ldapattrs.get('cn', [])[:1]
+            if not cns:
+                log.warn('directory replica: skipping %s: no cn', dn)
+                continue
+            [cn] = cns
+            entries[cn] = (dn, ldapattrs)
+
+        self._state = (entries, self._index(entries), watermark)
+        self._loaded_at = self._now()
+        if delta:
+            log.info('directory replica: %d entries changed since %s',
+                     len(changes), state[2])
+        else:
+            log.info('directory replica: loaded %d entries', len(entries))
+
+    @classmethod
+    def _index(cls, entries):
+        return dict((attr, sorted((v.lower(), cn)
+                                  for (cn, (_, ldapattrs)) in entries.items()
+                                  for v in ldapattrs.get(attr, [])))
+                    for attr in INDEXED)
+
+    def search(self, max_qty, cn, sn, givenname):
+        '''Search by name prefixes, a la
+        :meth:`ldaplib.LDAPService.search_name_clues`.
+
+        :return: up to max_qty (dn, attrs) pairs,
+                 or None if the replica is not fresh enough to answer.
+        '''
+        state = self._state
+        if (state is None or
+                self._now() - self._loaded_at > self._max_age):
+            return None
+        entries, index, _ = state
+
+        clues = [(attr, v.lower())
+                 for (attr, v) in zip(INDEXED, (cn, sn, givenname))
+                 if v]
+        if not clues:
+            return []
+
+        (attr, prefix), rest = clues[0], clues[1:]
+        keys = index[attr]
+        found, seen = [], set()
+        ix = bisect_left(keys, (prefix,))
+        while ix < len(keys) and len(found) < max_qty:
+            v, name = keys[ix]
+            if not v.startswith(prefix):
+                break
+            ix += 1
+            if name in seen:
+                continue
+            seen.add(name)
+            dn, ldapattrs = entries[name]
+            if all(any(w.lower().startswith(p)
+                       for w in ldapattrs.get(a, []))
+                   for (a, p) in rest):
+                found.append((dn, ldapattrs))
+        return [(hit_dn, dict((a, vs) for (a, vs) in hit.items()
+                              if a != 'modifyTimestamp'))
+                for (hit_dn, hit) in found]
+
+    def run(self, sleep, full_every=24, cycles=None):
+        '''Refresh periodically; reload in full every `full_every` cycles.
+
+        :param sleep: access to pause between refreshes
+        '''
+        cycle = count()
+        every(sleep, self._refresh,
+              lambda: self.refresh(full=(next(cycle) % full_every == 0)),
+              'directory replica refresh', cycles)
@@ -103,7 +103,7 @@ import xml.etree.ElementTree as ET
 # from pypi
 import injector
 from injector import inject, provides, singleton
-from sqlalchemy import orm
+from sqlalchemy import orm, and_
 from sqlalchemy.engine.base import Connectable
 from sqlalchemy.orm import session, sessionmaker, exc
 import pkg_resources as pkg
@@ -330,8 +330,14 @@ class _MockREDCapAPI2(redcap_api._MockREDCapAPI):
             values = rows[0]
             record = hash(values['user_id'])
             s = self.__smaker()
+            # Like REDCap, overwrite any earlier import of this record.
+            data = redcapdb.redcap_data
+            s.execute(data.delete().where(and_(
+                data.c.project_id == self.project_id,
+                data.c.record == record)))
             add_mock_eav(s, self.project_id, 1,
                          record, values.items())
+            s.commit()
             return StringIO.StringIO('')
         else:
             raise IOError('bad request: bad acknowledgement schema: '
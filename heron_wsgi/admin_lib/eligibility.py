@@ -0,0 +1,256 @@
+'''eligibility -- snapshot of who may use the repository
+-------------------------------------------------------
+
+Whether a user may start i2b2 depends on sponsorship, training,
+the system access agreement and directory status, each from a
+different system. An :class:`EligibilitySnapshot` keeps the answers
+for all known users in a small indexed table, refreshed in the
+background, so a login takes one primary-key read::
+
+  >>> import sqlite3
+  >>> import rtconfig
+  >>> clock = rtconfig.MockClock()
+  >>> snap = EligibilitySnapshot(
+  ...     sqlite3.connect(':memory:', check_same_thread=False),
+  ...     clock.now, refresh=300, max_age=600)
+
+Until a user's status is computed, there's no answer; callers
+check live::
+
+  >>> snap.is_eligible('john.smith') is None
+  True
+
+A refresh computes status for a batch of users at once using
+:meth:`heron_policy.HeronRecords.statuses`::
+
+  >>> import heron_policy
+  >>> hp, = heron_policy.Mock.make([heron_policy.HeronRecords])
+  >>> logged = rtconfig._printLogs()
+  >>> snap.refresh(hp.statuses, ['john.smith', 'bill.student', 'nobody'])
+  2
+  >>> print('\\n'.join(line for line in logged().split('\\n')
+  ...                 if 'eligibility' in line))
+  INFO:eligibility:eligibility snapshot: 1 of 2 users eligible
+
+  >>> snap.is_eligible('john.smith'), snap.is_eligible('bill.student')
+  (True, False)
+
+Along with the answer, we keep the inputs' timestamps::
+
+  >>> snap.row('john.smith')
+  ... # doctest: +NORMALIZE_WHITESPACE
+  Eligibility(user_id=u'john.smith', complete=1,
+              computed=u'2011-09-02 00:00:01.000000',
+              sponsored=None, training_expires=u'2012-01-01',
+              system_access_signed=u'2011-08-26 00:00:00')
+
+Answers go stale after `max_age` seconds, or when training
+expires::
+
+  >>> clock.wait(601)
+  >>> snap.is_eligible('john.smith') is None
+  True
+
+:meth:`EligibilitySnapshot.run` refreshes all known users, such as
+those with i2b2 accounts (:meth:`i2b2pm.I2B2PM.user_ids`), along with
+those already in the table::
+
+  >>> naps = []
+  >>> snap.run(naps.append, hp.statuses, lambda: ['big.wig'], cycles=1)
+  >>> naps
+  [300]
+  >>> snap.known_users()
+  [u'big.wig', u'bill.student', u'john.smith']
+  >>> snap.is_eligible('john.smith')
+  True
+
+The login path trusts a fresh answer that says yes, and skips the
+live check::
+
+  >>> import medcenter
+  >>> hp, mc, snap = heron_policy.Mock.make(
+  ...     [heron_policy.HeronRecords, medcenter.MedCenter,
+  ...      EligibilitySnapshot])
+  >>> snap.refresh(hp.statuses, ['john.smith', 'bill.student'])
+  2
+  >>> checked = []
+  >>> live_status = hp._status
+  >>> hp._status = lambda badge: checked.append(badge.cn) or live_status(
+  ...     badge)
+
+  >>> def start_i2b2(uid):
+  ...     req = medcenter.MockRequest()
+  ...     mc.authenticated(uid, req)
+  ...     hp.grant(req.context, heron_policy.PERM_START_I2B2)
+  >>> start_i2b2('john.smith')
+  >>> checked
+  []
+
+Otherwise, the user gets the live answer, with reasons::
+
+  >>> start_i2b2('bill.student')
+  ... # doctest: +ELLIPSIS
+  Traceback (most recent call last):
+    ...
+  NoPermission: NoPermission(Status(complete=False, ...))
+  >>> checked
+  ['bill.student']
+
+Without a table, the snapshot is disabled and has no answers::
+
+  >>> off = EligibilitySnapshot(None, clock.now)
+  >>> off.enabled, off.is_eligible('john.smith')
+  (False, None)
+
+'''
+
+from collections import namedtuple
+from datetime import timedelta
+from threading import Lock
+import logging
+
+from cache_remote import connect_local
+from periodic import every
+
+log = logging.getLogger(__name__)
+
+CONFIG_SECTION = 'eligibility'
+OPTIONS = ('sqlite_path', 'refresh', 'max_age', 'batch')
+
+Eligibility = namedtuple('Eligibility',
+                         ['user_id', 'complete', 'computed', 'sponsored',
+                          'training_expires', 'system_access_signed'])
+
+
+class EligibilitySnapshot(object):
+    def __init__(self, conn, now, refresh=None, max_age=None, batch=200):
+        '''
+        :param conn: sqlite3 connection, as from
+                     :func:`cache_remote.connect_local`; None to disable
+        :param now: access to the current time
+        :param refresh: seconds between refreshes
+        :param max_age: seconds to trust an answer
+        :param batch: users per call to `statuses`
+        '''
+        self._conn = conn
+        self._now = now
+        self._refresh = refresh
+        self._max_age = timedelta(seconds=max_age or 2 * (refresh or 0))
+        self._batch = batch
+        self._lock = Lock()
+        if conn is None:
+            return
+        with self._lock:
+            conn.execute('create table if not exists eligible_user ('
+                         ' user_id text primary key,'
+                         ' complete integer not null,'
+                         ' computed text not null,'
+                         ' sponsored integer,'
+                         ' training_expires text,'
+                         ' system_access_signed text)')
+            conn.execute('create index if not exists eligible_user_computed'
+                         ' on eligible_user (computed)')
+            conn.commit()
+
+    def __repr__(self):
+        return '%s(refresh=%s)' % (self.__class__.__name__, self._refresh)
+
+    @property
+    def enabled(self):
+        return self._conn is not None
+
+    @classmethod
+    def from_options(cls, rt, now):  # pragma: nocover
+        conn = connect_local(rt.sqlite_path) if rt.sqlite_path else None
+        return cls(conn, now,
+                   refresh=int(rt.refresh or 300),
+                   max_age=int(rt.max_age) if rt.max_age else None,
+                   batch=int(rt.batch or 200))
+
+    @classmethod
+    def _t(cls, t):
+        return t.strftime('%Y-%m-%d %H:%M:%S.%f')
+
+    def row(self, uid):
+        '''Get the stored answer for `uid`, fresh or not.
+
+        :return: an :class:`Eligibility` or None
+        '''
+        if self._conn is None:
+            return None
+        with self._lock:
+            found = self._conn.execute(
+                'select %s from eligible_user where user_id = ?' %
+                ', '.join(Eligibility._fields), (uid,)).fetchone()
+        return None if found is None else Eligibility(*found)
+
+    def is_eligible(self, uid):
+        '''Is `uid` eligible to use the repository, as of the last refresh?
+
+        :return: True or False; None if the answer is missing or stale
+        '''
+        e = self.row(uid)
+        tnow = self._now()
+        if (e is None or e.computed <= self._t(tnow - self._max_age) or
+                (e.complete and e.training_expires and
+                 e.training_expires < str(tnow.date()))):
+            return None
+        return bool(e.complete)
+
+    def known_users(self):
+        if self._conn is None:
+            return []
+        with self._lock:
+            return [uid for (uid, ) in self._conn.execute(
+                'select user_id from eligible_user order by user_id')]
+
+    def refresh(self, statuses, uids):
+        '''Recompute eligibility of `uids`.
+
+        :param statuses: access to status of many users, a la
+                         :meth:`heron_policy.HeronRecords.statuses`
+        :return: number of users found
+        '''
+        qty = eligible = 0
+        for start in range(0, len(uids), self._batch):
+            batch = uids[start:start + self._batch]
+            found = statuses(batch)
+            computed = self._t(self._now())
+            rows = [(uid, int(bool(st.complete)), computed,
+                     None if st.sponsored is None else int(st.sponsored),
+                     _training_expires(st),
+                     max([str(t) for t in st.system_access_signed or []] or
+                         [None]))
+                    for (uid, st) in found.items()]
+            gone = [(uid,) for uid in batch if uid not in found]
+            with self._lock:
+                self._conn.executemany(
+                    'insert or replace into eligible_user (%s)'
+                    ' values (?, ?, ?, ?, ?, ?)' %
+                    ', '.join(Eligibility._fields), rows)
+                self._conn.executemany(
+                    'delete from eligible_user where user_id = ?', gone)
+                self._conn.commit()
+            qty += len(rows)
+            eligible += sum(row[1] for row in rows)
+        log.info('eligibility snapshot: %d of %d users eligible',
+                 eligible, qty)
+        return qty
+
+    def run(self, sleep, statuses, users, cycles=None):
+        '''Refresh periodically.
+
+        :param sleep: access to pause between refreshes
+        :param users: access to all known users
+        '''
+        def refresh_all():
+            self.refresh(statuses,
+                         sorted(set(users()) | set(self.known_users())))
+
+        every(sleep, self._refresh, refresh_all,
+              'eligibility snapshot refresh', cycles)
+
+
+def _training_expires(st):
+    training = st.current_training or st.expired_training
+    return str(training.expired)[:10] if training else None
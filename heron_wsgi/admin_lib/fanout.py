@@ -0,0 +1,230 @@
+'''fanout -- run independent remote lookups concurrently
+-------------------------------------------------------
+
+Checking a user's status takes several lookups (REDCap, LDAP, the
+training DB, ...) that don't depend on each other. A :class:`FanOut`
+runs them on a bounded pool of worker threads, so the caller waits
+for the slowest rather than for the sum::
+
+  >>> from threading import Event
+  >>> first_done = Event()
+  >>> def first():
+  ...     first_done.set()
+  ...     return 1
+  >>> def second():
+  ...     first_done.wait(5)  # only finishes if first() runs concurrently
+  ...     return 2
+
+  >>> pool = FanOut(workers=2, timeout=10)
+  >>> pool.run([second, first])
+  [2, 1]
+
+Errors are raised in the caller, as if the lookups ran one after another::
+
+  >>> def broken():
+  ...     raise IOError('no route to host')
+  >>> pool.run([first, broken])
+  Traceback (most recent call last):
+    ...
+  IOError: no route to host
+
+A lookup that takes longer than `timeout` seconds fails with
+:exc:`LookupTimeout`, a kind of :exc:`IOError`::
+
+  >>> slow = FanOut(workers=1, timeout=0.05)
+  >>> never = Event()
+  >>> slow.run([lambda: never.wait(5)])
+  Traceback (most recent call last):
+    ...
+  LookupTimeout: lookup 1 of 1 timed out
+
+Or, if there's a sensible answer to use in that case::
+
+  >>> slow = FanOut(workers=2, timeout=0.05)
+  >>> slow.run([first, lambda: never.wait(5)], fallbacks={1: 'dunno'})
+  [1, 'dunno']
+
+Each lookup gets `timeout` seconds from when it is submitted, so
+a call waits at most `timeout` seconds in all.
+
+A lookup that has timed out may still be running, holding its worker.
+When no worker is free, lookups run in the calling thread, as they
+did before we had a pool, rather than waiting in line::
+
+  >>> stuck = Event()
+  >>> busy = FanOut(workers=2, timeout=0.05)
+  >>> busy.run([lambda: stuck.wait(5)] * 2, fallbacks={0: 'late', 1: 'late'})
+  ['late', 'late']
+  >>> busy.run([lambda: 'a', lambda: 'b'])
+  ['a', 'b']
+  >>> stuck.set()
+
+So a pool saturated by many concurrent requests makes pages slower,
+but doesn't make lookups time out::
+
+  >>> from threading import Thread
+  >>> busy = FanOut(workers=2, timeout=0.1)
+  >>> errors = []
+  >>> def request():
+  ...     try:
+  ...         busy.run([lambda: time.sleep(0.005)] * 4)
+  ...     except Exception as oops:
+  ...         errors.append(oops)
+  >>> requests = [Thread(target=request) for _ in range(20)]
+  >>> for t in requests:
+  ...     t.start()
+  >>> for t in requests:
+  ...     t.join()
+  >>> errors
+  []
+
+With no workers, lookups run one after another in the calling thread::
+
+  >>> FanOut().run([lambda: 'a', lambda: 'b'])
+  ['a', 'b']
+  >>> never.set()
+
+'''
+
+from Queue import Queue
+from threading import Event, Lock, Thread
+import logging
+import time
+
+import timing
+
+log = logging.getLogger(__name__)
+
+CONFIG_SECTION = 'status_checks'
+OPTIONS = ('workers', 'timeout')
+
+
+class LookupTimeout(IOError):
+    pass
+
+
+class FanOut(object):
+    def __init__(self, workers=0, timeout=None):
+        '''
+        :param workers: size of the thread pool; 0 to run lookups
+                        in the calling thread
+        :param timeout: seconds to wait for each lookup, or None
+        '''
+        self.workers = workers
+        self.timeout = timeout
+        self._jobs = Queue()
+        self._started = False
+        self._lock = Lock()
+        self._free = 0  # workers neither busy nor promised a job
+
+    def __repr__(self):
+        return '%s(workers=%s, timeout=%s)' % (
+            self.__class__.__name__, self.workers, self.timeout)
+
+    @classmethod
+    def from_options(cls, rt):
+        return cls(workers=int(rt.workers or 0),
+                   timeout=float(rt.timeout) if rt.timeout else None)
+
+    def run(self, thunks, fallbacks={}):
+        '''Call each of `thunks`; return their results in order.
+
+        :param fallbacks: results to use, by index, for lookups
+                          that time out
+        '''
+        if not self.workers:
+            return [thunk() for thunk in thunks]
+
+        self._start()
+        timer = timing.current()
+        deadline = (time.time() + self.timeout
+                    if self.timeout is not None else None)
+        pending, inline = [], []
+        for thunk in thunks:
+            p = _Pending()
+            if self._reserve():
+                self._jobs.put((thunk, timer, deadline, p))
+            else:
+                inline.append((thunk, p))
+            pending.append(p)
+        for thunk, p in inline:
+            p.call(thunk)
+
+        results = []
+        for ix, p in enumerate(pending):
+            try:
+                results.append(p.wait(deadline, ix + 1, len(pending)))
+            except LookupTimeout as oops:
+                if ix not in fallbacks:
+                    raise
+                log.warn('%s; using %s', oops, fallbacks[ix])
+                results.append(fallbacks[ix])
+        return results
+
+    def _start(self):
+        with self._lock:
+            if self._started:
+                return
+            for ix in range(self.workers):
+                t = Thread(target=self._work, name='fanout-%d' % ix)
+                t.daemon = True
+                t.start()
+            self._free = self.workers
+            self._started = True
+
+    def _reserve(self):
+        '''Promise a job to a free worker, if there is one.
+        '''
+        with self._lock:
+            if self._free <= 0:
+                return False
+            self._free -= 1
+            return True
+
+    def _work(self):
+        while True:
+            thunk, timer, deadline, p = self._jobs.get()
+            try:
+                if deadline is not None and time.time() >= deadline:
+                    # The caller has given up on this one.
+                    p.fail(LookupTimeout('lookup dropped after deadline'))
+                    continue
+                # Charge the lookup to the request that asked for it.
+                before = timing.adopt(timer)
+                try:
+                    p.call(thunk)
+                finally:
+                    timing.adopt(before)
+            finally:
+                with self._lock:
+                    self._free += 1
+
+
+class _Pending(object):
+    def __init__(self):
+        self._done = Event()
+        self._value = None
+        self._error = None
+
+    def call(self, thunk):
+        try:
+            self.land(thunk())
+        except Exception as ex:
+            self.fail(ex)
+
+    def land(self, value):
+        self._value = value
+        self._done.set()
+
+    def fail(self, error):
+        self._error = error
+        self._done.set()
+
+    def wait(self, deadline, ix, qty):
+        timeout = (None if deadline is None
+                   else max(0, deadline - time.time()))
+        if not self._done.wait(timeout):
+            raise LookupTimeout('lookup %d of %d timed out' % (ix, qty))
+        if self._error is not None:
+            raise self._error
+        return self._value
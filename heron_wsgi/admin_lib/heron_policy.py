@@ -41,7 +41,7 @@ investigator requests::
   >>> print(logged())
   ... # doctest: +NORMALIZE_WHITESPACE +ELLIPSIS
   INFO:cache_remote:LDAP query for ('(cn=john.smith)', ...
-  INFO:cache_remote:system access query for ('SAA', 'john.smith@js.example')
+  INFO:cache_remote:system access query for ('SAA', ('john.smith@js.example',))
   INFO:cache_remote:... cached until 2011-09-02 00:00:15.500000
   INFO:cache_remote:in DROC? query for john.smith
   INFO:cache_remote:... cached until 2011-09-02 00:01:00.500000
@@ -134,8 +134,9 @@ faculty not sponsored, nor has he completed human subjects training::
   INFO:heron_policy:not sponsored: bill.student
   INFO:cache_remote:... cached until 2011-09-02 00:00:03.500000
   INFO:heron_policy:no training on file for: bill.student (Bill Student)
-  INFO:cache_remote:system access query for ('SAA', 'bill.student@js.example')
-  INFO:cache_remote:... cached until 2011-09-02 00:00:18
+  INFO:cache_remote:system access query for
+    ('SAA', ('bill.student@js.example',))
+  INFO:cache_remote:... cached until 2011-09-02 00:00:04
   INFO:cache_remote:in DROC? query for bill.student
   INFO:cache_remote:... cached until 2011-09-02 00:01:01.500000
   >>> stureq.context.status  #doctest: +NORMALIZE_WHITESPACE
@@ -204,8 +205,9 @@ This student's sponsor is not with KUMC anymore
   WARNING:heron_policy:Sponsor prof.fickle not at med center anymore.
   INFO:heron_policy:not sponsored: jill.student
   INFO:cache_remote:... cached until 2011-09-02 00:00:07.500000
-  INFO:cache_remote:system access query for ('SAA', 'jill.student@js.example')
-  INFO:cache_remote:... cached until 2011-09-02 00:00:22
+  INFO:cache_remote:system access query for
+    ('SAA', ('jill.student@js.example',))
+  INFO:cache_remote:... cached until 2011-09-02 00:00:08
   INFO:cache_remote:in DROC? query for jill.student
   INFO:cache_remote:... cached until 2011-09-02 00:01:03.500000
 
@@ -218,8 +220,9 @@ Ensure things don't go wonky in case of missing email address
        'kumcPersonFaculty', 'kumcPersonJobcode', 'mail', 'ou', 'sn', 'title'))
     INFO:cache_remote:... cached until 2011-09-02 00:00:08.500000
     WARNING:medcenter:missing LDAP attribute mail for todd.ryan
-    INFO:cache_remote:system access query for ('SAA', 'todd.ryan@js.example')
-    INFO:cache_remote:... cached until 2011-09-02 00:00:22.500000
+    INFO:cache_remote:system access query for
+      ('SAA', ('todd.ryan@js.example',))
+    INFO:cache_remote:... cached until 2011-09-02 00:00:08.500000
     INFO:cache_remote:in DROC? query for todd.ryan
     INFO:cache_remote:... cached until 2011-09-02 00:01:04
 
@@ -245,7 +248,7 @@ Executives don't need sponsorship::
   INFO:cache_remote:LDAP query for ('(cn=big.wig)', ('cn', 'givenname',
        'kumcPersonFaculty', 'kumcPersonJobcode', 'mail', 'ou', 'sn', 'title'))
   INFO:cache_remote:... cached until 2011-09-02 00:00:09
-  INFO:cache_remote:system access query for ('SAA', 'big.wig@js.example')
+  INFO:cache_remote:system access query for ('SAA', ('big.wig@js.example',))
   INFO:cache_remote:... cached until 2011-09-02 00:00:23
   INFO:cache_remote:in DROC? query for big.wig
   INFO:cache_remote:... cached until 2011-09-02 00:01:04.500000
@@ -340,6 +343,7 @@ Email addresses are not limited to correspond to user ids:
 '''
 
 from __future__ import print_function
+from ConfigParser import NoSectionError
 from datetime import timedelta
 import itertools
 import logging
@@ -361,7 +365,11 @@ import noticelog
 from noticelog import OVERSIGHT_CONFIG_SECTION
 import disclaimer
 from audit_usage import I2B2AggregateUsage, I2B2SensitiveUsage
-from cache_remote import Cache
+from cache_remote import Cache, CachePolicy
+import fanout
+from fanout import FanOut
+import eligibility
+from eligibility import EligibilitySnapshot
 
 SAA_CONFIG_SECTION = 'saa_survey'
 DUA_CONFIG_SECTION = 'dua_survey'
@@ -387,10 +395,11 @@ class OversightCommittee(Token, Cache):
             mc=medcenter.MedCenter,
             timesrc=rtconfig.Clock,
             auditor=I2B2SensitiveUsage,
-            dr=noticelog.DecisionRecords)
+            dr=noticelog.DecisionRecords,
+            policy=CachePolicy)
     def __init__(self, redcap_sessionmaker, oversight_rc, mc,
-                 timesrc, auditor, dr):
-        Cache.__init__(self, timesrc.now)
+                 timesrc, auditor, dr, policy):
+        Cache.__init__(self, timesrc.now, policy=policy)
         self.__rcsm = redcap_sessionmaker
         self.project_id = oversight_rc.project_id
         self.__mc = mc
@@ -407,11 +416,21 @@ class OversightCommittee(Token, Cache):
         FROM redcap_user_rights
         WHERE redcap_user_rights.project_id = :project_id_1
         AND redcap_user_rights.username = :username_1
+
+        Given a list of users, match any of them:
+
+        >>> print(OversightCommittee._memberq(238, ['big.wig', 'john.smith']))
+        ... #doctest: +NORMALIZE_WHITESPACE
+        SELECT redcap_user_rights.project_id, redcap_user_rights.username
+        FROM redcap_user_rights
+        WHERE redcap_user_rights.project_id = :project_id_1
+        AND redcap_user_rights.username IN (:username_1, :username_2)
         '''
         t = redcapdb.redcap_user_rights
         return t.select().\
             where(t.c.project_id == pid).\
-            where(t.c.username == who)
+            where(t.c.username.in_(who) if isinstance(who, list)
+                  else t.c.username == who)
 
     def _droc_auditor(self, alleged_badge,
                       ttl=timedelta(seconds=60)):
@@ -430,6 +449,41 @@ class OversightCommittee(Token, Cache):
 
         return (self.__auditor, self.__dr)
 
+    def _droc_members(self, cns,
+                      ttl=timedelta(seconds=60)):
+        '''Find which of `cns` are DROC members using one query
+        for those not already cached.
+
+        :return: set of cns
+
+        Names are matched ignoring case:
+
+        >>> oc, = Mock.make([OversightCommittee])
+        >>> sorted(oc._droc_members(['Big.Wig', 'john.smith']))
+        ['Big.Wig']
+        '''
+        found, todo = {}, []
+        for cn in cns:
+            try:
+                found[cn] = self._cached(cn, 'in DROC?')
+            except KeyError:
+                todo.append(cn)
+
+        if todo:
+            log.info('in DROC? query for %d of %d users',
+                     len(todo), len(found) + len(todo))
+            s = self.__rcsm()
+            bulk = self._bulk()
+            # Compare the bare (indexed) column; match case in Python.
+            asked = sorted(set(todo) | set(cn.lower() for cn in todo))
+            members = set(row.username.lower() for row in
+                          s.execute(self._memberq(self.project_id, asked)))
+            answers = [(cn, cn.lower() in members) for cn in todo]
+            self._fill(answers, ttl, 'in DROC?', bulk)
+            found.update(answers)
+
+        return set(cn for (cn, in_droc) in found.items() if in_droc)
+
 
 Status = namedtuple('Status',
                     sorted(dict(faculty=0, executive=0, sponsored=0,
@@ -439,6 +493,7 @@ Status = namedtuple('Status',
                                 system_access_signed=0).keys()))
 
 
+@singleton
 class HeronRecords(Token, Cache):
     '''In the oversight_project, userid of sponsored users are stored in
     REDCap fields with names like ... ::
@@ -483,16 +538,23 @@ class HeronRecords(Token, Cache):
             oversight_rc=(redcap_connect.SurveySetup,
                           OVERSIGHT_CONFIG_SECTION),
             oc=OversightCommittee,
+            browser=medcenter.Browser,
             dg=disclaimer.DisclaimerGuard,
             smaker=(orm.session.Session,
                     redcapdb.CONFIG_SECTION),
-            timesrc=rtconfig.Clock)
+            timesrc=rtconfig.Clock,
+            policy=CachePolicy,
+            lookups=FanOut,
+            eligible=EligibilitySnapshot)
     def __init__(self, mc, pm, dr, stats, saa_rc, dua_rc, oversight_rc, oc,
-                 dg, smaker, timesrc):
-        Cache.__init__(self, timesrc.now)
+                 browser, dg, smaker, timesrc, policy, lookups, eligible):
+        Cache.__init__(self, timesrc.now, policy=policy)
         log.debug('HeronRecords.__init__ again?')
+        self._lookups = lookups
+        self._eligible = eligible
         self._smaker = smaker
         self._mc = mc
+        self._browser = browser
         self._pm = pm
         self.__dr = dr
         self.__stats = stats
@@ -522,7 +584,7 @@ class HeronRecords(Token, Cache):
         context.badge = badge
 
         if p is PERM_STATUS:
-            context.status = self._status(badge)
+            context.status = self._request_status(context, badge)
         elif p is PERM_SIGN_SAA:
             context.sign_saa = Affiliate(badge, self._query,
                                          saa_rc=self._saa_rc)
@@ -537,39 +599,104 @@ class HeronRecords(Token, Cache):
             context.decision_records = dr
         elif p is PERM_STATS_REPORTER:
             context.stats_reporter = self.__stats
-            context.browser = self._mc._browser
+            context.browser = self._browser
         elif p is PERM_START_I2B2:
-            st = self._status(badge)
-            if not st.complete:
-                raise NoPermission(st)
+            # Trust a fresh snapshot that says yes; otherwise check
+            # live, which also tells the user why not.
+            if not self._eligible.is_eligible(badge.cn):
+                st = self._request_status(context, badge)
+                if not st.complete:
+                    raise NoPermission(st)
             context.start_i2b2 = lambda: self.__redeem(badge)
             context.disclaimers = self.__dg
         else:
             raise TypeError
 
-    def _status(self, badge):
-        sponsored = (None if badge.is_investigator()
-                     else
-                     (self._sponsorship(badge.cn) is not None))
+    def _request_status(self, context, badge):
+        '''Compute status at most once per context, i.e. per request.
 
-        current_training, expired_training = self._training_current(badge)
+        >>> hp, mc = Mock.make((HeronRecords, medcenter.MedCenter))
+        >>> computed = []
+        >>> hp._status = lambda badge: computed.append(badge) or 'st'
 
-        # redcap_connect uses the '%s@%s' pattern when recording
-        # signatures, but we have traditionally looked this up
-        # by badge.mail. When those didn't agree, we updated
-        # the database to match badge.mail. So now we need
-        # to check both.
-        cn_at_domain = '%s@%s' % (badge.cn, self._saa_rc.domain)
-        # Cache args have to be hashable
-        mailboxes = frozenset([m for m in [badge.mail, cn_at_domain] if m])
+        >>> req = medcenter.MockRequest()
+        >>> _ = mc.authenticated('john.smith', req)
+        >>> hp.grant(req.context, PERM_STATUS)
+        >>> hp.grant(req.context, PERM_STATUS)
+        >>> computed
+        [John Smith <john.smith@js.example>]
+        '''
+        try:
+            memo_badge, st = context.__status
+        except AttributeError:
+            pass
+        else:
+            if memo_badge is badge:
+                return st
 
-        system_access_sigs = [sig.completion_time
-                              for sig in self._signatures(mailboxes)]
+        st = self._status(badge)
+        context.__status = (badge, st)
+        return st
 
-        try:
-            droc_audit = self.__oc._droc_auditor(badge)
-        except NotDROC:
-            droc_audit = None
+    def _status(self, badge):
+        '''Check sponsorship, training, system access and DROC
+        membership; these independent lookups may run concurrently.
+
+        A lookup that times out is taken to have found nothing, so
+        the user is shown what's missing rather than an error:
+
+        >>> from threading import Event
+        >>> hp, mc = Mock.make((HeronRecords, medcenter.MedCenter))
+        >>> stuck = Event()
+        >>> def hang(*argv):
+        ...     stuck.wait(5)
+        >>> # 3 workers: DROC runs here, near the per-thread mock DB
+        >>> hp._lookups = FanOut(workers=3, timeout=0.05)
+        >>> hp._sponsorship = hp._training_current = hp._signatures = hang
+        >>> req = medcenter.MockRequest()
+        >>> _ = mc.authenticated('bill.student', req)
+        >>> hp.grant(req.context, PERM_STATUS)
+        >>> req.context.status
+        ... # doctest: +NORMALIZE_WHITESPACE
+        Status(complete=False, current_training=None, droc=None,
+               executive=False, expired_training=None, faculty=False,
+               sponsored=False, system_access_signed=[])
+        >>> stuck.set()
+        '''
+        def sponsored():
+            return (None if badge.is_investigator()
+                    else
+                    (self._sponsorship(badge.cn) is not None))
+
+        def training():
+            return self._training_current(badge)
+
+        def signatures():
+            return [sig.completion_time
+                    for sig in self._signatures(self._mailboxes(badge))]
+
+        def droc():
+            try:
+                return self.__oc._droc_auditor(badge)
+            except NotDROC:
+                return None
+
+        # A slow lookup is treated like one that found nothing:
+        # not sponsored, no training, not signed, not in DROC.
+        (sponsored, training,
+         system_access_sigs, droc_audit) = self._lookups.run(
+             [sponsored, training, signatures, droc],
+             fallbacks={0: None if badge.is_investigator() else False,
+                        1: (None, None),
+                        2: [],
+                        3: None})
+
+        return self._decide(badge, sponsored, training,
+                            system_access_sigs, droc_audit)
+
+    def _decide(self, badge, sponsored, training,
+                system_access_sigs, droc_audit):
+        current_training, expired_training = training
 
         # Grace period for training enforcement ends July 1, 2015.
         enforce_training = str(self._t.today()) >= '2015-07-01'
@@ -590,6 +717,133 @@ class HeronRecords(Token, Cache):
                       system_access_signed=system_access_sigs,
                       complete=bool(complete))
 
+    def statuses(self, uids):
+        '''Compute :class:`Status` for many users at once.
+
+        Rather than several lookups per user, this makes one query each
+        for sponsorship, training, system access and DROC membership,
+        plus batched LDAP queries::
+
+        >>> hp, = Mock.make([HeronRecords])
+        >>> logged = rtconfig._printLogs()
+        >>> found = hp.statuses(['john.smith', 'bill.student', 'some.one',
+        ...                      'big.wig', 'nobody'])
+        >>> print(logged())
+        ... # doctest: +NORMALIZE_WHITESPACE +ELLIPSIS
+        INFO:ldaplib:LDAP query for 5 of 5 uncached names: ...
+        INFO:cache_remote:... cached until 2011-09-02 00:00:05
+        WARNING:medcenter:missing LDAP attribute ou for some.one
+        WARNING:medcenter:missing LDAP attribute title for some.one
+        INFO:heron_policy:Sponsorship query for 2 of 2 users
+        INFO:cache_remote:... cached until 2011-09-02 00:10:01.500000
+        INFO:cache_remote:... cached until 2011-09-02 00:00:03
+        INFO:heron_policy:system access query for 4 of 4 users
+        INFO:cache_remote:... cached until 2011-09-02 00:00:19.500000
+        INFO:cache_remote:... cached until 2011-09-02 00:00:06
+        INFO:heron_policy:in DROC? query for 4 of 4 users
+        INFO:cache_remote:... cached until 2011-09-02 00:01:02.500000
+        INFO:heron_policy:no training on file for: bill.student (Bill Student)
+
+        Users not in the directory are left out::
+
+        >>> for uid in sorted(found):
+        ...     st = found[uid]
+        ...     print(uid, st.complete, st.sponsored,
+        ...           bool(st.system_access_signed), bool(st.droc))
+        big.wig True None True True
+        bill.student False False False False
+        john.smith True None True False
+        some.one False True False False
+
+        The answers are the same as one user at a time would get::
+
+        >>> req = medcenter.MockRequest()
+        >>> _ = hp._mc.authenticated('some.one', req)
+        >>> hp.grant(req.context, PERM_STATUS)
+        >>> req.context.status == found['some.one']
+        True
+
+        And since they are cached, that took no further queries
+        but for the short-lived "not signed yet" answer::
+
+        >>> print(logged())
+        ... # doctest: +NORMALIZE_WHITESPACE
+        WARNING:medcenter:missing LDAP attribute ou for some.one
+        WARNING:medcenter:missing LDAP attribute title for some.one
+        INFO:cache_remote:system access query for
+          ('SAA', ('some.one@js.example',))
+        INFO:cache_remote:... cached until 2011-09-02 00:00:07
+
+        :return: dict from uid to :class:`Status`
+        '''
+        badges = self._mc._idbadges(uids)
+        cns = sorted(badges.keys())
+
+        sponsorships = self._sponsorships(
+            [cn for cn in cns if not badges[cn].is_investigator()])
+
+        try:
+            trainings = self._mc.latest_trainings(badges.values())
+        except IOError:
+            log.warn('failed to look up training due to IOError')
+            log.debug('training error detail', exc_info=True)
+            trainings = None
+
+        signatures = self._signatures_by_badge(badges)
+        droc = self.__oc._droc_members(cns)
+
+        return dict(
+            (cn, self._decide(
+                badge,
+                (None if badge.is_investigator()
+                 else sponsorships[cn] is not None),
+                (None, None) if trainings is None
+                else self._training_verdict(badge, trainings.get(cn)),
+                [sig.completion_time for sig in signatures[cn]],
+                self.__oc._droc_auditor(badge) if cn in droc else None))
+            for (cn, badge) in badges.items())
+
+    def warm_cache(self, uid):
+        '''Preload cached answers for a user who is likely to log in.
+
+        :raises: :exc:`KeyError` if `uid` is not in the directory
+
+        >>> hp, = Mock.make([HeronRecords])
+        >>> logged = rtconfig._printLogs()
+        >>> hp.warm_cache('john.smith')
+        >>> print(logged())
+        ... # doctest: +ELLIPSIS
+        INFO:cache_remote:LDAP query for ...
+        INFO:cache_remote:Sponsorship query for ('sponsorship', 'john.smith')
+        ...
+        INFO:cache_remote:system access query for ...
+
+        Later lookups for the same user come from the cache::
+
+        >>> hp.warm_cache('john.smith')
+        >>> 'LDAP query' in logged()
+        False
+        '''
+        badge = self._browser.lookup(uid)
+        self._sponsorship(uid)
+        self._signatures(self._mailboxes(badge))
+
+    def invalidate_sponsorships(self, uids):
+        '''Forget cached sponsorship answers, e.g. after a DROC decision.
+        '''
+        for uid in uids:
+            self.invalidate(('sponsorship', uid))
+
+    def _mailboxes(self, badge):
+        # redcap_connect uses the '%s@%s' pattern when recording
+        # signatures, but we have traditionally looked this up
+        # by badge.mail. When those didn't agree, we updated
+        # the database to match badge.mail. So now we need
+        # to check both.
+        cn_at_domain = '%s@%s' % (badge.cn, self._saa_rc.domain)
+        # Cache args have to be hashable
+        return tuple(sorted(set(m for m in [badge.mail, cn_at_domain] if m)))
+
     def _sponsorship(self, uid,
                      ttl=timedelta(seconds=600)):
         not_sponsored = timedelta(seconds=1), None
@@ -597,7 +851,7 @@ class HeronRecords(Token, Cache):
         def do_q():
             for ans in self.__dr.sponsorships(uid):
                 try:
-                    self._mc._browser.lookup(ans.sponsor)
+                    self._browser.lookup(ans.sponsor)
                 except KeyError:
                     log.warn('Sponsor %s not at med center anymore.',
                              ans.sponsor)
@@ -614,6 +868,69 @@ class HeronRecords(Token, Cache):
             else
             self._query(('sponsorship', uid), do_q, 'Sponsorship'))
 
+    def _sponsorships(self, uids,
+                      ttl=timedelta(seconds=600)):
+        '''Look up sponsorship for many users with one query
+        for those not already cached.
+
+        :return: dict from uid to sponsorship (or None)
+
+        Candidates are matched ignoring case, and the answers are
+        keyed by the uids as given:
+
+        >>> hp, = Mock.make([HeronRecords])
+        >>> found = hp._sponsorships(['Carol.Student', 'nobody.here'])
+        >>> sorted(found.keys())
+        ['Carol.Student', 'nobody.here']
+        >>> found['Carol.Student'].candidate, found['nobody.here']
+        (u'carol.student', None)
+        '''
+        if self._pm.identified_data:
+            return dict((uid, None) for uid in uids)
+
+        found, todo = {}, []
+        for uid in uids:
+            try:
+                found[uid] = self._cached(('sponsorship', uid), 'Sponsorship')
+            except KeyError:
+                todo.append(uid)
+        if not todo:
+            return found
+
+        log.info('Sponsorship query for %d of %d users',
+                 len(todo), len(uids))
+        # Compare the bare (indexed) column; match case in Python.
+        bulk = self._bulk()
+        asked = dict((uid.lower(), uid) for uid in todo)
+        candidates = {}
+        for ans in self.__dr.sponsorships_many(
+                sorted(set(todo) | set(asked))):
+            uid = asked.get(ans.candidate.lower())
+            if uid is not None:
+                candidates.setdefault(uid, []).append(ans)
+        sponsors = self._browser.lookup_many(
+            sorted(set(ans.sponsor for anss in candidates.values()
+                       for ans in anss)))
+
+        answers = dict((uid, None) for uid in todo)
+        for uid, anss in candidates.items():
+            for ans in anss:
+                if ans.sponsor in sponsors:
+                    answers[uid] = ans
+                    break
+                log.warn('Sponsor %s not at med center anymore.',
+                         ans.sponsor)
+
+        self._fill([(('sponsorship', uid), ans)
+                    for (uid, ans) in answers.items() if ans], ttl,
+                   'Sponsorship', bulk)
+        # Keep "not sponsored" just long enough to compute status.
+        self._fill([(('sponsorship', uid), ans)
+                    for (uid, ans) in answers.items() if not ans],
+                   timedelta(seconds=1), 'Sponsorship', bulk)
+        found.update(answers)
+        return found
+
     def _training_current(self, badge):
         try:
             info = self._mc.latest_training(badge)
@@ -622,6 +939,11 @@ class HeronRecords(Token, Cache):
             log.debug('training error detail', exc_info=True)
             return None, None
         except LookupError:
+            info = None
+        return self._training_verdict(badge, info)
+
+    def _training_verdict(self, badge, info):
+        if info is None:
             log.info('no training on file for: %s (%s)',
                      badge.cn, badge.full_name())
             return None, None
@@ -635,25 +957,97 @@ class HeronRecords(Token, Cache):
         return (info, None) if current else (None, info)
 
     def _signatures(self, mailboxes,
-                    ttl=timedelta(seconds=15)):
+                    ttl=timedelta(seconds=15),
+                    unsigned_ttl=timedelta(seconds=1)):
         '''Look up SAA survey response by email address(es).
+
+        We can't tell when a user finishes the survey, so "not signed
+        yet" is kept only long enough to compute status; a user who
+        comes back from signing sees the new answer:
+
+        >>> hp, = Mock.make([HeronRecords])
+        >>> logged = rtconfig._printLogs()
+        >>> hp._signatures(('nobody@js.example',))
+        []
+        >>> print(logged())
+        ... # doctest: +NORMALIZE_WHITESPACE
+        INFO:cache_remote:system access query for
+          ('SAA', ('nobody@js.example',))
+        INFO:cache_remote:... cached until 2011-09-02 00:00:01.500000
+
+        If REDCap can't be reached, we get a known response
+        (see :meth:`redcap_invite.SecureSurvey.responses_many`),
+        with a `completion_time` like any other:
+
+        >>> from sqlalchemy.exc import OperationalError
+        >>> def lose(*argv):
+        ...     raise OperationalError('select...', {}, None)
+        >>> hp, = Mock.make([HeronRecords])
+        >>> hp._saa_rc = redcap_connect.SurveySetup(
+        ...     redcap_connect._test_settings, lose, None, survey_id=11)
+        >>> sigs = hp._signatures(('bob@js.example',))
+        >>> [sig.completion_time for sig in sigs]
+        [datetime.datetime(2017, 1, 25, 8, 55, 10)]
         '''
+        def q():
+            sigs = self._saa_rc.responses_many(mailboxes)
+            return (ttl if sigs else unsigned_ttl), sigs
+
+        return self._query(('SAA', mailboxes), q, 'system access')
+
+    def _signatures_by_badge(self, badges,
+                             ttl=timedelta(seconds=15),
+                             unsigned_ttl=timedelta(seconds=1)):
+        '''Look up SAA survey responses for many users with one query
+        for those not already cached.
 
-        def mkq(mail):
-            def q():
-                return ttl, self._saa_rc.responses(mail)
-            return q
+        :param badges: dict from uid to badge
+        :return: dict from uid to responses
 
-        return [row
-                for mail in mailboxes
-                for row in
-                self._query(('SAA', mail), mkq(mail), 'system access')]
+        Addresses match regardless of case:
+
+        >>> hp, = Mock.make([HeronRecords])
+        >>> class Badge(object):
+        ...     cn, mail = 'Big.Wig', 'Big.Wig@JS.example'
+        >>> sigs = hp._signatures_by_badge({'Big.Wig': Badge()})
+        >>> [sig.completion_time for sig in sigs['Big.Wig']]
+        [datetime.datetime(2011, 8, 26, 0, 0)]
+        '''
+        found, todo = {}, {}
+        for uid, badge in badges.items():
+            mailboxes = self._mailboxes(badge)
+            try:
+                found[uid] = self._cached(('SAA', mailboxes),
+                                          'system access')
+            except KeyError:
+                todo[uid] = mailboxes
+        if not todo:
+            return found
+
+        log.info('system access query for %d of %d users',
+                 len(todo), len(badges))
+        bulk = self._bulk()
+        by_email = self._saa_rc.responses_many(
+            sorted(set(m for mbs in todo.values() for m in mbs)),
+            by_email=True)
+        # responses_many keys by lower-case address
+        answers = [(uid, [sig for m in sorted(set(m.lower() for m in mbs))
+                          for sig in by_email.get(m, [])])
+                   for (uid, mbs) in todo.items()]
+        self._fill([(('SAA', todo[uid]), sigs)
+                    for (uid, sigs) in answers if sigs],
+                   ttl, 'system access', bulk)
+        self._fill([(('SAA', todo[uid]), sigs)
+                    for (uid, sigs) in answers if not sigs],
+                   unsigned_ttl, 'system access', bulk)
+        found.update(answers)
+        return found
 
     def _oversight_request(self, badge):
         log.debug('oversight_request: %s faculty? %s executive? %s',
                   badge, badge.is_faculty(), badge.is_executive())
 
-        return OversightRequest(badge, self._mc._browser,
+        return OversightRequest(badge, self._browser,
                                 self._oversight_rc)
 
     def _redcap_rights(self, uid):
@@ -725,7 +1119,7 @@ class OversightRequest(Token):
         if what_for not in HeronRecords.oversight_request_purposes:
             raise TypeError(what_for)
 
-        tp = team_params(self.__browser.lookup, uids)
+        tp = team_params(self.__browser.lookup_many, uids)
         fac = self.__browser.lookup(fac_id)
         from_faculty = self.__badge.cn == fac_id
         return self.__orc(
@@ -741,11 +1135,11 @@ class OversightRequest(Token):
                  multi='yes'), multi=True)
 
 
-def team_params(lookup, uids):
+def team_params(lookup_many, uids):
     r'''
     >>> import pprint
     >>> (mc, ) = medcenter.Mock.make([medcenter.MedCenter])
-    >>> pprint.pprint(list(team_params(mc.peer_badge,
+    >>> pprint.pprint(list(team_params(mc.peer_badges,
     ...                                ['john.smith', 'bill.student'])))
     ... # doctest: +ELLIPSIS
     [('user_id_1', 'john.smith'),
@@ -755,13 +1149,16 @@ def team_params(lookup, uids):
      ('team_email_2', 'bill.student@js.example'),
      ('name_etc_2', 'Student, Bill\nStudent\nUndergrad')]
 
+
+    :raises: :exc:`KeyError` if any of `uids` is not found
     '''
+    found = lookup_many(uids)
     nested = [[('user_id_%d' % (i + 1), uid),
                ('team_email_%d' % (i + 1), a.mail),
                ('name_etc_%d' % (i + 1), '%s, %s\n%s\n%s' % (
                    a.sn, a.givenname, a.title or '', a.ou or ''))]
               for (i, uid, a) in
-              [(i, uids[i], lookup(uids[i]))
+              [(i, uids[i], found[uids[i]])
                for i in range(0, len(uids))]]
     return itertools.chain.from_iterable(nested)
 
@@ -799,6 +1196,21 @@ class Mock(injector.Module, rtconfig.MockMixin):
     def notary(self, mc):
         return mc.getInspector()
 
+    @singleton
+    @provides(FanOut)
+    def lookups(self):
+        # in-memory sqlite databases are per-thread
+        return FanOut()
+
+    @singleton
+    @provides(EligibilitySnapshot)
+    @inject(timesrc=rtconfig.Clock)
+    def eligible(self, timesrc):
+        import sqlite3
+        return EligibilitySnapshot(
+            sqlite3.connect(':memory:', check_same_thread=False),
+            timesrc.now, refresh=300)
+
     @classmethod
     def mods(cls):
         log.debug('heron_policy.Mock.mods')
@@ -857,6 +1269,30 @@ class RunTime(rtconfig.IniModule):  # pragma nocover
     def notary(self, mc):
         return mc.getInspector()
 
+    @singleton
+    @provides(FanOut)
+    def lookups(self):
+        try:
+            rt = self.get_options(fanout.OPTIONS, fanout.CONFIG_SECTION)
+            lookups = FanOut.from_options(rt)
+        except NoSectionError:
+            lookups = FanOut()
+        log.info('status lookups: %s', lookups)
+        return lookups
+
+    @singleton
+    @provides(EligibilitySnapshot)
+    @inject(timesrc=rtconfig.Clock)
+    def eligible(self, timesrc):
+        try:
+            rt = self.get_options(eligibility.OPTIONS,
+                                  eligibility.CONFIG_SECTION)
+        except NoSectionError:
+            return EligibilitySnapshot(None, timesrc.now)
+        snapshot = EligibilitySnapshot.from_options(rt, timesrc.now)
+        log.info('eligibility snapshot: %s', snapshot)
+        return snapshot
+
     @classmethod
     def mods(cls, ini, **kwargs):
         return (
@@ -886,7 +1322,7 @@ if __name__ == '__main__':  # pragma nocover
         from datetime import datetime
         from io import open as io_open
         from os import listdir
-        from os.path import join as joinpath
+        from os.path import join as joinpath, getmtime
         from random import Random
         from sys import argv, stderr, path as sys_path
         from urllib2 import build_opener
@@ -895,7 +1331,8 @@ if __name__ == '__main__':  # pragma nocover
         from sqlalchemy import create_engine
         import ldap
 
-        cwd = Path('.', open=io_open, joinpath=joinpath, listdir=listdir)
+        cwd = Path('.', open=io_open, joinpath=joinpath, listdir=listdir,
+                   getmtime=getmtime)
         logging.basicConfig(level=logging.DEBUG, stream=stderr)
 
         sys_path.append('..')
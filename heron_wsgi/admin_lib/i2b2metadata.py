@@ -2,6 +2,7 @@
 ----------------------------------------------------
 '''
 
+from ConfigParser import NoSectionError
 import logging
 
 import injector
@@ -166,22 +167,32 @@ class RunTime(rtconfig.IniModule):
 
     def __init__(self, ini, create_engine):
         rtconfig.IniModule.__init__(self, ini)
-        self.__ctx = RunTime.jboss_context(
-            ini, CONFIG_SECTION_MD, create_engine)
+        self.__ini = ini
+        self.__create_engine = create_engine
 
-    @classmethod
-    def jboss_context(cls, ini, section, create_engine):
-        m = rtconfig.IniModule(ini)
-        rt = m.get_options(['jboss_deploy'], section)
-        jdir = ini / rt.jboss_deploy
-        return jndi_util.JBossContext(jdir, create_engine)
+    def jboss_deploy(self, section):
+        rt = self.get_options(['jboss_deploy'], section)
+        return self.__ini / rt.jboss_deploy
+
+    @singleton
+    @provides(jndi_util.DataSources)
+    def datasources(self):
+        try:
+            rt = self.get_options(jndi_util.OPTIONS,
+                                  jndi_util.CONFIG_SECTION)
+        except NoSectionError:
+            return jndi_util.DataSources(self.__create_engine)
+        return jndi_util.DataSources.from_options(self.__create_engine, rt)
 
     @singleton
     @provides((orm.session.Session, CONFIG_SECTION_MD))
-    def md_sessionmaker(self):
+    @inject(sources=jndi_util.DataSources)
+    def md_sessionmaker(self, sources):
+        ctx = sources.context(self.jboss_deploy(CONFIG_SECTION_MD))
+        sm = orm.session.sessionmaker()
+
         def send_sessionmaker():
-            sm = orm.session.sessionmaker()
-            engine = self.__ctx.lookup(self.jndi_name_md)
+            engine = ctx.lookup(self.jndi_name_md)
             ds = sm(bind=engine)
             return ds
         return send_sessionmaker
@@ -217,7 +228,8 @@ if __name__ == '__main__':
                              open=io_open,
                              joinpath=os.path.join,
                              listdir=os.listdir,
-                             exists=os.path.exists)
+                             exists=os.path.exists,
+                             getmtime=os.path.getmtime)
         [md] = RunTime.make([I2B2Metadata],
                             ini=cwd / 'integration-test.ini',
                             create_engine=create_engine)
@@ -178,15 +178,81 @@ left static.
   >>> sorted(set([role.user_role_cd for role in js.roles]))
   ['ADMIN', 'DATA_AGG', 'DATA_DEID', 'DATA_LDS', 'DATA_OBFSC', 'USER']
 
+Roles are provisioned set-wise: one query gets the user's current
+(project, role) pairs, and only the differences are deleted or
+inserted, each in one statement:
+
+  >>> pm, dbsrc = Mock.make([I2B2PM, (orm.session.Session, CONFIG_SECTION)])
+  >>> stmts = _statements(dbsrc.kw['bind'])
+  >>> _ = pm.authz('bill.student', 'Bill Student', 'REDCap_1')
+  >>> stmts
+  ['UPDATE', 'INSERT', 'SELECT', 'INSERT', 'SELECT']
+
+When nothing changed, there's nothing to delete or insert:
+
+  >>> del stmts[:]
+  >>> _ = pm.authz('bill.student', 'Bill Student', 'REDCap_1')
+  >>> stmts
+  ['UPDATE', 'SELECT', 'SELECT']
+
+To compare with other approaches, use :func:`_benchmark`
+(`python i2b2pm.py --bench`).
+
+
+Revoking Expired Authorizations
+===============================
+
+A one-time password is good only until the user's i2b2 sessions
+expire. Rather than revoking expired passwords each time we open a
+database session, an :class:`AuthSweeper` does it in the background
+every `revoke_interval` seconds:
+
+  >>> from datetime import datetime
+  >>> pm, sweeper, dbsrc = Mock.make([
+  ...     I2B2PM, AuthSweeper, (orm.session.Session, CONFIG_SECTION)])
+  >>> for uid in ['john.smith', 'bill.student', 'big.wig']:
+  ...     _ = pm.authz(uid, uid, 'BlueHeron')
+  >>> s = dbsrc()
+  >>> s.add_all([
+  ...     UserSession(user_id='john.smith',
+  ...                 expired_date=datetime(2011, 9, 1)),
+  ...     UserSession(user_id='bill.student',
+  ...                 expired_date=datetime(2011, 9, 3))])
+  >>> s.commit()
+
+Only passwords of users whose latest session has expired are revoked;
+`big.wig` hasn't started a session yet:
+
+  >>> logged = rtconfig._printLogs()
+  >>> sweeper.sweep()
+  1
+  >>> print(logged())
+  INFO:i2b2pm:auth sweep: revoked 1 expired one-time passwords
+  >>> s.execute('select user_id from pm_user_data'
+  ...           ' where password is null').fetchall()
+  [(u'john.smith',)]
+
+Each sweep's count is kept for the statistics page:
+
+  >>> naps = []
+  >>> sweeper.run(naps.append, cycles=2)
+  >>> naps
+  [60, 60]
+  >>> sweeper.stats()
+  SweepStats(interval=60, sweeps=3, last_revoked=0, total_revoked=1)
+
 """
 
+from collections import namedtuple
+from threading import Lock
 import logging
 import hashlib
 
 import injector
 from injector import inject, provides, singleton
-from sqlalchemy import Column, ForeignKey, and_
-from sqlalchemy import func, orm
+from sqlalchemy import Column, ForeignKey, and_, event
+from sqlalchemy import func, literal_column, or_, orm, select
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.types import String, DateTime, Enum
 from sqlalchemy.ext.declarative import declarative_base
 
@@ -194,6 +260,7 @@ import rtconfig
 import jndi_util
 import ocap_file
 import i2b2metadata
+from periodic import every
 from sqlite_mem import _test_engine
 
 CONFIG_SECTION = 'i2b2pm'
@@ -230,6 +297,23 @@ class I2B2PM(ocap_file.Token):
         '''
         return I2B2Account(self, agent, project_id)
 
+    def user_ids(self):
+        '''List users with active i2b2 accounts, leaving out service
+        accounts.
+
+        >>> pm, = Mock.make([I2B2PM])
+        >>> _ = pm.authz('john.smith', 'John Smith', 'BlueHeron')
+        >>> pm.user_ids()
+        [u'john.smith']
+        '''
+        ud = User.__table__
+        ds = self._datasrc()
+        return [uid for (uid, ) in ds.execute(
+            select([ud.c.user_id]).where(and_(
+                ud.c.status_cd == 'A',
+                ~ud.c.user_id.like('%SERVICE_ACCOUNT'))).order_by(
+                    ud.c.user_id))]
+
     def i2b2_project(self, rc_pids):
         '''select project based on redcap projects user has access to.
 
@@ -294,63 +378,104 @@ class I2B2PM(ocap_file.Token):
         log.debug('generate authorization for: %s', (uid, full_name))
         ds = self._datasrc()
 
-        t = func.current_timestamp()
         auth = str(self._uuidgen.uuid4())
         pw_hash = hexdigest(auth)
 
-        # TODO: consider factoring out the "update the change_date
-        # whenever you set a field" aspect of Audited.
         try:
-            me = ds.query(User).filter(User.user_id == uid).one()
-        except orm.exc.NoResultFound:
-            me = User(user_id=uid, full_name=full_name,
-                      entry_date=t, change_date=t, status_cd='A',
-                      password=pw_hash,
-                      # Related UserRole records might exist
-                      # even though there is no User record.
-                      roles=ds.query(UserRole).filter_by(user_id=uid).all())
-            log.info('adding: %s', me)
-            ds.add(me)
-        else:
-            log.info('found: %s', me)
-            me.password, me.status_cd, me.change_date = pw_hash, 'A', t
-
-        admin_role = ds.query(UserRole).filter_by(user_id=uid,
-                                                  user_role_cd='ADMIN').all()
-
-        if not admin_role:
-            # http://docs.sqlalchemy.org/en/rel_0_8/orm/query.html?highlight=query.update#sqlalchemy.orm.query.Query.update # noqa
-            ds.query(UserRole).filter(and_(
-                UserRole.user_id == uid,
-                UserRole.user_role_cd.in_(list(roles)))).\
-                delete(synchronize_session='fetch')
-
-            # If a user has permissions to REDCap i2b2 project,
-            # also grant permissions to default project #2111
-            for project in set([project_id, DEFAULT_PID]):
-                for r in roles:
-                    myrole = UserRole(user_id=uid, project_id=project,
-                                      user_role_cd=r, entry_date=t,
-                                      change_date=t, status_cd='A')
-                    log.info('I2B2PM: adding: %s', myrole)
-                    me.roles.append(myrole)
-        else:
-            ds.query(UserRole).filter(and_(
-                UserRole.user_id == uid,
-                UserRole.project_id.like('REDCap_%'))).\
-                delete(synchronize_session='fetch')
-
-            for project in set([project_id, DEFAULT_PID]):
-                if "REDCap_" in project:
-                    for r in roles:
-                        myrole = UserRole(user_id=uid, project_id=project,
-                                          user_role_cd=r, entry_date=t,
-                                          change_date=t, status_cd='A')
-                        log.info('I2B2PM: adding REDCap role: %s', myrole)
-                        me.roles.append(myrole)
+            self._provision(ds, uid, full_name, pw_hash, project_id, roles)
+        except IntegrityError:
+            # A concurrent first login for uid inserted the same rows.
+            ds.rollback()
+            log.info('I2B2PM: concurrent provisioning of %s; retrying', uid)
+            self._provision(ds, uid, full_name, pw_hash, project_id, roles)
 
         ds.commit()
-        return auth, me
+        return auth, ds.query(User).get(uid)
+
+    def _provision(self, ds, uid, full_name, pw_hash, project_id, roles):
+        '''Set the user's password; diff current and desired
+        (project, role) pairs and apply only the differences.
+        '''
+        ud, ur = User.__table__, UserRole.__table__
+        t = func.current_timestamp()
+
+        # TODO: consider factoring out the "update the change_date
+        # whenever you set a field" aspect of Audited.
+        found = ds.execute(ud.update().where(ud.c.user_id == uid).values(
+            password=pw_hash, status_cd='A', change_date=t)).rowcount
+        if not found:
+            # Related UserRole records might exist
+            # even though there is no User record.
+            log.info('adding: %s', uid)
+            ds.execute(ud.insert().values(
+                user_id=uid, full_name=full_name, password=pw_hash,
+                entry_date=t, change_date=t, status_cd='A'))
+
+        current = ds.execute(
+            select([ur.c.project_id, ur.c.user_role_cd, ur.c.status_cd])
+            .where(ur.c.user_id == uid)).fetchall()
+        in_scope, want = _role_plan(
+            project_id, roles,
+            admin=any(r == 'ADMIN' for (_, r, _) in current))
+        have = set((p, r) for (p, r, st) in current
+                   if in_scope(p, r) and st == 'A')
+        stale = [(p, r) for (p, r, st) in current
+                 if in_scope(p, r) and (st != 'A' or (p, r) not in want)]
+        missing = [pr for pr in want if pr not in have]
+        log.info('I2B2PM: %s roles: adding %s; removing %s',
+                 uid, missing, stale)
+
+        if stale:
+            ds.execute(ur.delete().where(and_(
+                ur.c.user_id == uid,
+                or_(*[and_(ur.c.project_id == p, ur.c.user_role_cd == r)
+                      for (p, r) in stale]))))
+        if missing:
+            ds.execute(ur.insert().values(user_id=uid, entry_date=t,
+                                          change_date=t, status_cd='A'),
+                       [dict(project_id=p, user_role_cd=r)
+                        for (p, r) in missing])
+
+
+def _role_plan(project_id, roles, admin):
+    '''Which of a user's (project, role) pairs do we manage,
+    and which should there be?
+
+    If a user has permissions to a REDCap i2b2 project, we also grant
+    permissions to the default project (#2111)::
+
+      >>> in_scope, want = _role_plan('REDCap_4', ('USER', 'DATA_LDS'),
+      ...                             admin=False)
+      >>> want
+      ... # doctest: +NORMALIZE_WHITESPACE
+      [('REDCap_4', 'USER'), ('REDCap_4', 'DATA_LDS'),
+       ('BlueHeron', 'USER'), ('BlueHeron', 'DATA_LDS')]
+      >>> in_scope('REDCap_1', 'USER'), in_scope('REDCap_1', 'MANAGER')
+      (True, False)
+
+    For an ADMIN, we manage only REDCap project roles::
+
+      >>> in_scope, want = _role_plan('REDCap_4', ('USER', 'DATA_LDS'),
+      ...                             admin=True)
+      >>> want
+      [('REDCap_4', 'USER'), ('REDCap_4', 'DATA_LDS')]
+      >>> in_scope('REDCap_1', 'MANAGER'), in_scope('BlueHeron', 'USER')
+      (True, False)
+      >>> _role_plan(DEFAULT_PID, ('USER', 'DATA_LDS'), admin=True)[1]
+      []
+
+    :return: (in_scope, want) where `in_scope(project_id, role)`
+             tests whether we manage a pair and `want` is a list
+             of pairs
+    '''
+    if admin:
+        projects = [project_id] if 'REDCap_' in project_id else []
+        return ((lambda p, r: p.startswith('REDCap_')),
+                [(p, r) for p in projects for r in roles])
+    projects = [project_id] + [pid for pid in [DEFAULT_PID]
+                               if pid != project_id]
+    return ((lambda p, r: r in roles),
+            [(p, r) for p in projects for r in roles])
 
 
 def hexdigest(txt):
@@ -364,20 +489,81 @@ def hexdigest(txt):
     return ''.join([hex(ord(b))[2:] for b in hashlib.md5(txt).digest()])
 
 
-def revoke_expired_auths(ds):
+SYSDATE = literal_column('sysdate')
+
+
+def revoke_expired_auths(ds, now=SYSDATE):
     '''Revoke one-time passwords for all users whose sessions are expired.
+
+    Latest session expiry is aggregated per user once, in one
+    `group by`, rather than in a subquery for each `pm_user_data` row.
+
+    :param now: cut-off time; by default, the database's `sysdate`
+    :return: number of passwords revoked
     '''
-    ds.execute('''
-    update pm_user_data ipud
-    set ipud.password = null
-    where
-        ipud.user_id not like '%SERVICE_ACCOUNT'
-        and ipud.password is not null and (
-        select max(ipus.expired_date)
-        from pm_user_session ipus
-        where ipus.user_id = ipud.user_id) < sysdate
-    ''')
+    ud, us = User.__table__, UserSession.__table__
+    expired = select([us.c.user_id]).group_by(us.c.user_id).having(
+        func.max(us.c.expired_date) < now)
+    result = ds.execute(ud.update().where(and_(
+        ud.c.password.isnot(None),
+        ~ud.c.user_id.like('%SERVICE_ACCOUNT'),
+        ud.c.user_id.in_(expired))).values(password=None))
     ds.commit()
+    return result.rowcount
+
+
+SweepStats = namedtuple('SweepStats',
+                        ['interval', 'sweeps', 'last_revoked',
+                         'total_revoked'])
+
+
+class AuthSweeper(object):
+    def __init__(self, datasrc, interval=60, now=None):
+        '''
+        :param datasrc: access to a pm session
+        :param interval: seconds between sweeps
+        :param now: access to the current time; by default,
+                    the database's
+        '''
+        self._datasrc = datasrc
+        self.interval = interval
+        self._now = now
+        self._lock = Lock()
+        self._sweeps = self._total = 0
+        self._last = None
+
+    def __repr__(self):
+        return '%s(interval=%s)' % (self.__class__.__name__, self.interval)
+
+    def sweep(self):
+        '''Revoke expired one-time passwords.
+
+        :return: number of passwords revoked
+        '''
+        ds = self._datasrc()
+        try:
+            qty = revoke_expired_auths(
+                ds, SYSDATE if self._now is None else self._now())
+        finally:
+            ds.close()
+        with self._lock:
+            self._sweeps += 1
+            self._last = qty
+            self._total += qty
+        log.info('auth sweep: revoked %d expired one-time passwords', qty)
+        return qty
+
+    def stats(self):
+        with self._lock:
+            return SweepStats(self.interval, self._sweeps, self._last,
+                              self._total)
+
+    def run(self, sleep, cycles=None):
+        '''Sweep periodically.
+
+        :param sleep: access to pause between sweeps
+        '''
+        every(sleep, self.interval, self.sweep, 'auth sweep', cycles)
 
 
 def proj_desc_for(rc_pids):
@@ -473,7 +659,6 @@ class RunTime(rtconfig.IniModule):  # pragma: nocover
 
     def __init__(self, ini, uuid, create_engine):
         rtconfig.IniModule.__init__(self, ini)
-        self.__create_engine = create_engine
 
         def jdir_access(section):
             return ini / self.get_options(
@@ -484,25 +669,32 @@ class RunTime(rtconfig.IniModule):  # pragma: nocover
 
     # abusing Session a bit; this really provides a subclass, not an
     # instance, of Session
-    def sessionmaker(self, jndi, section):
-        ctx = jndi_util.JBossContext(
-            self.__jdir(section), self.__create_engine)
+    def sessionmaker(self, jndi, section, sources):
+        ctx = sources.context(self.__jdir(section))
 
         sm = orm.session.sessionmaker()
 
-        def make_session_and_revoke():
+        def make_session():
             engine = ctx.lookup(jndi)
             log.info('i2p2pm engine: %s', engine)
-            ds = sm(bind=engine)
-            revoke_expired_auths(ds)
-            return ds
+            return sm(bind=engine)
 
-        return make_session_and_revoke
+        return make_session
 
     @singleton
     @provides((orm.session.Session, CONFIG_SECTION))
-    def pm_sessionmaker(self):
-        return self.sessionmaker(self.jndi_name, CONFIG_SECTION)
+    @inject(sources=jndi_util.DataSources)
+    def pm_sessionmaker(self, sources):
+        return self.sessionmaker(self.jndi_name, CONFIG_SECTION, sources)
+
+    @singleton
+    @provides(AuthSweeper)
+    @inject(datasrc=(orm.session.Session, CONFIG_SECTION))
+    def auth_sweeper(self, datasrc):
+        rt = self.get_options(['revoke_interval'], CONFIG_SECTION)
+        sweeper = AuthSweeper(datasrc, interval=int(rt.revoke_interval or 60))
+        log.info('%s', sweeper)
+        return sweeper
 
     @singleton
     @provides(i2b2metadata.I2B2Metadata)
@@ -564,6 +756,17 @@ class Mock(injector.Module, rtconfig.MockMixin):
     def identified_data(self):
         return False
 
+    @singleton
+    @provides(jndi_util.DataSources)
+    def datasources(self):
+        return jndi_util.DataSources(jndi_util._MockEngine)
+
+    @singleton
+    @provides(AuthSweeper)
+    @inject(datasrc=(orm.session.Session, CONFIG_SECTION))
+    def auth_sweeper(self, datasrc):
+        return AuthSweeper(datasrc, now=rtconfig.MockClock().now)
+
 
 def _mock_i2b2_projects(ds, id_descs):
     '''Mock up i2b2 projects
@@ -583,6 +786,56 @@ def _mock_i2b2_proj_usage(ds, assignments):
         ds.commit()
 
 
+def _statements(engine):
+    '''Note the kind of each statement executed on `engine`.
+    '''
+    seen = []
+
+    def note(conn, cursor, statement, *_):
+        seen.append(str(statement.split(None, 1)[0].upper()))
+
+    event.listen(engine, 'before_cursor_execute', note)
+    return seen
+
+
+def _benchmark(stdout, time, uuid, users=200):
+    '''Time :meth:`I2B2PM.authz` on the sqlite stand-in.
+
+    Each round logs in every user: first to the default project, then
+    to a REDCap project, then to the same one again::
+
+      >>> from StringIO import StringIO
+      >>> import uuid
+      >>> out = StringIO()
+      >>> _benchmark(out, lambda: 0.0, uuid, users=10)
+      >>> print(out.getvalue().strip())
+      ... # doctest: +NORMALIZE_WHITESPACE
+      project    logins  ms/login  statements/login
+      BlueHeron      10     0.000              5.00
+      REDCap_1       10     0.000              4.00
+      REDCap_1       10     0.000              3.00
+    '''
+    engine = _test_engine()
+    Base.metadata.create_all(engine)
+    dbsrc = orm.session.sessionmaker(engine)
+    _mock_i2b2_projects(dbsrc(), [(1, None)])
+    pm = I2B2PM(dbsrc, i2b2metadata.MockMetadata(1), False, uuid)
+    stmts = _statements(engine)
+    uids = ['user%04d' % ix for ix in range(users)]
+
+    stdout.write('%-9s %7s %9s %17s\n' % (
+        'project', 'logins', 'ms/login', 'statements/login'))
+    for project_id in [DEFAULT_PID, 'REDCap_1', 'REDCap_1']:
+        del stmts[:]
+        t0 = time()
+        for uid in uids:
+            pm.authz(uid, uid, project_id)
+        elapsed = time() - t0
+        stdout.write('%-9s %7d %9.3f %17.2f\n' % (
+            project_id, users, elapsed * 1000 / users,
+            float(len(stmts)) / users))
+
+
 def _integration_test(argv, stdout, cwd, uuid,
                       create_engine):  # pragma: nocover
     # python i2b2pm.py badagarla 12,11,53 'Bhargav A'
@@ -632,14 +885,19 @@ if __name__ == '__main__':  # pragma: nocover
     def _script():
         from io import open as io_open
         from os import listdir
-        from os.path import join as joinpath, exists
+        from os.path import join as joinpath, exists, getmtime
         from sys import argv, stdout
+        from time import time
         import uuid
 
         from sqlalchemy import create_engine
 
         cwd = ocap_file.Path('.', open=io_open, joinpath=joinpath,
-                             exists=exists, listdir=listdir)
+                             exists=exists, listdir=listdir,
+                             getmtime=getmtime)
 
+        if '--bench' in argv:
+            _benchmark(stdout, time, uuid)
+            return
         _integration_test(argv, stdout, cwd, uuid, create_engine)
     _script()
@@ -26,13 +26,37 @@ Caching:
   INFO:cache_remote:LDAP query for ('(cn=john.smith)', ('sn',))
   INFO:cache_remote:... cached until 2011-09-02 00:00:08.500000
 
+Connections are bound once and reused from a pool; a connection that
+the server dropped is replaced::
+
+  >>> mock = MockLDAP()
+  >>> ds = LDAPService(ts.now, ttl=2, rt=_sample_settings,
+  ...                  ldap=mock, flags=MockLDAP)
+  >>> for who in ['john.smith', 'bill.student']:
+  ...     print(ds.search_remote('(cn=%s)' % who, ['sn']))
+  [('(cn=john.smith)', {'sn': ['Smith']})]
+  [('(cn=bill.student)', {'sn': ['Student']})]
+  >>> mock.opened
+  1
+  >>> mock.drop_connections()
+  >>> ds.search_remote('(cn=john.smith)', ['sn'])
+  [('(cn=john.smith)', {'sn': ['Smith']})]
+  >>> mock.opened
+  2
+  >>> _ = logged()
+
 Sample configuration::
 
   >>> print(_sample_settings.inifmt(CONFIG_SECTION))
   [enterprise_directory]
   base=ou=...,o=...
+  breaker_failures=5
+  breaker_reset=30
   certfile=LDAP_HOST_CERT.pem
   password=sekret
+  pool_idle=300
+  pool_size=4
+  timeout=10
   url=ldaps://_ldap_host_:636
   userdn=cn=...,ou=...,o=...
 
@@ -59,42 +83,227 @@ It supplies HSC training info::
 
 from __future__ import print_function
 
-from collections import namedtuple
+from collections import OrderedDict, namedtuple
+from contextlib import contextmanager
 from datetime import timedelta
 from io import BytesIO
 from pprint import pformat
+from threading import Condition, Lock
 import csv
 import logging
 import re
+import time
 
 import pkg_resources as pkg
 from injector import inject, provides, singleton
 
-from cache_remote import Cache
+from cache_remote import Cache, CachePolicy
+import cache_remote
 from ocap_file import Path
 import rtconfig
+import timing
 
 CONFIG_SECTION = 'enterprise_directory'
+NAME_CLUES = ('cn', 'sn', 'givenname')
 log = logging.getLogger(__name__)
 
 
 class LDAPService(Cache):
-    def __init__(self, now, ttl, rt, ldap, flags):
-        Cache.__init__(self, now)
+    # for use while LDAP is down; see search_cn_or_stale
+    keep_stale = timedelta(days=1)
+
+    def __init__(self, now, ttl, rt, ldap, flags, policy=None,
+                 breaker=None):
+        Cache.__init__(self, now, policy=policy)
         self._ttl = timedelta(seconds=ttl)
         self._rt = rt
         self._ldap = ldap
         self.flags = flags
-        self._l = None
+        self._breaker = breaker or CircuitBreaker()
+        self._trip_on = (flags.SERVER_DOWN, flags.TIMEOUT, PoolTimeout)
+        self._timeout = int(rt.timeout or 10)
+        self._pool = ConnectionPool(self._bind,
+                                    size=int(rt.pool_size or 4),
+                                    idle=int(rt.pool_idle or 300),
+                                    timeout=self._timeout)
+        # complete (untruncated) name clue results, most recent last
+        self._complete = OrderedDict()
+        self._clue_searches = self._clue_reuses = 0
 
     def search_cn(self, cn, attrs):
         return self._search('(cn=%s)' % quote(cn), attrs)
 
+    def search_cn_or_stale(self, cn, attrs):
+        '''Search by cn; while the circuit breaker is open, fall back to
+        an expired answer, up to `keep_stale` old.
+
+        :return: (matches, stale)
+
+        >>> ts = rtconfig.MockClock()
+        >>> mock = MockLDAP()
+        >>> ds = LDAPService(ts.now, ttl=60, rt=_sample_settings,
+        ...                  ldap=mock, flags=MockLDAP,
+        ...                  breaker=CircuitBreaker(threshold=2))
+        >>> ds.search_cn_or_stale('john.smith', ['sn'])
+        ([('(cn=john.smith)', {'sn': ['Smith']})], False)
+
+        Until the breaker opens, failures are passed along; the
+        failure that opens it gets the stale answer, as do later
+        requests:
+
+        >>> mock.down = True
+        >>> ts.wait(3600)
+        >>> logged = rtconfig._printLogs()
+        >>> ds.search_cn_or_stale('john.smith', ['sn'])
+        Traceback (most recent call last):
+          ...
+        SERVER_DOWN
+        >>> ds.search_cn_or_stale('john.smith', ['sn'])
+        ([('(cn=john.smith)', {'sn': ['Smith']})], True)
+        >>> ds.search_cn_or_stale('john.smith', ['sn'])
+        ([('(cn=john.smith)', {'sn': ['Smith']})], True)
+        >>> ds.search_cn_or_stale('bill.student', ['sn'])
+        Traceback (most recent call last):
+          ...
+        CircuitOpen: LDAP circuit breaker is open
+        >>> print(logged())
+        ... # doctest: +ELLIPSIS
+        INFO:cache_remote:LDAP query for ('(cn=john.smith)', ('sn',))
+        WARNING:ldaplib:LDAP server down; retrying with a new connection
+        INFO:cache_remote:LDAP query for ('(cn=john.smith)', ('sn',))
+        WARNING:ldaplib:LDAP server down; retrying with a new connection
+        WARNING:ldaplib:LDAP circuit breaker open after 2 consecutive failures
+        WARNING:ldaplib:LDAP unavailable; using stale entry for john.smith
+        INFO:cache_remote:LDAP query for ('(cn=john.smith)', ('sn',))
+        WARNING:ldaplib:LDAP unavailable; using stale entry for john.smith
+        INFO:cache_remote:LDAP query for ('(cn=bill.student)', ('sn',))
+        '''
+        k = ('(cn=%s)' % quote(cn), tuple(sorted(attrs)))
+        try:
+            return self.search_cn(cn, attrs), False
+        except self._trip_on + (CircuitOpen,):
+            if self._breaker.state().state != CircuitBreaker.OPEN:
+                raise
+            matches = self._stale(k)
+            if matches is None:
+                raise
+            log.warn('LDAP unavailable; using stale entry for %s', cn)
+            return matches, True
+
+    def search_cns(self, cns, attrs, chunk=50):
+        '''Search for several cns at once.
+
+        Cached answers are used where available; the rest are fetched
+        with one `(|(cn=...)(cn=...))` search per `chunk` of names,
+        and cached as if by :meth:`search_cn`.
+
+        :return: dict from cn to results as from :meth:`search_cn`
+
+        >>> ts = rtconfig.MockClock()
+        >>> ds = LDAPService(ts.now, ttl=60, rt=_sample_settings,
+        ...                  ldap=MockLDAP(), flags=MockLDAP)
+        >>> logged = rtconfig._printLogs()
+        >>> ds.search_cn('john.smith', ['sn'])
+        [('(cn=john.smith)', {'sn': ['Smith']})]
+        >>> found = ds.search_cns(['john.smith', 'bill.student',
+        ...                        'nobody', 'some.one'], ['sn'], chunk=2)
+        >>> for cn in sorted(found):
+        ...     print(cn, found[cn])
+        bill.student [('(cn=bill.student)', {'sn': ['Student']})]
+        john.smith [('(cn=john.smith)', {'sn': ['Smith']})]
+        nobody []
+        some.one [('(cn=some.one)', {'sn': ['One']})]
+        >>> print(logged())
+        ... # doctest: +NORMALIZE_WHITESPACE
+        INFO:cache_remote:LDAP query for ('(cn=john.smith)', ('sn',))
+        INFO:cache_remote:... cached until 2011-09-02 00:01:00.500000
+        INFO:ldaplib:LDAP query for 2 of 3 uncached names:
+          (|(cn=bill.student)(cn=nobody))
+        INFO:cache_remote:... cached until 2011-09-02 00:01:03
+        INFO:ldaplib:LDAP query for 1 of 3 uncached names: (|(cn=some.one))
+        INFO:cache_remote:... cached until 2011-09-02 00:01:03.500000
+
+        The answers are cached per cn::
+
+        >>> ds.search_cn('some.one', ['sn'])
+        [('(cn=some.one)', {'sn': ['One']})]
+        >>> logged()
+        ''
+        '''
+        attrs = tuple(sorted(attrs))
+        found, todo = {}, []
+        for cn in cns:
+            try:
+                found[cn] = self._cached(('(cn=%s)' % quote(cn), attrs),
+                                         'LDAP')
+            except KeyError:
+                if cn not in todo:
+                    todo.append(cn)
+
+        remote_attrs = sorted(set(attrs) | set(['cn']))
+        for start in range(0, len(todo), chunk):
+            batch = todo[start:start + chunk]
+            query = '(|%s)' % ''.join('(cn=%s)' % quote(cn) for cn in batch)
+            log.info('LDAP query for %d of %d uncached names: %s',
+                     len(batch), len(todo), query)
+            bulk = self._bulk()
+            by_cn = dict((cn.lower(), []) for cn in batch)
+            for dn, ldapattrs in self.search_remote(query, remote_attrs):
+                for cn in ldapattrs.get('cn', []):
+                    if cn.lower() in by_cn:
+                        by_cn[cn.lower()].append(
+                            (dn, dict((a, v) for (a, v) in ldapattrs.items()
+                                      if a in attrs)))
+            answers = [(cn, by_cn[cn.lower()]) for cn in batch]
+            self._fill([(('(cn=%s)' % quote(cn), attrs), ans)
+                        for (cn, ans) in answers], self._ttl, 'LDAP', bulk)
+            found.update(answers)
+        return found
+
     def search_name_clues(self, max_qty, cn, sn, givenname, attrs):
+        '''Search by name prefixes, asking the server for at most max_qty.
+
+        >>> ts = rtconfig.MockClock()
+        >>> ds = LDAPService(ts.now, ttl=60, rt=_sample_settings,
+        ...                  ldap=MockLDAP(), flags=MockLDAP)
+        >>> logged = rtconfig._printLogs()
+        >>> [dn for dn, _ in ds.search_name_clues(2, '', 'S', '', ['cn'])]
+        ['(cn=john.smith)', '(cn=bill.student)']
+        >>> print(logged())
+        ... # doctest: +NORMALIZE_WHITESPACE
+        INFO:cache_remote:LDAP query for ('(sn=S*)', ('cn',), 2)
+        INFO:cache_remote:... cached until 2011-09-02 00:01:00.500000
+
+        Each limit is cached separately::
+
+        >>> len(ds.search_name_clues(3, '', 'S', '', ['cn']))
+        3
+        >>> len(ds.search_name_clues(2, '', 'S', '', ['cn']))
+        2
+        >>> print(logged())
+        ... # doctest: +NORMALIZE_WHITESPACE
+        INFO:cache_remote:LDAP query for ('(sn=S*)', ('cn',), 3)
+        INFO:cache_remote:... cached until 2011-09-02 00:01:01
+
+        When a complete answer for shorter prefixes is cached, longer
+        prefixes are answered by filtering it::
+
+        >>> attrs = ['cn', 'sn', 'givenname']
+        >>> len(ds.search_name_clues(10, '', 'S', '', attrs))
+        4
+        >>> [dn for dn, _ in ds.search_name_clues(10, '', 'St', 'c', attrs)]
+        ['(cn=carol.student)']
+        >>> print(logged())
+        ... # doctest: +NORMALIZE_WHITESPACE
+        INFO:cache_remote:LDAP query for
+          ('(sn=S*)', ('cn', 'givenname', 'sn'), 10)
+        INFO:cache_remote:... cached until 2011-09-02 00:01:02
+        INFO:ldaplib:LDAP name search ('', 'St', 'c') refined from
+          ('', 'S', ''): 1 of 5 name searches reused
+        '''
+        clues = (cn, sn, givenname)
         clauses = ['(%s=%s*)' % (n, quote(v))
-                   for (n, v) in (('cn', cn),
-                                  ('sn', sn),
-                                  ('givenname', givenname))
+                   for (n, v) in zip(NAME_CLUES, clues)
                    if v]
         if len(clauses) == 0:
             return []
@@ -104,7 +313,63 @@ class LDAPService(Cache):
         else:
             q = clauses[0]
 
-        return self._search(q, attrs)[:max_qty]
+        attrs = tuple(sorted(attrs))
+        k = (q, attrs, max_qty)
+        with self._lock:
+            self._clue_searches += 1
+        refined = self._refine(clues, attrs, max_qty)
+        if refined is not None:
+            return refined
+
+        hits = self._query(k,
+                           lambda: (self._ttl,
+                                    self.search_remote_limited(
+                                        q, attrs, max_qty)),
+                           'LDAP')
+        if len(hits) < max_qty:
+            with self._lock:
+                self._complete.pop(k, None)
+                self._complete[k] = clues
+                if len(self._complete) > 100:
+                    self._complete.popitem(last=False)
+        return hits
+
+    def _refine(self, clues, attrs, max_qty):
+        '''Filter a cached, complete answer for shorter name prefixes.
+
+        Matching is case-insensitive prefix matching on the clue as
+        given, as the server does with the substring filter that
+        :func:`quote` builds.
+
+        :return: hits, or None if no such answer is cached
+        '''
+        needed = [n for (n, v) in zip(NAME_CLUES, clues) if v]
+        if not set(needed) <= set(attrs):
+            return None
+        with self._lock:
+            candidates = list(reversed(self._complete.items()))
+        lower = [v.lower() for v in clues]
+        for k, wider in candidates:
+            if (k[1] != attrs or wider == clues or
+                    not all(v.startswith(w.lower())
+                            for (w, v) in zip(wider, lower))):
+                continue
+            try:
+                hits = self._cached(k, 'LDAP')
+            except KeyError:
+                continue
+            with self._lock:
+                self._clue_reuses += 1
+                reuses, searches = self._clue_reuses, self._clue_searches
+            log.info('LDAP name search %s refined from %s: '
+                     '%d of %d name searches reused',
+                     clues, wider, reuses, searches)
+            return [(dn, found) for (dn, found) in hits
+                    if all(any(x.lower().startswith(v)
+                               for x in found.get(n, []))
+                           for (n, v) in zip(NAME_CLUES, lower)
+                           if v)][:max_qty]
+        return None
 
     def _search(self, query, attrs):
         attrs = tuple(sorted(attrs))
@@ -114,24 +379,493 @@ class LDAPService(Cache):
                            'LDAP')
 
     def search_remote(self, query, attrs):
-        ds = self._l or self._bind()
-        base = self._rt.base
-        try:
-            ans = ds.search_s(base, self.flags.SCOPE_SUBTREE, query, attrs)
-        except self.flags.SERVER_DOWN:
-            self._l = ds = self._bind()
-            ans = ds.search_s(base, self.flags.SCOPE_SUBTREE, query, attrs)
-        return ans
+        return self._with_connection(
+            lambda ds: ds.search_s(self._rt.base, self.flags.SCOPE_SUBTREE,
+                                   query, attrs))
+
+    def search_remote_limited(self, query, attrs, limit):
+        '''Search with a server-side size limit and paged results.
+
+        Stop as soon as `limit` entries have arrived.
+        '''
+        return self.search_paged(query, attrs, limit, limit)
+
+    def search_paged(self, query, attrs, page_size, limit=0):
+        '''Search using the simple paged-results control.
+
+        :param limit: stop after this many entries; 0 for no limit.
+
+        >>> ds = LDAPService(rtconfig.MockClock().now, ttl=60,
+        ...                  rt=_sample_settings,
+        ...                  ldap=MockLDAP(), flags=MockLDAP)
+        >>> len(ds.search_paged('(cn=*)', ['cn'], page_size=2))
+        10
+        '''
+        f = self.flags
+
+        def search(ds):
+            page = f.controls.SimplePagedResultsControl(
+                True, size=page_size, cookie='')
+            found = []
+            while True:
+                msgid = ds.search_ext(self._rt.base, f.SCOPE_SUBTREE,
+                                      query, list(attrs),
+                                      serverctrls=[page], sizelimit=limit)
+                try:
+                    while True:
+                        rtype, rdata, _, ctrls = ds.result3(msgid, all=0)
+                        if rtype == f.RES_SEARCH_RESULT:
+                            break
+                        if rtype == f.RES_SEARCH_ENTRY:
+                            found.extend(rdata)
+                        if limit and len(found) >= limit:
+                            ds.abandon(msgid)
+                            return found[:limit]
+                except f.SIZELIMIT_EXCEEDED:
+                    return found[:limit]
+                cookies = [c.cookie for c in ctrls
+                           if c.controlType == page.controlType]
+                if not (cookies and cookies[0]):
+                    return found
+                page.cookie = cookies[0]
+
+        return self._with_connection(search)
+
+    def _with_connection(self, op):
+        def attempt():
+            try:
+                with self._pool.connection() as ds:
+                    return op(ds)
+            except self.flags.SERVER_DOWN:
+                log.warn('LDAP server down; retrying with a new connection')
+                with self._pool.connection(fresh=True) as ds:
+                    return op(ds)
+
+        with timing.timed('ldap'):
+            return self._breaker.call(attempt, self._trip_on)
 
     def _bind(self):
         rt = self._rt
         ldap = self._ldap
         ldap.set_option(self.flags.OPT_X_TLS_CACERTFILE, rt.certfile)
         ds = ldap.initialize(rt.url)
+        ds.set_option(self.flags.OPT_NETWORK_TIMEOUT, self._timeout)
+        ds.timeout = self._timeout  # for each synchronous operation
         ds.simple_bind_s(rt.userdn, rt.password)
         return ds
 
 
+class PoolTimeout(IOError):
+    pass
+
+
+class CircuitOpen(IOError):
+    pass
+
+
+BreakerState = namedtuple('BreakerState', 'state failures trips opened')
+
+
+@singleton
+class CircuitBreaker(object):
+    '''Fail fast while LDAP is down rather than tie up request threads.
+
+    After `threshold` consecutive failures, the breaker opens::
+
+      >>> now = [0]
+      >>> cb = CircuitBreaker(threshold=2, reset=30, timer=lambda: now[0])
+      >>> def down():
+      ...     raise IOError('down')
+      >>> for attempt in range(3):
+      ...     try:
+      ...         cb.call(down, IOError)
+      ...     except IOError as oops:
+      ...         print(repr(oops))
+      IOError('down',)
+      IOError('down',)
+      CircuitOpen('LDAP circuit breaker is open',)
+      >>> cb.state()
+      BreakerState(state='open', failures=2, trips=1, opened=0)
+
+    After `reset` seconds, one request is let through as a probe; if it
+    succeeds, the breaker closes::
+
+      >>> now[0] = 31
+      >>> cb.call(lambda: 'up', IOError)
+      'up'
+      >>> cb.state()
+      BreakerState(state='closed', failures=0, trips=1, opened=None)
+
+    A failed probe opens the breaker again straight away.
+
+    A probe cut short by, say, :exc:`SystemExit` tells us
+    nothing, so the breaker goes back to open and the next request
+    probes again::
+
+      >>> cb = CircuitBreaker(threshold=1, reset=30, timer=lambda: now[0])
+      >>> cb.call(down, IOError)
+      Traceback (most recent call last):
+        ...
+      IOError: down
+      >>> now[0] = 62
+      >>> def interrupted():
+      ...     raise SystemExit(1)
+      >>> cb.call(interrupted, IOError)
+      Traceback (most recent call last):
+        ...
+      SystemExit: 1
+      >>> cb.state().state
+      'open'
+      >>> cb.call(lambda: 'up', IOError)
+      'up'
+
+    Other errors, such as a malformed query, neither count as failures
+    nor reset the count::
+
+      >>> cb = CircuitBreaker(threshold=2, reset=30, timer=lambda: now[0])
+      >>> def malformed():
+      ...     raise ValueError('bad filter')
+      >>> for thunk in [down, malformed, down, malformed]:
+      ...     try:
+      ...         cb.call(thunk, IOError)
+      ...     except (IOError, ValueError) as oops:
+      ...         print(repr(oops))
+      IOError('down',)
+      ValueError('bad filter',)
+      IOError('down',)
+      CircuitOpen('LDAP circuit breaker is open',)
+    '''
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half-open'
+
+    def __init__(self, threshold=5, reset=30, timer=time.time):
+        '''
+        :param threshold: consecutive failures that open the breaker
+        :param reset: seconds to wait before probing
+        :param timer: access to elapsed time
+        '''
+        self.threshold = threshold
+        self.reset = reset
+        self._timer = timer
+        self._lock = Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._trips = 0
+        self._opened = None
+
+    def __repr__(self):
+        return '%s(threshold=%s, reset=%s)' % (
+            self.__class__.__name__, self.threshold, self.reset)
+
+    @classmethod
+    def from_options(cls, rt):
+        return cls(threshold=int(rt.breaker_failures or 5),
+                   reset=int(rt.breaker_reset or 30))
+
+    def state(self):
+        with self._lock:
+            return BreakerState(self._state, self._failures, self._trips,
+                                self._opened)
+
+    def call(self, thunk, trip_on):
+        '''Call thunk unless the breaker is open.
+
+        :param trip_on: exception type(s) that count as failures
+        :raises: :exc:`CircuitOpen`
+        '''
+        with self._lock:
+            if self._state == self.HALF_OPEN:  # probe in progress
+                raise CircuitOpen('LDAP circuit breaker is open')
+            if self._state == self.OPEN:
+                if self._timer() < self._opened + self.reset:
+                    raise CircuitOpen('LDAP circuit breaker is open')
+                self._state = self.HALF_OPEN
+                log.info('LDAP circuit breaker half-open; probing')
+        try:
+            value = thunk()
+        except trip_on:
+            self._record(ok=False)
+            raise
+        except Exception:
+            self._answered()
+            raise
+        except BaseException:
+            self._abandon()
+            raise
+        self._record(ok=True)
+        return value
+
+    def _answered(self):
+        '''Note an error answer: it ends a probe, since the server is
+        up, but says nothing about the failures counted so far.
+        '''
+        with self._lock:
+            if self._state == self.HALF_OPEN:
+                log.info('LDAP circuit breaker closed')
+                self._state = self.CLOSED
+                self._failures = 0
+                self._opened = None
+
+    def _abandon(self):
+        '''Forget a probe that ended without an answer.
+        '''
+        with self._lock:
+            if self._state == self.HALF_OPEN:
+                self._state = self.OPEN
+
+    def _record(self, ok):
+        with self._lock:
+            if ok:
+                if self._state != self.CLOSED:
+                    log.info('LDAP circuit breaker closed')
+                self._state = self.CLOSED
+                self._failures = 0
+                self._opened = None
+                return
+            self._failures += 1
+            if (self._state == self.HALF_OPEN or
+                    self._failures >= self.threshold):
+                if self._state != self.OPEN:
+                    self._trips += 1
+                    log.warn('LDAP circuit breaker open after %d '
+                             'consecutive failures', self._failures)
+                self._state = self.OPEN
+                self._opened = self._timer()
+
+
+class ConnectionPool(object):
+    '''A bounded pool of bound LDAP connections, safe for use by threads.
+
+    Connections are made on demand, up to `size` of them::
+
+      >>> class Clock(object):
+      ...     t = 0
+      ...     def __call__(self):
+      ...         self.t += 0.01
+      ...         return self.t
+      >>> clock = Clock()
+      >>> mock = MockLDAP()
+      >>> pool = ConnectionPool(mock.connect, size=2, idle=300, timeout=0.05,
+      ...                       timer=clock)
+      >>> with pool.connection() as c1:
+      ...     with pool.connection() as c2:
+      ...         c1 is c2
+      False
+      >>> with pool.connection() as c3:
+      ...     c3 in (c1, c2)
+      True
+      >>> mock.opened
+      2
+
+    Once all `size` are checked out, more callers wait until one is
+    returned, or give up after `timeout` seconds::
+
+      >>> with pool.connection():
+      ...     with pool.connection():
+      ...         with pool.connection():
+      ...             pass
+      Traceback (most recent call last):
+        ...
+      PoolTimeout: no LDAP connection available after 0.05 sec
+
+    A connection that has been idle a while gets a health check before
+    reuse; one that has been idle too long is recycled::
+
+      >>> clock.t += 120
+      >>> mock.drop_connections()
+      >>> with pool.connection() as c4:
+      ...     c4 in (c1, c2)
+      False
+      >>> clock.t += 600
+      >>> with pool.connection() as c5:
+      ...     c5 is c4
+      False
+      >>> mock.opened, len(pool._idle)
+      (4, 1)
+
+    Idle connections count against `size`, along with those checked
+    out, so however many threads ask at once, there are never more
+    than `size` connections, even while health checks are slow::
+
+      >>> from threading import Lock, Thread
+      >>> class Conn(object):
+      ...     live = peak = 0
+      ...     lock = Lock()
+      ...     def __init__(self):
+      ...         with Conn.lock:
+      ...             Conn.live += 1
+      ...             Conn.peak = max(Conn.peak, Conn.live)
+      ...     def whoami_s(self):
+      ...         time.sleep(0.001)
+      ...         return 'dn:cn=heron'
+      ...     def unbind_s(self):
+      ...         with Conn.lock:
+      ...             Conn.live -= 1
+      >>> busy = ConnectionPool(Conn, size=4, idle=300, timeout=5)
+      >>> busy.check_after = 0
+      >>> with busy.connection(), busy.connection():
+      ...     with busy.connection(), busy.connection():
+      ...         pass
+      >>> def work():
+      ...     for n in range(20):
+      ...         with busy.connection(fresh=(n == 10)):
+      ...             time.sleep(0.001)
+      >>> workers = [Thread(target=work) for _ in range(3)]
+      >>> for t in workers:
+      ...     t.start()
+      >>> for t in workers:
+      ...     t.join()
+      >>> Conn.peak
+      4
+
+    Idle connections that are too old are closed at checkin and
+    checkout, oldest first::
+
+      >>> old = ConnectionPool(Conn, size=4, idle=300, timeout=0.05,
+      ...                      timer=clock)
+      >>> with old.connection(), old.connection():
+      ...     pass
+      >>> live = Conn.live
+      >>> clock.t += 200
+      >>> with old.connection():
+      ...     clock.t += 200
+      >>> Conn.live - live, len(old._idle)
+      (-1, 1)
+
+    A connection is discarded if an operation on it fails::
+
+      >>> with pool.connection() as c6:
+      ...     c6.search_s('o=...', None, '(oops)', [])
+      Traceback (most recent call last):
+        ...
+      ValueError
+      >>> len(pool._idle)
+      0
+    '''
+    check_after = 60  # seconds idle before a health check
+
+    def __init__(self, connect, size, idle, timeout, timer=time.time):
+        '''
+        :param connect: make a new bound connection
+        :param size: maximum number of connections
+        :param idle: seconds after which idle connections are recycled
+        :param timeout: seconds to wait for a connection
+        :param timer: access to elapsed time
+        '''
+        self._connect = connect
+        self.size = size
+        self._max_idle = idle
+        self._timeout = timeout
+        self._timer = timer
+        self._cond = Condition()
+        self._idle = []  # (last used, connection), most recent last
+        self._out = 0
+        self._closing = 0
+
+    @contextmanager
+    def connection(self, fresh=False):
+        ds = self._checkout(fresh)
+        try:
+            yield ds
+        except BaseException:
+            self._discard(ds)
+            raise
+        else:
+            self._checkin(ds)
+
+    def _checkout(self, fresh):
+        deadline = self._timer() + self._timeout
+        while True:
+            with self._cond:
+                doomed = self._expire()
+                if fresh:
+                    doomed, self._idle, fresh = doomed + self._idle, [], False
+                self._closing += len(doomed)
+                if not doomed:
+                    if self._idle or self._total() < self.size:
+                        ds = self._idle.pop() if self._idle else None
+                        self._out += 1
+                        break
+                    left = deadline - self._timer()
+                    if left <= 0:
+                        raise PoolTimeout(
+                            'no LDAP connection available after %s sec' %
+                            self._timeout)
+                    self._cond.wait(left)
+                    continue
+            self._close_all(doomed)
+
+        if ds is not None:
+            last_used, ds = ds
+            if (self._timer() - last_used > self.check_after and
+                    not self._healthy(ds)):
+                self._close(ds)
+                ds = None
+
+        if ds is None:
+            try:
+                ds = self._connect()
+            except BaseException:
+                self._release()
+                raise
+        return ds
+
+    def _total(self):
+        return self._out + len(self._idle) + self._closing
+
+    def _expire(self):
+        '''Take idle connections that are too old off the pool.
+
+        Call with `self._cond` held.
+        '''
+        tnow = self._timer()
+        doomed = []
+        while self._idle and tnow - self._idle[0][0] > self._max_idle:
+            doomed.append(self._idle.pop(0))
+        return doomed
+
+    def _close_all(self, doomed):
+        for _, old in doomed:
+            self._close(old)
+        if doomed:
+            with self._cond:
+                self._closing -= len(doomed)
+                self._cond.notify_all()
+
+    def _checkin(self, ds):
+        with self._cond:
+            self._idle.append((self._timer(), ds))
+            self._out -= 1
+            doomed = self._expire()
+            self._closing += len(doomed)
+            self._cond.notify()
+        self._close_all(doomed)
+
+    def _discard(self, ds):
+        self._close(ds)
+        self._release()
+
+    def _release(self):
+        with self._cond:
+            self._out -= 1
+            self._cond.notify()
+
+    @classmethod
+    def _healthy(cls, ds):
+        try:
+            ds.whoami_s()
+        except Exception:
+            log.info('LDAP connection failed health check; replacing it')
+            return False
+        return True
+
+    @classmethod
+    def _close(cls, ds):
+        try:
+            ds.unbind_s()
+        except Exception:
+            pass
+
+
 def quote(txt):
     r'''
     examples from `section 4 of RFC4515`__
@@ -158,41 +892,86 @@ def quote(txt):
 
 
 class MockLDAP(object):
-    SCOPE_SUBTREE, OPT_X_TLS_CACERTFILE = range(2)
+    SCOPE_SUBTREE, OPT_X_TLS_CACERTFILE, OPT_NETWORK_TIMEOUT = range(3)
+    RES_SEARCH_ENTRY, RES_SEARCH_RESULT = 100, 101
 
     class SERVER_DOWN(Exception):
         pass
 
+    class TIMEOUT(Exception):
+        pass
+
+    class SIZELIMIT_EXCEEDED(Exception):
+        pass
+
+    class controls(object):
+        class SimplePagedResultsControl(object):
+            controlType = '1.2.840.113556.1.4.319'
+
+            def __init__(self, criticality, size, cookie):
+                self.size = size
+                self.cookie = cookie
+
     def __init__(self, records=None):
         if records is None:
             records = MockDirectory().records
+        self._records = records
         self._d = dict([(r['cn'], r) for r in records])
-        self._bound = False
+        self.opened = 0
+        self.down = False
+        self._generation = 0
 
     def set_option(self, option, invalue):
         assert option == self.OPT_X_TLS_CACERTFILE
         assert invalue == _sample_settings.certfile
 
     def initialize(self, url):
-        return self
+        self.opened += 1
+        return _MockConnection(self)
 
-    def simple_bind_s(self, username, password):
-        self._bound = True
+    def connect(self):
+        ds = self.initialize(_sample_settings.url)
+        ds.simple_bind_s(_sample_settings.userdn, _sample_settings.password)
+        return ds
 
-    def search_s(self, base, scope, q, attrs):
-        if not self._bound:
-            raise TypeError('not bound')
+    def drop_connections(self):
+        '''Simulate the server dropping all open connections.
+        '''
+        self._generation += 1
 
+    def _search(self, q, attrs):
         log.debug('network fetch for %s', q)  # TODO: caching, .info()
-        i = self._qid(q)
-        try:
-            record = self._d[i]
-        except KeyError:
-            return []
-        return [('(cn=%s)' % i,
+        if q.startswith('(|'):
+            ids = re.findall(r'\(cn=([^*)]+)\)', q)
+            records = [self._d[i] for i in ids if i in self._d]
+        elif q.startswith('(&') or '*' in q or '>=' in q:
+            records = self._select(q)
+        else:
+            i = self._qid(q)
+            records = [self._d[i]] if i in self._d else []
+        return [('(cn=%s)' % record['cn'],
                  dict([(a, [record[a]])
                        for a in (attrs or record.keys())
-                       if record[a] != '']))]
+                       if record.get(a, '') != '']))
+                for record in records]
+
+    def _select(self, q):
+        '''Find records matching a conjunction of prefix (or >=) clauses.
+
+        >>> [r['cn'] for r in MockLDAP()._select('(&(sn=s*)(givenname=b*))')]
+        ['bill.student']
+        >>> [r['cn'] for r in MockLDAP()._select('(sn>=U)')]
+        ['big.wig', 'act.user', 'todd.ryan']
+        '''
+        prefixes = [(a, v[:-1].lower())
+                    for (a, v) in re.findall(r'\((\w+)=([^()]*\*)\)', q)]
+        bounds = re.findall(r'\((\w+)>=([^()]*)\)', q)
+        if not (prefixes or bounds):
+            raise ValueError(q)
+        return [r for r in self._records
+                if all((r.get(a) or '').lower().startswith(v)
+                       for (a, v) in prefixes) and
+                all((r.get(a) or '') >= v for (a, v) in bounds)]
 
     @classmethod
     def _qid(cls, q):
@@ -209,12 +988,77 @@ class MockLDAP(object):
         raise ValueError
 
 
+class _MockConnection(object):
+    timeout = -1
+
+    def __init__(self, server):
+        self._server = server
+        self._generation = server._generation
+        self._bound = False
+
+    def _check(self):
+        if (self._server.down or
+                self._generation != self._server._generation):
+            raise MockLDAP.SERVER_DOWN()
+
+    def set_option(self, option, invalue):
+        assert option == MockLDAP.OPT_NETWORK_TIMEOUT
+
+    def simple_bind_s(self, username, password):
+        self._check()
+        self._bound = True
+
+    def whoami_s(self):
+        self._check()
+        return 'dn:' + _sample_settings.userdn
+
+    def unbind_s(self):
+        self._bound = False
+
+    def search_s(self, base, scope, q, attrs):
+        self._check()
+        if not self._bound:
+            raise TypeError('not bound')
+        return self._server._search(q, attrs)
+
+    def search_ext(self, base, scope, q, attrs, serverctrls, sizelimit):
+        hits = self.search_s(base, scope, q, attrs)
+        [page] = serverctrls
+        start = int(page.cookie or 0)
+        end = start + page.size
+        entries = [(MockLDAP.RES_SEARCH_ENTRY, [hit])
+                   for hit in hits[start:min(end, sizelimit or end)]]
+        if 0 < sizelimit < len(hits) and end >= sizelimit:
+            entries.append(MockLDAP.SIZELIMIT_EXCEEDED())
+        else:
+            done = MockLDAP.controls.SimplePagedResultsControl(
+                True, page.size, str(end) if end < len(hits) else '')
+            entries.append((MockLDAP.RES_SEARCH_RESULT, [], [done]))
+        self._pending = entries
+        return 1
+
+    def result3(self, msgid, all=1):
+        item = self._pending.pop(0)
+        if isinstance(item, Exception):
+            raise item
+        rtype, rdata = item[:2]
+        return rtype, rdata, msgid, item[2] if len(item) > 2 else []
+
+    def abandon(self, msgid):
+        self._pending = []
+
+
 _sample_settings = rtconfig.TestTimeOptions(dict(
     certfile='LDAP_HOST_CERT.pem',
     url='ldaps://_ldap_host_:636',
     userdn='cn=...,ou=...,o=...',
     password='sekret',
-    base='ou=...,o=...'))
+    base='ou=...,o=...',
+    pool_size='4',
+    pool_idle='300',
+    timeout='10',
+    breaker_failures='5',
+    breaker_reset='30'))
 
 
 class MockDirectory(object):
@@ -249,15 +1093,26 @@ class RunTime(rtconfig.IniModule):  # pragma: nocover
     def opts(self):
         return self.get_options(
             ('url certfile userdn base password'
+             ' pool_size pool_idle timeout'
+             ' breaker_failures breaker_reset'
+             ' replica_refresh replica_max_age'
              ' studylookupaddr'
              ' executives testing_faculty').split(),
             CONFIG_SECTION)
 
+    @singleton
+    @provides(CircuitBreaker)
+    @inject(rt=(rtconfig.Options, CONFIG_SECTION))
+    def breaker(self, rt):
+        return CircuitBreaker.from_options(rt)
+
     @singleton
     @provides(LDAPService)
     @inject(rt=(rtconfig.Options, CONFIG_SECTION),
-            timesrc=rtconfig.Clock)
-    def service(self, rt, timesrc,
+            timesrc=rtconfig.Clock,
+            policy=CachePolicy,
+            breaker=CircuitBreaker)
+    def service(self, rt, timesrc, policy, breaker,
                 ttl=15):
         '''Provide native or mock LDAP implementation.
 
@@ -271,11 +1126,13 @@ class RunTime(rtconfig.IniModule):  # pragma: nocover
         '''
         flags = self.__ldap
         return LDAPService(timesrc.now, ttl=ttl, rt=rt,
-                           ldap=self.__ldap, flags=flags)
+                           ldap=self.__ldap, flags=flags, policy=policy,
+                           breaker=breaker)
 
     @classmethod
     def mods(cls, ini, ldap, timesrc, **kwargs):
-        return [cls(ini, ldap), rtconfig.RealClockInjector(timesrc)]
+        return [cls(ini, ldap), rtconfig.RealClockInjector(timesrc),
+                cache_remote.RunTime(ini)]
 
 
 if __name__ == '__main__':  # pragma nocover
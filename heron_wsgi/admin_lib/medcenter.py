@@ -94,8 +94,10 @@ import logging
 import injector
 from injector import inject, provides, singleton
 
+import cache_remote
 import rtconfig
 import ldaplib
+from dir_replica import DirectoryReplica
 import sealing
 from notary import makeNotary
 from ocap_file import WebReadable, Path
@@ -105,6 +107,7 @@ log = logging.getLogger(__name__)
 TRAINING_SECTION = 'training'
 # Injector keys are not shareable, so...
 KTrainingFunction = (type(lambda: 1), TRAINING_SECTION)
+KTrainingBatch = (type(lambda: 1), TRAINING_SECTION + '.many')
 KExecutives = injector.Key('Executives')
 KTestingFaculty = injector.Key('TestingFaculty')
 KStudyTeamLookup = injector.Key('StudyTeamLookup')
@@ -146,15 +149,20 @@ class Browser(object):
 
     '''
     @inject(searchsvc=ldaplib.LDAPService,
-            studyLookup=KStudyTeamLookup)
-    def __init__(self, searchsvc, studyLookup):
+            studyLookup=KStudyTeamLookup,
+            replica=DirectoryReplica)
+    def __init__(self, searchsvc, studyLookup, replica):
         self._svc = searchsvc
         self._studyLookup = studyLookup
+        self._replica = replica
 
     def directory_attributes(self, name):
         '''Get directory attributes.
+
+        While LDAP is unavailable, the last attributes seen may be
+        used; they are marked `stale`.
         '''
-        matches = self._svc.search_cn(name, Badge.attributes)
+        matches, stale = self._svc.search_cn_or_stale(name, Badge.attributes)
 
         if len(matches) != 1:  # pragma nocover
             if len(matches) == 0:
@@ -163,7 +171,10 @@ class Browser(object):
                 raise ValueError(name)  # ambiguous
 
         dn, ldapattrs = matches[0]
-        return LDAPBadge._simplify(ldapattrs)
+        attrs = LDAPBadge._simplify(ldapattrs)
+        if stale:
+            attrs.stale = True
+        return attrs
 
     def _search(self, max_qty, cn, sn, givenname):
         return self._svc.search_name_clues(max_qty, cn, sn, givenname,
@@ -174,11 +185,47 @@ class Browser(object):
         '''
         return LDAPBadge(**self.directory_attributes(name))
 
+    def lookup_many(self, names):
+        '''Get badges for several peers at once.
+
+        :return: dict from name to badge; names not found (or
+                 ambiguous) are left out.
+
+        >>> (mc, ) = Mock.make([MedCenter])
+        >>> found = mc.peer_badges(['john.smith', 'nobody', 'bill.student'])
+        >>> sorted((n, b.sn) for (n, b) in found.items())
+        [('bill.student', 'Student'), ('john.smith', 'Smith')]
+        '''
+        return dict((name, LDAPBadge(**attrs)) for (name, attrs)
+                    in self.directory_attributes_many(names).items())
+
+    def directory_attributes_many(self, names):
+        '''Get directory attributes for several names using batched
+        LDAP queries.
+
+        :return: dict from name to attributes; names not found (or
+                 ambiguous) are left out.
+        '''
+        found = {}
+        for name, matches in self._svc.search_cns(
+                names, Badge.attributes).items():
+            if len(matches) == 1:
+                dn, ldapattrs = matches[0]
+                found[name] = LDAPBadge._simplify(ldapattrs)
+            elif matches:  # pragma nocover
+                log.warn('ambiguous directory entry: %s', name)
+        return found
+
     def search(self, max_qty, cn, sn, givenname):
         '''Search for peers.
+
+        Answer from the directory replica if it is fresh; else from LDAP.
         '''
+        hits = self._replica.search(max_qty, cn, sn, givenname)
+        if hits is None:
+            hits = self._search(max_qty, cn, sn, givenname)
         return [LDAPBadge.from_attrs(ldapattrs)
-                for dn, ldapattrs in self._search(max_qty, cn, sn, givenname)]
+                for dn, ldapattrs in hits]
 
     def studyTeam(self, studyId):
         return self._studyLookup(studyId)
@@ -194,20 +241,23 @@ class MedCenter(object):
 
     @inject(browser=Browser,
             trainingfn=KTrainingFunction,
+            trainingbatch=KTrainingBatch,
             executives=KExecutives,
             testing_faculty=KTestingFaculty)
-    def __init__(self, browser, trainingfn,
+    def __init__(self, browser, trainingfn, trainingbatch,
                  testing_faculty, executives):
         '''
         :param testing_faculty: testing hook for faculty badge.
         '''
         #@@ log.debug('MedCenter.__init__ again?')
         self._training = trainingfn
+        self._trainings = trainingbatch
         self._testing_faculty = testing_faculty
         self.__executives = executives
         self._browser = browser
         self.search = browser.search
         self.peer_badge = browser.lookup
+        self.peer_badges = browser.lookup_many
         self.__notary = makeNotary()
         self.__sealer, self.__unsealer = sealing.makeBrandPair(
             self.__class__.__name__)
@@ -235,17 +285,59 @@ class MedCenter(object):
     def idbadge(self, context):
         '''
         :raises: TypeError on failure to authenticate context.remote_user
+
+        The badge is made once per context, i.e. per request::
+
+          >>> (mc, ) = Mock.make([MedCenter])
+          >>> req = MockRequest()
+          >>> _ = mc.authenticated('john.smith', req)
+          >>> mc.idbadge(req.context) is mc.idbadge(req.context)
+          True
         '''
         try:
             remote_user = context.remote_user
         except AttributeError:
             raise TypeError
 
+        try:
+            cred, badge = context.__badge
+        except AttributeError:
+            pass
+        else:
+            if cred is remote_user:
+                return badge
+
         uid = self.__unsealer.unseal(remote_user)  # raises TypeError
 
-        return IDBadge(self.__notary, uid in self.__executives,
-                       uid in self._testing_faculty,
-                       **self._browser.directory_attributes(uid))
+        badge = IDBadge(self.__notary, uid in self.__executives,
+                        uid in self._testing_faculty,
+                        **self._browser.directory_attributes(uid))
+        context.__badge = (remote_user, badge)
+        return badge
+
+    def _idbadges(self, uids):
+        '''Issue badges for many users at once, for batch reports.
+
+        Unlike :meth:`idbadge`, this takes uids on faith; it's only
+        for trusted callers such as
+        :meth:`heron_policy.HeronRecords.statuses`.
+
+        :return: dict from uid to badge; uids not in the directory
+                 are left out.
+
+          >>> (mc, ) = Mock.make([MedCenter])
+          >>> badges = mc._idbadges(['john.smith', 'big.wig', 'nobody'])
+          >>> sorted((uid, b.is_faculty(), b.is_executive())
+          ...        for (uid, b) in badges.items())
+          [('big.wig', False, True), ('john.smith', True, False)]
+          >>> sorted(mc.latest_trainings(badges.values()))
+          ['big.wig', 'john.smith']
+        '''
+        return dict(
+            (uid, IDBadge(self.__notary, uid in self.__executives,
+                          uid in self._testing_faculty, **attrs))
+            for (uid, attrs)
+            in self._browser.directory_attributes_many(uids).items())
 
     def latest_training(self, alleged_badge):
         '''
@@ -257,6 +349,17 @@ class MedCenter(object):
 
         return info
 
+    def latest_trainings(self, alleged_badges):
+        '''Look up training for many users at once.
+
+        :return: dict from cn to training; users with no training
+                 on file are left out.
+        :raises: :exc:`IOError`
+        '''
+        inspector = self.__notary.getInspector()
+        return self._trainings([inspector.vouch(b).cn
+                                for b in alleged_badges])
+
     @classmethod
     def faculty_check(cls, attrs):
         try:
@@ -267,6 +370,25 @@ class MedCenter(object):
             return None
 
 
+def each_training(trainingfn):
+    '''Make a batch training lookup from a one-at-a-time lookup,
+    for training sources that don't support bulk queries.
+
+    >>> many = each_training(ldaplib.MockDirectory().latest_training)
+    >>> sorted(many(['john.smith', 'bill.student', 'nobody']))
+    ['john.smith']
+    '''
+    def latest_many(cns):
+        found = {}
+        for cn in cns:
+            try:
+                found[cn] = trainingfn(cn)
+            except LookupError:
+                pass
+        return found
+    return latest_many
+
+
 class NotFaculty(TypeError):
     # subclass TypeError for compatibility with cas_auth grant()
     pass
@@ -286,11 +408,17 @@ class Badge(object):
       Traceback (most recent call last):
       ...
       AttributeError: sn_typo
+
+    Attributes from a stale directory entry are so marked:
+
+      >>> js.stale
+      False
     '''
     attributes = ("cn", "ou", "sn", "givenname", "title", "mail",
                   "kumcPersonFaculty", "kumcPersonJobcode")
 
-    def __init__(self, **attrs):
+    def __init__(self, stale=False, **attrs):
+        self.stale = stale
         self.__attrs = attrs
 
     def __getattr__(self, n):
@@ -413,17 +541,27 @@ class Mock(injector.Module, rtconfig.MockMixin):
     '''Mock up dependencies of :class:`MedCenter`:
       - :class:`ldap.LDAPService`
       - :data:`KTrainingFunction`
+      - :data:`KTrainingBatch`
       - :data:`KTestingFaculty` (for faculty testing hook)
 
     '''
 
+    @singleton
     @provides(ldaplib.LDAPService)
-    @inject(d=ldaplib.MockDirectory, ts=rtconfig.Clock)
-    def ldap(self, d, ts):
+    @inject(d=ldaplib.MockDirectory, ts=rtconfig.Clock,
+            policy=cache_remote.CachePolicy,
+            breaker=ldaplib.CircuitBreaker)
+    def ldap(self, d, ts, policy, breaker):
         return ldaplib.LDAPService(
             ts.now, ttl=2, rt=ldaplib._sample_settings,
             ldap=ldaplib.MockLDAP(d.records),
-            flags=ldaplib.MockLDAP)
+            flags=ldaplib.MockLDAP, policy=policy, breaker=breaker)
+
+    @singleton
+    @provides(DirectoryReplica)
+    @inject(svc=ldaplib.LDAPService, ts=rtconfig.Clock)
+    def replica(self, svc, ts):
+        return DirectoryReplica(ts.now, svc, Badge.attributes)
 
     @provides(rtconfig.Clock)
     def _time_source(self):
@@ -434,6 +572,11 @@ class Mock(injector.Module, rtconfig.MockMixin):
     def training_function(self, d):
         return d.latest_training
 
+    @provides(KTrainingBatch)
+    @inject(d=ldaplib.MockDirectory)
+    def training_batch(self, d):
+        return each_training(d.latest_training)
+
     @provides(KTestingFaculty)
     def fac(self):
         return ''
@@ -453,14 +596,16 @@ class RunTime(rtconfig.IniModule):  # pragma: nocover
     '''Configure dependencies of :class:`MedCenter`:
       - :class:`ldap.LDAPService`
       - :data:`KTrainingFunction`
+      - :data:`KTrainingBatch`
       - :data:`KTestingFaculty` (for faculty testing hook)
 
     '''
 
-    def __init__(self, ini, urlopener, trainingfn):
+    def __init__(self, ini, urlopener, trainingfn, trainingbatch=None):
         rtconfig.IniModule.__init__(self, ini)
         self.__urlopener = urlopener
         self.__trainingfn = trainingfn
+        self.__trainingbatch = trainingbatch or each_training(trainingfn)
         self.label = '%s(%s, %s, %s)' % (
             self.__class__.__name__, ini, urlopener, trainingfn)
 
@@ -485,6 +630,21 @@ class RunTime(rtconfig.IniModule):  # pragma: nocover
     def training(self):
         return self.__trainingfn
 
+    @provides(KTrainingBatch)
+    def training_batch(self):
+        return self.__trainingbatch
+
+    @singleton
+    @provides(DirectoryReplica)
+    @inject(rt=(rtconfig.Options, ldaplib.CONFIG_SECTION),
+            svc=ldaplib.LDAPService, timesrc=rtconfig.Clock)
+    def replica(self, rt, svc, timesrc):
+        refresh = rt.replica_refresh
+        max_age = rt.replica_max_age
+        return DirectoryReplica(timesrc.now, svc, Badge.attributes,
+                                refresh=int(refresh) if refresh else None,
+                                max_age=int(max_age) if max_age else None)
+
     @provides(KStudyTeamLookup)
     @inject(rt=(rtconfig.Options, ldaplib.CONFIG_SECTION))
     def study_team_lookup(self, rt):
@@ -502,8 +662,9 @@ class RunTime(rtconfig.IniModule):  # pragma: nocover
         return lookup
 
     @classmethod
-    def mods(cls, ini, timesrc, urlopener, ldap, trainingfn, **kwargs):
-        return [cls(ini, urlopener, trainingfn)] + (
+    def mods(cls, ini, timesrc, urlopener, ldap, trainingfn,
+             trainingbatch=None, **kwargs):
+        return [cls(ini, urlopener, trainingfn, trainingbatch)] + (
             ldaplib.RunTime.mods(ini, ldap, timesrc))
 
 
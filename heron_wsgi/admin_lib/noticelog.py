@@ -95,6 +95,21 @@ Get current email addresses of the team:
  >>> dr.team_email(inv.cn, [mem.cn for mem in team])
  ('john.smith@js.example', ['some.one@js.example', 'carol.student@js.example'])
 
+If the directory can't look up the whole team at once, we look
+them up one at a time, skipping any we can't find:
+
+  >>> class Strained(object):
+  ...     def __init__(self, browser):
+  ...         self.lookup = browser.lookup
+  ...     def lookup_many(self, uids):
+  ...         raise IOError('query too big')
+  >>> browser, dr._browser = dr._browser, Strained(dr._browser)
+  >>> dr.team_email(inv.cn, [mem.cn for mem in team])
+  ... # doctest: +NORMALIZE_WHITESPACE
+  ('john.smith@js.example',
+   ['some.one@js.example', 'carol.student@js.example'])
+  >>> dr._browser = browser
+
 The following table is used to log notices::
 
   >>> from redcapdb import _test_engine
@@ -185,13 +200,25 @@ class DecisionRecords(Token):
         '''Enumerate current (un-expired) sponsorships by/for uid.
         :param inv: True=by (i.e. investigator); False=for
         '''
+        return self._sponsorships(lambda dc: dc.c.candidate == uid, inv)
+
+    def sponsorships_many(self, uids):
+        '''Enumerate current sponsorships for any of uids, in one query.
+
+        :return: sponsorships, by record; check `candidate`
+                 to see who each is for
+        '''
+        return self._sponsorships(
+            lambda dc: dc.c.candidate.in_(list(uids)))
+
+    def _sponsorships(self, which, inv=False):
         _d, _c, dc = _sponsor_queries(self._oversight_project_id,
                                       len(self.institutions), inv)
 
         # mysql work-around for
         # 1248, 'Every derived table must have its own alias'
         dc = dc.alias('mw')
-        q = dc.select(and_(dc.c.candidate == uid,
+        q = dc.select(and_(which(dc),
                            dc.c.decision == DecisionRecords.YES,
                            dc.c.what_for == DecisionRecords.SPONSORSHIP)).\
                                order_by(dc.c.record)
@@ -262,17 +289,25 @@ class DecisionRecords(Token):
         that are on file.
         '''
         browser = self._browser
-
-        def try_lookup(who):
-            try:
-                return browser.lookup(who)
-            except Exception as ex:
-                log.warn('cannot get email for %s', who, exc_info=ex)
-                return None
-
-        return (browser.lookup(inv_uid).mail,
+        try:
+            found = browser.lookup_many([inv_uid] + list(team_uids))
+        except Exception as ex:
+            log.warn('cannot look up team at once; trying one at a time',
+                     exc_info=ex)
+            found = {inv_uid: browser.lookup(inv_uid)}
+            for uid in team_uids:
+                try:
+                    found[uid] = browser.lookup(uid)
+                except Exception as ex:
+                    log.debug('lookup of %s failed', uid, exc_info=ex)
+
+        for uid in team_uids:
+            if uid not in found:
+                log.warn('cannot get email for %s', uid)
+
+        return (found[inv_uid].mail,
                 [entry.mail
-                 for entry in [try_lookup(uid) for uid in team_uids]
+                 for entry in [found.get(uid) for uid in team_uids]
                  if entry and hasattr(entry, 'mail') and entry.mail])
 
 
@@ -27,9 +27,11 @@ __ http://www.hpl.hp.com/techreports/2006/HPL-2006-116.html
 
 '''
 
-from urlparse import urljoin
+from urlparse import urljoin, urlparse
 from urllib2 import Request
 
+import timing
+
 
 class Path(object):
     '''Just the parts of the pathlib API that we use.
@@ -38,6 +40,7 @@ class Path(object):
     :type open: (...) -> Path
     :type exists: () -> bool
     :type listdir: (str) -> Iterable[str]
+    :type getmtime: (str) -> float
     '''
     def __init__(self, here, **ops):
         '''
@@ -48,6 +51,7 @@ class Path(object):
         self.exists = lambda: ops['exists'](here)
         self.iterdir = lambda: (self / child for child in ops['listdir'](here))
         self.resolve = lambda: self / ops['abspath'](here)
+        self.getmtime = lambda: ops['getmtime'](here)
         self._path = here
 
     def __repr__(self):
@@ -169,7 +173,8 @@ def WebReadable(base, urlopener):
                 return "HEAD"
 
         try:
-            urlopener.open(HeadRequest(base))
+            with timed():
+                urlopener.open(HeadRequest(base))
             return True
         except IOError:
             return False
@@ -187,7 +192,8 @@ def WebReadable(base, urlopener):
         '''
         .. todo:: wrap result of open() for strict confinement.
         '''
-        return urlopener.open(base)
+        with timed():
+            return urlopener.open(base)
 
     def getBytes():
         return inChannel().read()
@@ -195,11 +201,22 @@ def WebReadable(base, urlopener):
     def fullPath():
         return base
 
+    def timed():
+        return timing.timed(_timing_label(base))
+
     return edef(__repr__,
                 isDir, exists, subRdFiles, subRdFile, inChannel,
                 getBytes, fullPath)
 
 
+def _timing_label(url):
+    '''
+    >>> _timing_label('https://cas.example:8443/cas/validate')
+    'http-cas.example'
+    '''
+    return 'http-%s' % urlparse(url).hostname
+
+
 def WebPostable(base, urlopener):
     '''Extend WebReadable with POST support.
 
@@ -220,7 +237,8 @@ def WebPostable(base, urlopener):
         return 'WebPostable(...)'
 
     def post(content):
-        return urlopener.open(base, content)
+        with timing.timed(_timing_label(base)):
+            return urlopener.open(base, content)
 
     return edef(__repr__, post, delegate=delegate)
 
@@ -0,0 +1,55 @@
+'''periodic -- repeat a task in the background
+--------------------------------------------
+
+Refreshing the directory replica, the eligibility snapshot and so on
+is the same loop: do the work, log any failure, pause, repeat::
+
+  >>> import rtconfig
+  >>> logged = rtconfig._printLogs()
+  >>> results = iter([1, 0])
+  >>> def task():
+  ...     print(1 / next(results))
+  >>> naps = []
+  >>> every(naps.append, 60, task, 'sample refresh', cycles=2)
+  1
+  >>> naps
+  [60, 60]
+  >>> print(logged())
+  WARNING:periodic:sample refresh failed
+
+A failure doesn't stop the loop; the next cycle tries again.
+
+'''
+
+from threading import Thread
+import logging
+
+log = logging.getLogger(__name__)
+
+
+def every(sleep, interval, task, what, cycles=None):
+    '''Call `task` now and after each `interval`.
+
+    :param sleep: access to pause between calls
+    :param interval: seconds between calls
+    :param what: description for logs
+    :param cycles: number of calls, or `None` to go on forever
+    '''
+    n = 0
+    while cycles is None or n < cycles:
+        try:
+            task()
+        except Exception:
+            log.warn('%s failed', what)
+            log.debug('%s error detail', what, exc_info=True)
+        n += 1
+        sleep(interval)
+
+
+def start(name, target, **kwargs):  # pragma: nocover
+    '''Run `target(**kwargs)` in a daemon thread.
+    '''
+    t = Thread(target=target, name=name, kwargs=kwargs)
+    t.daemon = True
+    t.start()
+    return t
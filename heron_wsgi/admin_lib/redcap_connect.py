@@ -83,6 +83,9 @@ class SurveySetup(object):
     def responses(self, email):
         return self.__ss.responses(email)
 
+    def responses_many(self, emails, by_email=False):
+        return self.__ss.responses_many(emails, by_email=by_email)
+
     @classmethod
     def _surveycode(cls, url):
         """Get survey code from survey URL
@@ -28,10 +28,15 @@ He hasn't responded yet:
     >>> saa.responses('bob@js.example')
     []
 
+To check several addresses for the same person, ask about them all at once:
+    >>> saa.responses_many(['big.wig@js.example', 'bob@js.example'])
+    [(u'3253004250825796194', datetime.datetime(2011, 8, 26, 0, 0))]
+
 '''
 
 from __future__ import print_function
 from ConfigParser import SafeConfigParser
+from collections import namedtuple
 from random import Random as Random_T
 import datetime
 import logging
@@ -47,6 +52,8 @@ import redcapdb
 log = logging.getLogger(__name__)
 CONFIG_SECTION = 'survey_invite'
 
+Response = namedtuple('Response', ['record', 'completion_time'])
+
 Nonce = str
 
 
@@ -265,9 +272,84 @@ class SecureSurvey(object):
         # (line 2 of this method)
         return list(eventResponse)
 
+    def responses_many(self, emails,
+                       max_retries=10,
+                       known_record_id='767',
+                       known_sig_time=datetime.datetime(
+                           2017, 1, 25, 8, 55, 10),
+                       by_email=False):
+        '''Find responses to this survey from any of `emails`.
+
+        This takes one connection and two queries, however many
+        addresses there are. Connection failures are handled
+        as in :meth:`responses`:
+
+        >>> from random import Random
+        >>> def lose(*argv):
+        ...     raise OperationalError('select...', {}, None)
+        >>> ss = SecureSurvey(connect=lose, rng=Random(1), survey_id=93)
+        >>> ss.responses_many(['daffy@walt.disney'], max_retries=2)
+        ... # doctest: +NORMALIZE_WHITESPACE
+        [Response(record='767',
+                  completion_time=datetime.datetime(2017, 1, 25, 8, 55, 10))]
+
+        :param by_email: if true, return a dict from each address
+                         to its responses
+
+        >>> ss.responses_many(['daffy@walt.disney'], max_retries=2,
+        ...                   by_email=True)
+        ... # doctest: +NORMALIZE_WHITESPACE
+        {'daffy@walt.disney':
+         [Response(record='767',
+                   completion_time=datetime.datetime(2017, 1, 25, 8, 55, 10))]}
+
+        Addresses are matched, and the dict is keyed, ignoring case.
+        MySQL's `IN` ignores case anyway; we compare the bare
+        (indexed) column and query the lower-case spelling as well:
+
+        >>> io = MockIO()
+        >>> saa = SecureSurvey(io.connect, io.rng, 11)
+        >>> saa.responses_many(['Big.Wig@JS.example'], by_email=True)
+        ... # doctest: +NORMALIZE_WHITESPACE
+        {'big.wig@js.example':
+         [(u'big.wig@js.example', u'3253004250825796194',
+           datetime.datetime(2011, 8, 26, 0, 0))]}
+        '''
+        # type: (List[str]) -> List[Tuple(str, datetime)]
+        if not emails:
+            return {} if by_email else []
+        spellings = sorted(set(emails) |
+                           set(email.lower() for email in emails))
+        emails = sorted(set(email.lower() for email in emails))
+        for attempt in range(max_retries):
+            try:
+                conn = self.__connect()
+            except OperationalError:
+                log.info('MySQL Connection Failed, trying %d more times...',
+                         max_retries - attempt - 1)
+                continue
+            try:
+                event_id = conn.execute(self._event_q(self.survey_id)).scalar()
+                q = self._response_q(spellings, self.survey_id, event_id,
+                                     with_email=by_email)
+                rows = conn.execute(q).fetchall()
+            finally:
+                conn.close()
+            if not by_email:
+                return rows
+            found = dict((email, []) for email in emails)
+            for row in rows:
+                found.setdefault(row.participant_email.lower(),
+                                 []).append(row)
+            return found
+
+        log.warn('Connect failed! Making up data for %s', list(emails))
+        known = [Response(known_record_id, known_sig_time)]
+        return dict((email, known) for email in emails) if by_email else known
+
     @classmethod
-    def _response_q(cls, email, survey_id, event_id):
-        # type: (str, int, int) -> Executable
+    def _response_q(cls, email, survey_id, event_id, with_email=False):
+        # type: (str, int, int, bool) -> Executable
         '''
         >>> q = SecureSurvey._response_q('xyz@abc', 12, 7)
         >>> print(q)
@@ -278,12 +360,30 @@ class SecureSurvey(object):
           AND p.participant_email = :participant_email_1
           AND p.survey_id = :survey_id_1
           AND p.event_id = :event_id_1
+
+        Given a list of addresses, match any of them:
+
+        >>> q = SecureSurvey._response_q(['xyz@abc', 'x@abc'], 12, 7)
+        >>> print(q)
+        ... # doctest: +NORMALIZE_WHITESPACE
+        SELECT r.record, r.completion_time
+        FROM redcap_surveys_response AS r, redcap_surveys_participants AS p
+        WHERE r.participant_id = p.participant_id
+          AND p.participant_email IN (:participant_email_1,
+                                      :participant_email_2)
+          AND p.survey_id = :survey_id_1
+          AND p.event_id = :event_id_1
         '''
         r = redcapdb.redcap_surveys_response.alias('r')
         p = redcapdb.redcap_surveys_participants.alias('p')
-        return select([r.c.record, r.c.completion_time]).where(
+        cols = [r.c.record, r.c.completion_time]
+        if with_email:
+            cols = [p.c.participant_email] + cols
+        return select(cols).where(
             and_(r.c.participant_id == p.c.participant_id,
-                 p.c.participant_email == email,
+                 (p.c.participant_email.in_(email)
+                  if isinstance(email, (list, tuple, set, frozenset))
+                  else p.c.participant_email == email),
                  p.c.survey_id == survey_id,
                  p.c.event_id == event_id))
 
@@ -0,0 +1,150 @@
+r'''status_report -- HERON access status of many users, as CSV
+
+Usage:
+  status_report [options] CONFIG [UID...]
+  status_report --help
+
+Options:
+  CONFIG             admin ini file, as for the web app
+  UID                userids to report on; if none are given,
+                     read them from stdin, one per line
+  --batch=N          users per round of queries [default: 200]
+  -d --debug         turn on debug logging
+
+.. note:: This directive separates usage doc above from design notes below.
+
+DROC staff and compliance jobs need the access status of hundreds
+of users at a time. Rather than checking them one by one, we use
+:meth:`heron_policy.HeronRecords.statuses`, a batch at a time, and
+write each batch as soon as it's ready::
+
+  >>> from StringIO import StringIO
+  >>> import heron_policy
+  >>> hr, = heron_policy.Mock.make([heron_policy.HeronRecords])
+  >>> out = StringIO()
+  >>> main(['status_report', '--batch=2', 'admin.ini'],
+  ...      StringIO('john.smith\nbill.student\nnobody\nbig.wig\n'), out,
+  ...      lambda config: hr)
+  >>> lines = out.getvalue().splitlines()
+  >>> lines[0] == ','.join(COLUMNS)
+  True
+  >>> print('\n'.join(lines[1:]))
+  john.smith,True,True,False,,False,True,2012-01-01,2011-08-26 00:00:00
+  bill.student,False,False,False,False,False,False,,
+  nobody,,,,,,,,
+  big.wig,True,False,True,,True,True,2012-01-01,2011-08-26 00:00:00
+
+Users not in the directory are listed with blank status.
+
+'''
+
+import csv
+import logging
+
+log = logging.getLogger(__name__)
+
+COLUMNS = ['user_id', 'complete', 'faculty', 'executive', 'sponsored',
+           'droc', 'training_current', 'training_expires',
+           'system_access_signed']
+
+
+def main(argv, stdin, stdout, make_records):
+    # Don't require docopt except for command-line usage
+    from docopt import docopt
+
+    usage = __doc__.split('\n..')[0]
+    opts = docopt(usage, argv=argv[1:])
+    log.debug('docopt: %s', opts)
+
+    uids = opts['UID'] or (line.strip() for line in stdin)
+    write_csv(make_records(opts['CONFIG']), uids, stdout,
+              batch=int(opts['--batch']))
+
+
+def write_csv(hr, uids, out, batch=200):
+    '''Write the status of each of `uids` to `out`, `batch` at a time.
+
+    :param hr: a :class:`heron_policy.HeronRecords`
+    '''
+    w = csv.writer(out)
+    w.writerow(COLUMNS)
+    todo = []
+    for uid in uids:
+        if uid and uid not in todo:
+            todo.append(uid)
+        if len(todo) >= batch:
+            _write_batch(w, hr, todo)
+            out.flush()
+            todo = []
+    if todo:
+        _write_batch(w, hr, todo)
+
+
+def _write_batch(w, hr, uids):
+    found = hr.statuses(uids)
+    log.info('status of %d users (%d not found)',
+             len(uids), len(uids) - len(found))
+    for uid in uids:
+        st = found.get(uid)
+        w.writerow([uid] + (['' for _ in COLUMNS[1:]] if st is None
+                            else _row(st)))
+
+
+def _row(st):
+    training = st.current_training or st.expired_training
+    sigs = sorted(st.system_access_signed or [])
+    return [st.complete, st.faculty, st.executive,
+            '' if st.sponsored is None else st.sponsored,
+            bool(st.droc),
+            bool(st.current_training),
+            str(training.expired)[:10] if training else '',
+            sigs[-1] if sigs else '']
+
+
+if __name__ == '__main__':  # pragma: nocover
+    def _privileged_main():
+        from datetime import datetime
+        from io import open as io_open
+        from os import listdir
+        from os.path import join as joinpath, getmtime
+        from random import Random
+        from sys import argv, path as sys_path, stdin, stdout, stderr
+        from urllib2 import build_opener
+        import uuid
+
+        from sqlalchemy import create_engine
+        import ldap
+
+        from ocap_file import Path
+        import heron_policy
+
+        logging.basicConfig(
+            level=logging.DEBUG if '--debug' in argv else logging.INFO,
+            stream=stderr)
+
+        sys_path.append('..')
+        import traincheck
+
+        cwd = Path('.', open=io_open, joinpath=joinpath, listdir=listdir,
+                   getmtime=getmtime)
+
+        def make_records(config_fn):
+            ini = cwd / config_fn
+            trainingfn, trainingbatch = traincheck.training_functions(
+                ini, create_engine)
+            [hr] = heron_policy.RunTime.make(
+                [heron_policy.HeronRecords],
+                ini=ini,
+                rng=Random(),
+                timesrc=datetime,
+                uuid=uuid,
+                urlopener=build_opener(),
+                trainingfn=trainingfn,
+                trainingbatch=trainingbatch,
+                ldap=ldap,
+                create_engine=create_engine)
+            return hr
+
+        main(argv, stdin, stdout, make_records)
+
+    _privileged_main()
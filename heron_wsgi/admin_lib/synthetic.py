@@ -0,0 +1,357 @@
+'''synthetic -- seeded, scalable mock data for benchmarks
+-------------------------------------------------------
+
+:class:`ldaplib.MockDirectory` and `mock_redcapdb.sql` describe a
+handful of people, which is plenty for correctness tests but tells us
+nothing about how we scale. A :class:`Population` generates as many
+people as we like, with a realistic mix of faculty, staff and
+students::
+
+  >>> pop = Population(500, seed=1)
+  >>> people = pop.records
+  >>> len(people)
+  500
+  >>> sorted(people[0].keys()) == sorted(ldaplib.MockDirectory.records[0])
+  True
+  >>> faculty = [p for p in people if p['kumcPersonFaculty'] == 'Y']
+  >>> 50 < len(faculty) < 100
+  True
+
+The same seed gives the same people::
+
+  >>> Population(500, seed=1).records == people
+  True
+  >>> len(set(p['cn'] for p in people))
+  500
+
+A population stands in for :class:`ldaplib.MockDirectory`, including
+training records::
+
+  >>> who = people[0]['cn']
+  >>> mock = ldaplib.MockLDAP(pop.records)
+  >>> [dn for (dn, _) in mock._search('(cn=%s)' % who, ['cn'])] == [
+  ...     '(cn=%s)' % who]
+  True
+  >>> trained = [p['cn'] for p in people if p['trainedThru']]
+  >>> pop.latest_training(trained[0]).expired == people[
+  ...     [p['cn'] for p in people].index(trained[0])]['trainedThru']
+  True
+
+It fills the REDCap tables with sponsorships and system access
+agreement (SAA) signatures::
+
+  >>> import redcapdb
+  >>> rc = redcapdb.Mock.engine()
+  >>> counts = pop.load_redcap(rc)
+  >>> sorted(counts.keys())
+  ['saa', 'sponsorships']
+  >>> counts['saa'] > 300
+  True
+  >>> rc.execute('select count(distinct record) from redcap_data'
+  ...            ' where project_id = 34').scalar() > counts['sponsorships']
+  True
+
+and i2b2 query history::
+
+  >>> from sqlite_mem import _test_engine
+  >>> i2b2 = _test_engine()
+  >>> qty = pop.load_query_history(i2b2)
+  >>> i2b2.execute('select count(*) from blueherondata.qt_query_master'
+  ...              ).scalar() == qty
+  True
+
+Training records in the form that traincheck's
+`TrainingRecordsAdmin.put('HumanSubjectsFull', ...)` expects::
+
+  >>> pop.training()[0]._fields
+  ... # doctest: +NORMALIZE_WHITESPACE
+  ('FirstName', 'LastName', 'Email', 'EmployeeID', 'DateCompleted',
+   'Username')
+
+To benchmark the whole app on a population, add a :class:`Mock` for it
+after the usual mock modules; its bindings take precedence::
+
+  >>> import injector
+  >>> import heron_policy, medcenter
+  >>> depgraph = injector.Injector(heron_policy.Mock.mods() + [Mock(pop)])
+  >>> browser = depgraph.get(medcenter.Browser)
+  >>> browser.lookup(who).cn == who
+  True
+
+'''
+
+from collections import namedtuple
+from datetime import date, datetime, timedelta
+from random import Random
+import logging
+
+import injector
+from injector import provides, singleton
+from sqlalchemy.engine.base import Connectable
+
+import ldaplib
+import redcapdb
+
+log = logging.getLogger(__name__)
+
+GIVEN_NAMES = '''
+Aaron Abigail Adam Aisha Alex Amy Andre Ann Ben Beth Carlos Carol Chen
+Chris Dana David Diego Elena Emily Eric Fatima Grace Hana Ian Ivan Jamal
+Jill Joan John Jose Kate Kevin Kim Laura Leo Lin Maria Mark Mei Nina
+Omar Pat Priya Raj Rosa Sam Sara Tom Uma Victor Wei Yusuf Zoe
+'''.split()
+
+SURNAMES = '''
+Adams Ahmed Allen Brown Chen Clark Davis Diaz Evans Garcia Gomez Green
+Hall Harris Hill Jackson Johnson Jones Kim King Lee Lewis Lopez Martin
+Miller Moore Nguyen Patel Perez Reed Roberts Robinson Rodriguez Ruiz
+Scott Singh Smith Taylor Thomas Thompson Walker White Williams Wilson
+Wright Young Zhang
+'''.split()
+
+DEPARTMENTS = '''
+Anesthesiology Biostatistics Cardiology Dermatology Emergency
+Family_Medicine Internal_Medicine Neurology Nursing Oncology Pathology
+Pediatrics Pharmacy Psychiatry Radiology Surgery Urology
+'''.split()
+
+TITLES = dict(faculty=('Professor', 'Associate Professor',
+                       'Assistant Professor', 'Chair'),
+              staff=('Research Coordinator', 'Data Analyst',
+                     'Nurse', 'Program Manager'),
+              student=('Student', 'Resident', 'Fellow'))
+
+Training = namedtuple('Training', ('FirstName LastName Email EmployeeID '
+                                   'DateCompleted Username'))
+
+
+class Population(object):
+    def __init__(self, size, seed=0,
+                 mix=(('faculty', 0.15), ('staff', 0.35),
+                      ('student', 0.5)),
+                 trained=0.8, signed=0.7, sponsoring=0.6,
+                 domain='js.example', today=date(2011, 9, 2)):
+        '''
+        :param size: number of people
+        :param seed: for the random number generator
+        :param mix: share of each kind of person
+        :param trained: share of people with training on file
+        :param signed: share of people who signed the SAA
+        :param sponsoring: share of faculty who sponsor a team
+        '''
+        self.size = size
+        self.seed = seed
+        self._mix = mix
+        self._trained = trained
+        self._signed = signed
+        self._sponsoring = sponsoring
+        self.domain = domain
+        self.today = today
+        self._records = None
+        self._by_cn = None
+
+    def __repr__(self):
+        return '%s(%d, seed=%s)' % (self.__class__.__name__,
+                                    self.size, self.seed)
+
+    def _rng(self, purpose):
+        return Random('%s:%s' % (self.seed, purpose))
+
+    @property
+    def records(self):
+        '''People, in the form of :data:`ldaplib.MockDirectory.records`.
+        '''
+        if self._records is None:
+            self._records = list(self._people())
+            self._by_cn = dict((r['cn'], r) for r in self._records)
+        return self._records
+
+    def _people(self):
+        rng = self._rng('people')
+        seen = {}
+        kinds = [kind for (kind, _) in self._mix]
+        cumulative = [sum(share for (_, share) in self._mix[:ix + 1])
+                      for ix in range(len(self._mix))]
+        for ix in xrange(self.size):
+            given, sn = rng.choice(GIVEN_NAMES), rng.choice(SURNAMES)
+            base = '%s.%s' % (given.lower(), sn.lower())
+            seen[base] = n = seen.get(base, 0) + 1
+            cn = base if n == 1 else '%s%d' % (base, n)
+            pick = rng.random() * cumulative[-1]
+            kind = kinds[[pick < c for c in cumulative].index(True)]
+            dept = rng.choice(DEPARTMENTS).replace('_', ' ')
+            title = rng.choice(TITLES[kind])
+            expires = (self.today +
+                       timedelta(days=rng.randint(-365, 3 * 365)))
+            yield dict(
+                sn=sn, cn=cn, givenname=given,
+                mail='%s@%s' % (cn, self.domain),
+                title=('%s of %s' % (title, dept) if kind == 'faculty'
+                       else title),
+                ou=dept,
+                kumcPersonJobcode=('%04d' % rng.randint(1000, 9999)
+                                   if kind != 'student' else '0'),
+                kumcPersonFaculty='Y' if kind == 'faculty' else 'N',
+                trainedThru=(expires.isoformat()
+                             if rng.random() < self._trained else ''))
+
+    def latest_training(self, cn):
+        '''Look up training a la :meth:`ldaplib.MockDirectory.latest_training`.
+        '''
+        self.records
+        expired = self._by_cn[cn]['trainedThru']
+        if not expired:
+            raise LookupError(cn)
+        return ldaplib.Training(cn, expired, expired, 'Human Subjects 101')
+
+    def training(self):
+        '''Training records for traincheck's HumanSubjectsFull table.
+        '''
+        return [Training(r['givenname'], r['sn'], r['mail'], 'E%06d' % ix,
+                         datetime.strptime(r['trainedThru'], '%Y-%m-%d') -
+                         timedelta(days=3 * 365),
+                         r['cn'])
+                for (ix, r) in enumerate(self.records)
+                if r['trainedThru']]
+
+    def sponsorships(self):
+        '''Oversight requests: (record, sponsor, fields) for faculty sponsors.
+        '''
+        rng = self._rng('sponsorships')
+        others = [r for r in self.records if r['kumcPersonFaculty'] != 'Y']
+        record = 0
+        for sponsor in self.records:
+            if (sponsor['kumcPersonFaculty'] != 'Y' or
+                    rng.random() >= self._sponsoring or not others):
+                continue
+            for _ in range(rng.randint(1, 3)):
+                record += 1
+                team = rng.sample(others, min(len(others),
+                                              rng.randint(1, 5)))
+                decision = '1' if rng.random() < 0.9 else '2'
+                expiration = ('' if rng.random() < 0.7 else
+                              (self.today + timedelta(
+                                  days=rng.randint(-365, 3 * 365))
+                               ).isoformat())
+                fields = [('user_id', sponsor['cn']),
+                          ('full_name', '%s %s' % (sponsor['givenname'],
+                                                   sponsor['sn'])),
+                          ('project_title', 'Study %d' % record),
+                          ('what_for', '1'),
+                          ('date_of_expiration', expiration)]
+                fields += [('user_id_%d' % n, member['cn'])
+                           for (n, member) in enumerate(team, 1)]
+                fields += [('approve_%s' % org, decision)
+                           for org in ('kuh', 'kupi', 'kumc')]
+                yield str(record), sponsor['cn'], fields
+
+    def load_redcap(self, engine, project_id=34, survey_id=11,
+                    chunk=5000):
+        '''Add sponsorships and SAA signatures to a REDCap database
+        as from :meth:`redcapdb.Mock.engine`.
+
+        :return: dict of counts
+        '''
+        rng = self._rng('saa')
+        counts = dict(sponsorships=0, saa=0)
+        with engine.begin() as conn:
+            rows = []
+            for record, _, fields in self.sponsorships():
+                counts['sponsorships'] += 1
+                rows.extend(dict(project_id=project_id, event_id=1,
+                                 record=record, field_name=k, value=v)
+                            for (k, v) in fields)
+                if len(rows) >= chunk:
+                    conn.execute(redcapdb.redcap_data.insert(), rows)
+                    rows = []
+            if rows:
+                conn.execute(redcapdb.redcap_data.insert(), rows)
+
+            # clear of the participant ids in mock_redcapdb.sql
+            base = 10 ** 6
+            midnight = datetime.combine(self.today, datetime.min.time())
+            signers = [(base + ix, r) for (ix, r) in enumerate(self.records)
+                       if rng.random() < self._signed]
+            counts['saa'] = len(signers)
+            for start in xrange(0, len(signers), chunk):
+                batch = signers[start:start + chunk]
+                conn.execute(redcapdb.redcap_surveys_participants.insert(),
+                             [dict(participant_id=pid, survey_id=survey_id,
+                                   event_id=1, participant_email=r['mail'])
+                              for (pid, r) in batch])
+                conn.execute(redcapdb.redcap_surveys_response.insert(),
+                             [dict(response_id=pid, participant_id=pid,
+                                   record=str(pid),
+                                   completion_time=midnight - timedelta(
+                                       days=rng.randint(0, 1000)))
+                              for (pid, r) in batch])
+        log.info('synthetic REDCap data: %s', counts)
+        return counts
+
+    def query_history(self):
+        '''i2b2 queries: (id, user_id, name, create_date) tuples.
+
+        Faculty and sponsored team members query; a few heavily.
+        '''
+        rng = self._rng('queries')
+        users = set(cn for (_, sponsor, fields) in self.sponsorships()
+                    for (k, cn) in fields if k.startswith('user_id'))
+        midnight = datetime.combine(self.today, datetime.min.time())
+        qid = 0
+        for r in self.records:
+            if r['cn'] not in users:
+                continue
+            for _ in xrange(int(rng.paretovariate(1.5) * 3)):
+                qid += 1
+                when = midnight - timedelta(
+                    minutes=rng.randint(0, 2 * 365 * 24 * 60))
+                yield qid, r['cn'], 'Query %d' % qid, when
+
+    def load_query_history(self, engine, chunk=5000):
+        '''Load :meth:`query_history` into a sqlite qt_query_master table.
+
+        :return: number of queries
+        '''
+        conn = engine.connect()
+        conn.execute("attach database ':memory:' as blueherondata")
+        conn.execute('''create table blueherondata.qt_query_master (
+                          query_master_id integer primary key,
+                          user_id varchar(50), name varchar(250),
+                          create_date timestamp,
+                          delete_flag varchar(3) default 'N')''')
+        qty, rows = 0, []
+        for row in self.query_history():
+            rows.append(row)
+            if len(rows) >= chunk:
+                qty += self._insert_queries(conn, rows)
+                rows = []
+        qty += self._insert_queries(conn, rows)
+        log.info('synthetic i2b2 query history: %d queries', qty)
+        return qty
+
+    @classmethod
+    def _insert_queries(cls, conn, rows):
+        if rows:
+            conn.execute('insert into blueherondata.qt_query_master'
+                         ' (query_master_id, user_id, name, create_date)'
+                         ' values (?, ?, ?, ?)', rows)
+        return len(rows)
+
+
+class Mock(injector.Module):
+    '''Bind the directory and REDCap database to a :class:`Population`.
+    '''
+    def __init__(self, population):
+        injector.Module.__init__(self)
+        self._population = population
+
+    @provides(ldaplib.MockDirectory)
+    def directory(self):
+        return self._population
+
+    @singleton
+    @provides((Connectable, redcapdb.CONFIG_SECTION))
+    def redcap_datasource(self):
+        engine = redcapdb.Mock.engine()
+        self._population.load_redcap(engine)
+        return engine
@@ -0,0 +1,244 @@
+'''timing -- where did the time for this request go?
+---------------------------------------------------
+
+A slow page might be waiting on LDAP, one of several databases, a web
+service such as CAS, or template rendering. :class:`Middleware` starts
+a :class:`RequestTimer` for each (sampled) request; code that talks to
+those subsystems reports to it using :func:`timed`::
+
+  >>> ticks = iter(range(0, 1000, 5)).next
+  >>> def app(environ, start_response):
+  ...     with timed('ldap'):
+  ...         pass
+  ...     with timed('ldap'):
+  ...         pass
+  ...     with timed('render'):
+  ...         pass
+  ...     start_response('200 OK', [('Content-Type', 'text/plain')])
+  ...     return ['hi']
+
+  >>> import rtconfig
+  >>> logged = rtconfig._printLogs()
+  >>> app1 = Middleware(app, sample=1, rng=None, time=lambda: ticks() / 1e3)
+
+Each response gets a `Server-Timing` header, with durations in
+milliseconds::
+
+  >>> started = []
+  >>> app1({'REQUEST_METHOD': 'GET', 'PATH_INFO': '/'},
+  ...      lambda status, headers: started.append((status, headers)))
+  ['hi']
+  >>> dict(started[0][1])['Server-Timing']
+  'ldap;dur=10.0, render;dur=5.0, total;dur=35.0'
+
+and there's one log line per request::
+
+  >>> print(logged())
+  ... # doctest: +NORMALIZE_WHITESPACE
+  INFO:timing:request timing: method=GET path=/ status=200 total_ms=40.0
+      ldap_ms=10.0 ldap_n=2 render_ms=5.0 render_n=1
+
+Outside a sampled request, :func:`timed` does nothing::
+
+  >>> with timed('ldap'):
+  ...     current() is None
+  True
+
+Sampling
+--------
+
+With `sample` below 1, only some requests are timed::
+
+  >>> class MockRandom(object):
+  ...     def __init__(self):
+  ...         self.x = 0
+  ...     def random(self):
+  ...         self.x = (self.x + 0.3) % 1
+  ...         return self.x
+  >>> app2 = Middleware(app, sample=0.5, rng=MockRandom(),
+  ...                   time=lambda: ticks() / 1e3)
+  >>> for n in range(4):
+  ...     del started[:]
+  ...     body = app2({'REQUEST_METHOD': 'GET', 'PATH_INFO': '/'},
+  ...                 lambda status, headers: started.append(headers))
+  ...     print('Server-Timing' in dict(started[0]))
+  True
+  False
+  False
+  True
+
+SQL Statements
+--------------
+
+Statements on a watched engine count against that engine's label::
+
+  >>> from sqlalchemy import create_engine
+  >>> make_engine = timed_engines(create_engine)
+  >>> engine = make_engine('sqlite:///')
+  >>> label(engine.url)
+  'db-sqlite'
+
+  >>> timer = start(lambda: ticks() / 1e3)
+  >>> engine.execute('select 1').fetchall()
+  [(1,)]
+  >>> stop() is timer, timer.header()
+  ... # doctest: +ELLIPSIS
+  (True, 'db-sqlite;dur=5.0, total;dur=...')
+
+'''
+
+from collections import OrderedDict
+from contextlib import contextmanager
+import logging
+import re
+import threading
+
+from sqlalchemy import event
+from sqlalchemy.engine.url import make_url
+
+log = logging.getLogger(__name__)
+
+_current = threading.local()
+
+
+class RequestTimer(object):
+    def __init__(self, time):
+        self.time = time
+        self._t0 = time()
+        self.spent = OrderedDict()  # name -> [count, seconds]
+        self._lock = threading.Lock()
+
+    def add(self, name, seconds):
+        with self._lock:
+            count_total = self.spent.setdefault(name, [0, 0.0])
+            count_total[0] += 1
+            count_total[1] += seconds
+
+    def header(self):
+        '''Format as a `Server-Timing` header value.
+        '''
+        return ', '.join(
+            ['%s;dur=%.1f' % (name, seconds * 1000)
+             for (name, (_, seconds)) in self.spent.items()] +
+            ['total;dur=%.1f' % ((self.time() - self._t0) * 1000)])
+
+    def fields(self):
+        '''Durations (in ms) and counts by subsystem, for logging.
+        '''
+        out = [('total_ms', '%.1f' % ((self.time() - self._t0) * 1000))]
+        for name, (qty, seconds) in self.spent.items():
+            out += [('%s_ms' % name, '%.1f' % (seconds * 1000)),
+                    ('%s_n' % name, qty)]
+        return out
+
+
+def start(time):
+    timer = RequestTimer(time)
+    _current.timer = timer
+    return timer
+
+
+def stop():
+    timer = current()
+    _current.timer = None
+    return timer
+
+
+def current():
+    return getattr(_current, 'timer', None)
+
+
+def adopt(timer):
+    '''Time work in this thread (e.g. a pool worker) against `timer`.
+
+    :return: the timer this thread was using before
+    '''
+    before = current()
+    _current.timer = timer
+    return before
+
+
+@contextmanager
+def timed(name):
+    '''Charge the time spent in this block to `name`,
+    if the current request is being timed.
+    '''
+    timer = current()
+    if timer is None:
+        yield
+        return
+    t0 = timer.time()
+    try:
+        yield
+    finally:
+        timer.add(name, timer.time() - t0)
+
+
+def label(url):
+    '''Name a database for timing purposes.
+    '''
+    name = url.database or url.drivername
+    return 'db-' + re.sub(r'[^\w.-]', '_', name)
+
+
+def watch_engine(engine, name):
+    '''Time each statement executed on `engine` as `name`.
+    '''
+    def before(conn, cursor, statement, parameters, context, many):
+        timer = current()
+        if timer is not None:
+            conn.info.setdefault('timing_t0', []).append(timer.time())
+
+    def after(conn, cursor, statement, parameters, context, many):
+        timer = current()
+        starts = conn.info.get('timing_t0')
+        if timer is not None and starts:
+            timer.add(name, timer.time() - starts.pop())
+
+    event.listen(engine, 'before_cursor_execute', before)
+    event.listen(engine, 'after_cursor_execute', after)
+    return engine
+
+
+def timed_engines(create_engine):
+    '''Wrap `create_engine` so that every engine it makes is watched.
+    '''
+    def create(url, **kwargs):
+        engine = create_engine(url, **kwargs)
+        return watch_engine(engine, label(make_url(url)))
+    return create
+
+
+class Middleware(object):
+    '''Time a fraction of requests; report in a header and the log.
+    '''
+    def __init__(self, app, sample, rng, time):
+        self._app = app
+        self._sample = sample
+        self._rng = rng
+        self._time = time
+
+    def __call__(self, environ, start_response):
+        if not (self._sample >= 1 or
+                (self._sample > 0 and self._rng.random() < self._sample)):
+            return self._app(environ, start_response)
+
+        timer = start(self._time)
+        status = ['-']
+
+        def start_timed(status_line, headers, exc_info=None):
+            status[0] = status_line.split(' ', 1)[0]
+            headers = headers + [('Server-Timing', timer.header())]
+            if exc_info:
+                return start_response(status_line, headers, exc_info)
+            return start_response(status_line, headers)
+
+        try:
+            return self._app(environ, start_timed)
+        finally:
+            stop()
+            log.info('request timing: %s', ' '.join(
+                '%s=%s' % kv for kv in
+                [('method', environ.get('REQUEST_METHOD')),
+                 ('path', environ.get('PATH_INFO')),
+                 ('status', status[0])] + timer.fields()))
@@ -332,11 +332,35 @@ class CapabilityStyle(object):
         '''Ask each issuer to grant capabilities for this permission.
 
         @return: True iff an audit raised no exception.
+
+        A permission granted in a context (i.e. a request) stays
+        granted; we don't ask the issuers again::
+
+          >>> class CountingIssuer(object):
+          ...     grants = 0
+          ...     def grant(self, context, permission):
+          ...         self.grants += 1
+          >>> class Context(object):
+          ...     pass
+          >>> issuer = CountingIssuer()
+          >>> policy, ctx = CapabilityStyle([issuer]), Context()
+          >>> [policy.permits(ctx, [], 'p1') for _ in range(3)]
+          [True, True, True]
+          >>> issuer.grants
+          1
         '''
+        try:
+            granted = context.__granted
+        except AttributeError:
+            granted = context.__granted = set()
+        if permission in granted:
+            return True
+
         for issuer in self.__issuers:
             try:
                 issuer.grant(context, permission)
                 log.info('%s permits %s', issuer, permission)
+                granted.add(permission)
                 return True
             except TypeError as ex:
                 log.debug('TypeError in grant: %s', ex)
@@ -76,12 +76,14 @@ class DROCNotice(Token):
 
     @inject(dr=DecisionRecords,
             smaker=(sqlalchemy.orm.session.Session, redcapdb.CONFIG_SECTION),
-            mailer=Mailer)
-    def __init__(self, dr, smaker, mailer):
+            mailer=Mailer,
+            hr=heron_policy.HeronRecords)
+    def __init__(self, dr, smaker, mailer, hr):
         self._dr = dr
         self._rf = genshi_render.Factory({})
         self._smaker = smaker
         self._mailer = mailer
+        self._hr = hr
 
     def configure(self, config, route, permission=None):
         config.add_view(self.send_notices, route_name=route,
@@ -98,12 +100,13 @@ class DROCNotice(Token):
         ins = noticelog.notice_log.insert()
         out = []
 
-        for record, msg in self.build_notices(req):
+        for record, msg, uids in self._notices(req):
             s = self._smaker()
             log.info('sending to: %s cc: %s', msg.recipients, msg.cc)
             mailer.send_immediately(msg)
             s.execute(ins.values(record=record, timestamp=func.now()))
             s.commit()
+            self._hr.invalidate_sponsorships(uids)
             notice = ('notice sent for record %s: %s\n' %
                       (str(record), str(msg.subject)))
             out.append(notice)
@@ -111,6 +114,9 @@ class DROCNotice(Token):
         return Response(app_iter=out)
 
     def build_notices(self, req):
+        return ((record, msg) for record, msg, _ in self._notices(req))
+
+    def _notices(self, req):
         dr = self._dr
         for record, decision, _ in dr.oversight_decisions():
             if decision not in self.FINAL_DECISIONS:
@@ -151,7 +157,7 @@ class DROCNotice(Token):
                         recipients=[inv_mail] + team_mail,
                         html=body)
 
-            yield record, m
+            yield record, m, [investigator.cn] + [mem.cn for mem in team]
 
 
 def render_value(investigator, team, decision, detail, heron_home):
@@ -9,6 +9,8 @@ import os
 # from PyPI - the Python Package Index http://pypi.python.org/pypi
 from genshi.template import TemplateLoader
 
+from admin_lib import timing
+
 log = logging.getLogger(__name__)
 
 
@@ -21,5 +23,6 @@ class Factory(object):
 
     def __call__(self, value, system):
         log.debug('genshi template: %s', system['renderer_name'])
-        tmpl = self._loader.load(system['renderer_name'])
-        return tmpl.generate(**value).render('xhtml')
+        with timing.timed('render'):
+            tmpl = self._loader.load(system['renderer_name'])
+            return tmpl.generate(**value).render('xhtml')
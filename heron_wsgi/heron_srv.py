@@ -17,6 +17,7 @@ from injector import inject, provides
 import pyramid
 from pyramid.config import Configurator
 from pyramid.httpexceptions import HTTPFound, HTTPSeeOther, HTTPForbidden
+from pyramid.settings import asbool
 from pyramid_mailer.mailer import Mailer
 
 # modules in this package
@@ -25,10 +26,16 @@ import genshi_render
 import drocnotice
 import stats
 import perf_reports
+from admin_lib import cache_warmup
+from admin_lib.dir_replica import DirectoryReplica
+from admin_lib.eligibility import EligibilitySnapshot
+from admin_lib.i2b2pm import AuthSweeper, I2B2PM
 from admin_lib import medcenter
 from admin_lib import heron_policy
+from admin_lib import periodic
 from admin_lib import redcap_connect
 from admin_lib import rtconfig
+from admin_lib import timing
 from admin_lib.rtconfig import Options, TestTimeOptions
 from admin_lib import disclaimer
 from admin_lib.ocap_file import WebReadable, Token, Path
@@ -440,14 +447,17 @@ class TeamBuilder(Token):
                 studyTeam.sort(key=lambda who: (who["lastName"],
                                                 who["firstName"]))
 
+        found = browser.lookup_many(
+            uids + ([investigator_id] if investigator_id else []))
+
         # Since we're the only supposed to supply these names,
         # it seems OK to throw KeyError if we hit a bad one.
-        team = [browser.lookup(n) for n in uids]
+        team = [found[n] for n in uids]
         team.sort(key=lambda(a): (a.sn, a.givenname))
 
         investigator = None
         if investigator_id:
-            inv_info = browser.lookup(investigator_id)
+            inv_info = found[investigator_id]
             if inv_info.faculty_role() or investigator_id in executives:
                 investigator = inv_info
 
@@ -666,11 +676,13 @@ class RunTime(rtconfig.IniModule):  # pragma: nocover
     def mods(cls, cwd, settings, mailer, create_engine, **kwargs):
         ini = cwd / settings['webapp_ini']
         admin_ini = cwd / settings['admin_ini']
-        trainingfn = traincheck.from_config(admin_ini, create_engine)
+        trainingfn, trainingbatch = traincheck.training_functions(
+            admin_ini, create_engine)
         return (cas_auth.RunTime.mods(ini=ini, **kwargs) +
                 heron_policy.RunTime.mods(ini=admin_ini,
                                           create_engine=create_engine,
                                           trainingfn=trainingfn,
+                                          trainingbatch=trainingbatch,
                                           **kwargs) +
                 [cls(ini, settings, mailer)])
 
@@ -743,19 +755,26 @@ def app_factory(global_config, **settings):
     from datetime import datetime
     from io import open as io_open
     from os import listdir
-    from os.path import join as joinpath
+    from os.path import join as joinpath, getmtime
     from random import Random
+    from time import sleep, time
     from urllib2 import build_opener
     import uuid
 
     from sqlalchemy import create_engine
     import ldap
 
-    cwd = Path('.', open=io_open, joinpath=joinpath, listdir=listdir)
+    cwd = Path('.', open=io_open, joinpath=joinpath, listdir=listdir,
+               getmtime=getmtime)
+
+    timed = asbool(settings.get('timing', False))
+    if timed:
+        create_engine = timing.timed_engines(create_engine)
 
     log.debug('in app_factory')
-    [config] = RunTime.make(
-        [HeronAdminConfig],
+    [config, replica, eligible, sweeper, hr, pm, depgraph] = RunTime.make(
+        [HeronAdminConfig, DirectoryReplica, EligibilitySnapshot,
+         AuthSweeper, heron_policy.HeronRecords, I2B2PM, None],
         cwd=cwd,
         settings=settings,
         create_engine=create_engine,
@@ -773,7 +792,28 @@ def app_factory(global_config, **settings):
                     context=Exception,
                     permission=pyramid.security.NO_PERMISSION_REQUIRED)
 
-    return config.make_wsgi_app()
+    if asbool(settings.get('cache_warmup', False)):
+        warmer = depgraph.get(cache_warmup.CacheWarmer)
+        periodic.start(
+            'cache-warmup', warmer.run, sleep=sleep,
+            rate=float(settings.get('cache_warmup.rate', 2)),
+            max_users=int(settings.get('cache_warmup.max_users', 200)))
+
+    if replica.enabled:
+        periodic.start('dir-replica', replica.run, sleep=sleep)
+
+    if eligible.enabled:
+        periodic.start('eligibility', eligible.run, sleep=sleep,
+                       statuses=hr.statuses, users=pm.user_ids)
+
+    periodic.start('auth-sweeper', sweeper.run, sleep=sleep)
+
+    app = config.make_wsgi_app()
+    if timed:
+        app = timing.Middleware(app,
+                                sample=float(settings.get('timing.sample', 1)),
+                                rng=Random(), time=time)
+    return app
 
 
 if __name__ == '__main__':  # pragma nocover
@@ -0,0 +1,443 @@
+'''loadtest -- drive simulated users through the HERON admin app
+
+Usage:
+  loadtest [options]
+
+Options:
+  --users=N          number of simulated users [default: 20]
+  --threads=N        concurrent workers [default: 4]
+  --rounds=N         passes each user makes through the flow [default: 1]
+  --population=N     size of a synthetic directory; 0 to use
+                     the mock directory [default: 0]
+  --seed=N           synthetic population seed [default: 0]
+  --ldap-delay=S     seconds added to each LDAP search [default: 0]
+  --db-delay=S       seconds added to each SQL statement [default: 0]
+  --http-delay=S     seconds added to each CAS validation [default: 0]
+  --save=FILE        append results to FILE (JSON, one run per line)
+                     and compare them with the previous run there
+  --label=L          name of this run in saved results [default: dev]
+  --tolerance=X      p95 slowdown ratio that counts as a
+                     regression [default: 1.2]
+  -d --debug         turn on debug logging
+
+.. note:: This directive separates usage doc above from design notes below.
+
+Each simulated user goes through the same steps a person does on a
+typical visit:
+
+  1. `cas_login`: arrive with a CAS ticket
+  2. `checklist`: the home page (:meth:`heron_srv.CheckListView.get`)
+  3. `team_search`: a team builder search by surname
+  4. `i2b2_login`: the start-i2b2 button
+  5. `disclaimer`: acknowledge the disclaimer
+
+The app is the one built by :class:`heron_srv.Mock`, with stand-ins for
+LDAP, the databases and CAS that can be slowed down::
+
+  >>> from tempfile import mkdtemp
+  >>> from shutil import rmtree
+  >>> workdir = mkdtemp()
+  >>> report = run(['john.smith', 'bill.student'], threads=2,
+  ...              workdir=workdir)
+  >>> rmtree(workdir)
+
+  >>> report.requests
+  10
+  >>> for route in FLOW:
+  ...     s = report.routes[route]
+  ...     print(route, s['count'], s['denied'], s['errors'])
+  ('cas_login', 2, 0, 0)
+  ('checklist', 2, 0, 0)
+  ('team_search', 2, 0, 0)
+  ('i2b2_login', 2, 1, 0)
+  ('disclaimer', 2, 1, 0)
+
+Responses such as 403 Forbidden count as `denied` rather than errors;
+students don't get to use i2b2 without a sponsor.
+
+Reports give throughput and nearest-rank percentiles of response times
+in milliseconds::
+
+  >>> print(report.format())  # doctest: +ELLIPSIS
+  dev: 10 requests in ... s; ... requests/s
+  route          count denied errors    p50    p95    p99
+  cas_login          2      0      0 ...
+
+Saving Results
+--------------
+
+To see regressions between releases, save each run and compare p95
+times with the previous one::
+
+  >>> before = Report('v1', '2011-09-01T00:00:00', 1.0, 5, {
+  ...     'checklist': dict(count=5, denied=0, errors=0,
+  ...                       p50=10.0, p95=20.0, p99=25.0)})
+  >>> after = before._replace(label='v2', routes={
+  ...     'checklist': dict(count=5, denied=0, errors=1,
+  ...                       p50=12.0, p95=31.0, p99=35.0)})
+  >>> for complaint in after.regressions(before, tolerance=1.2):
+  ...     print(complaint)
+  checklist p95: 20.0ms in v1 -> 31.0ms in v2
+  checklist errors: 0 in v1 -> 1 in v2
+
+  >>> Report.from_json(after.to_json()) == after
+  True
+
+'''
+
+from collections import namedtuple
+from datetime import datetime
+from os.path import join as joinpath
+from urlparse import urlparse, parse_qs
+import json
+import logging
+
+import injector
+from injector import inject, provides, singleton
+from sqlalchemy import event, orm
+from sqlalchemy.engine.base import Connectable
+
+import cas_auth
+import heron_srv
+from admin_lib import heron_policy
+from admin_lib import i2b2pm
+from admin_lib import ldaplib
+from admin_lib import redcapdb
+from admin_lib import rtconfig
+from admin_lib.cache_remote import CachePolicy, _percentile
+from admin_lib.fanout import FanOut
+from admin_lib.ocap_file import WebReadable
+
+log = logging.getLogger(__name__)
+
+FLOW = ('cas_login', 'checklist', 'team_search', 'i2b2_login', 'disclaimer')
+
+Latency = namedtuple('Latency', 'ldap db http')
+
+
+def run(uids, threads=4, rounds=1, latency=Latency(0, 0, 0),
+        population=None, workdir=None, label='dev'):
+    '''Send each of `uids` through :data:`FLOW` `rounds` times.
+
+    :param workdir: where to put the sqlite databases the simulated
+                    users share
+    :param population: a :class:`admin_lib.synthetic.Population`
+                       to use in place of the mock directory
+    :rtype: :class:`Report`
+    '''
+    from threading import Thread
+    from time import sleep, time
+    from Queue import Queue, Empty
+
+    app = make_app(latency, sleep, workdir, population)
+
+    jobs = Queue()
+    for n in range(rounds):
+        for ix, uid in enumerate(uids):
+            jobs.put((uid, 'ST-%d-%s' % (n * len(uids) + ix, uid)))
+
+    samples = []
+
+    def work():
+        while True:
+            try:
+                uid, ticket = jobs.get_nowait()
+            except Empty:
+                return
+            samples.extend(visit(app, uid, ticket, time))
+
+    started = datetime.now()
+    t0 = time()
+    workers = [Thread(target=work, name='loadtest-%d' % ix)
+               for ix in range(threads)]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    return Report.of(label, started, time() - t0, samples)
+
+
+def make_app(latency, sleep, workdir, population=None):
+    mods = heron_srv.Mock.mods()
+    if population:
+        from admin_lib import synthetic
+        mods += [synthetic.Mock(population)]
+    mods += [Mock(latency, sleep, workdir, population)]
+    config = injector.Injector(mods).get(heron_srv.HeronAdminConfig)
+    return config.make_wsgi_app()
+
+
+def visit(app, uid, ticket, time):
+    '''Go through :data:`FLOW` as `uid`.
+
+    :return: (route, status, milliseconds) for each step
+    '''
+    from paste.fixture import TestApp
+
+    t = TestApp(app)
+    any_status = dict(status='*', expect_errors=True)
+    sn = uid.split('.')[-1][:3]
+    steps = [
+        ('cas_login', lambda: t.get('/?ticket=' + ticket, **any_status)),
+        ('checklist', lambda: t.get('/', **any_status)),
+        ('team_search', lambda: t.get(
+            '/build_team/sponsorship?goal=Search&sn=' + sn, **any_status)),
+        ('i2b2_login', lambda: t.post('/i2b2', **any_status)),
+        ('disclaimer', lambda: t.post('/disclaimer', **any_status))]
+
+    samples = []
+    for route, step in steps:
+        t0 = time()
+        try:
+            status = step().status
+        except Exception:
+            log.error('%s failed for %s', route, uid, exc_info=True)
+            status = 500
+        samples.append((route, status, (time() - t0) * 1000))
+    return samples
+
+
+class Report(namedtuple('Report', 'label started elapsed requests routes')):
+    '''Throughput and response time percentiles of a run, by route.
+    '''
+    @classmethod
+    def of(cls, label, started, elapsed, samples):
+        routes = {}
+        for route in set(r for (r, _, _) in samples):
+            statuses = [s for (r, s, _) in samples if r == route]
+            times = sorted(ms for (r, _, ms) in samples if r == route)
+            routes[route] = dict(
+                count=len(times),
+                denied=len([s for s in statuses if 400 <= s < 500]),
+                errors=len([s for s in statuses if s >= 500]),
+                p50=_percentile(times, 50),
+                p95=_percentile(times, 95),
+                p99=_percentile(times, 99))
+        return cls(label, started.isoformat(), elapsed, len(samples),
+                   routes)
+
+    @property
+    def throughput(self):
+        return self.requests / self.elapsed if self.elapsed else 0.0
+
+    def format(self):
+        lines = ['%s: %d requests in %.2f s; %.1f requests/s' % (
+            self.label, self.requests, self.elapsed, self.throughput),
+            '%-14s %5s %6s %6s %6s %6s %6s' % (
+                'route', 'count', 'denied', 'errors', 'p50', 'p95', 'p99')]
+        for route in sorted(self.routes, key=_flow_order):
+            s = self.routes[route]
+            lines.append('%-14s %5d %6d %6d %6.1f %6.1f %6.1f' % (
+                route, s['count'], s['denied'], s['errors'],
+                s['p50'], s['p95'], s['p99']))
+        return '\n'.join(lines)
+
+    def regressions(self, before, tolerance):
+        '''Compare with an earlier run.
+
+        :return: descriptions of routes that got slower by more than
+                 `tolerance` (a ratio) at p95, or that got more errors
+        '''
+        out = []
+        for route in sorted(self.routes, key=_flow_order):
+            now, then = self.routes[route], before.routes.get(route)
+            if then is None:
+                continue
+            if now['p95'] > then['p95'] * tolerance:
+                out.append('%s p95: %.1fms in %s -> %.1fms in %s' % (
+                    route, then['p95'], before.label, now['p95'],
+                    self.label))
+            if now['errors'] > then['errors']:
+                out.append('%s errors: %d in %s -> %d in %s' % (
+                    route, then['errors'], before.label, now['errors'],
+                    self.label))
+        return out
+
+    def to_json(self):
+        return json.dumps(self._asdict(), sort_keys=True)
+
+    @classmethod
+    def from_json(cls, text):
+        return cls(**dict((str(k), v) for (k, v) in json.loads(text).items()))
+
+
+def _flow_order(route):
+    return FLOW.index(route) if route in FLOW else len(FLOW)
+
+
+class RunningClock(object):
+    '''Real time, but starting from the mock clock's date, when the
+    mock directory's training records and such are current.
+    '''
+    def __init__(self, timesrc):
+        self._timesrc = timesrc
+        self._t0 = timesrc.now()
+        self._start = rtconfig.MockClock().now()
+
+    def now(self):
+        return self._start + (self._timesrc.now() - self._t0)
+
+    def today(self):
+        return self.now().date()
+
+
+class SlowLDAP(ldaplib.MockLDAP):
+    def __init__(self, records, delay, sleep):
+        ldaplib.MockLDAP.__init__(self, records)
+        self._delay = delay
+        self._sleep = sleep
+
+    def _search(self, q, attrs):
+        self._sleep(self._delay)
+        return ldaplib.MockLDAP._search(self, q, attrs)
+
+
+class TicketOpener(object):
+    '''Validate any `ST-n-uid` CAS ticket as `uid`.
+    '''
+    def __init__(self, delay, sleep):
+        self._delay = delay
+        self._sleep = sleep
+
+    def open(self, addr, body=None):
+        [ticket] = parse_qs(urlparse(addr).query)['ticket']
+        uid = ticket.split('-', 2)[2]
+        self._sleep(self._delay)
+        return cas_auth.LinesResponse(['yes', uid])
+
+
+class Mock(heron_policy.Mock):
+    '''Override :class:`heron_srv.Mock` stand-ins for use by many threads.
+
+    In-memory sqlite databases are per-thread, so we put the REDCap
+    and i2b2 databases in files under `workdir`.
+    '''
+    def __init__(self, latency, sleep, workdir, population=None):
+        from sqlalchemy import create_engine
+
+        heron_policy.Mock.__init__(self)
+        self._latency = latency
+        self._sleep = sleep
+
+        def engine(name):
+            # Connections the app leaves open get closed by
+            # whichever thread collects them.
+            e = create_engine('sqlite:///' + joinpath(workdir, name + '.db'),
+                              connect_args=dict(check_same_thread=False))
+            # Let readers and a writer proceed at the same time.
+            event.listen(e, 'connect', lambda dbapi_conn, _:
+                         dbapi_conn.execute('pragma journal_mode=wal'))
+            if latency.db:
+                event.listen(e, 'before_cursor_execute',
+                             lambda *_: sleep(latency.db))
+            return e
+
+        self._redcap = engine('redcap')
+        redcapdb.Mock.init_db(self._redcap)
+        if population:
+            population.load_redcap(self._redcap)
+        self.io.connect = self._redcap.connect
+
+        self._i2b2 = engine('i2b2pm')
+        i2b2pm.Base.metadata.create_all(self._i2b2)
+
+    @singleton
+    @provides(rtconfig.Clock)
+    def _time_source(self):
+        return RunningClock(datetime)
+
+    @provides((Connectable, redcapdb.CONFIG_SECTION))
+    def redcap_datasource(self):
+        return self._redcap
+
+    @provides((orm.session.Session, i2b2pm.CONFIG_SECTION))
+    def pm_sessionmaker(self):
+        return orm.session.sessionmaker(self._i2b2)
+
+    @singleton
+    @provides(FanOut)
+    def lookups(self):
+        return FanOut(workers=4, timeout=10)
+
+    @provides(i2b2pm.KUUIDGen)
+    def uuid_maker(self):
+        import uuid
+        return uuid
+
+    @singleton
+    @provides(ldaplib.LDAPService)
+    @inject(d=ldaplib.MockDirectory, ts=rtconfig.Clock,
+            policy=CachePolicy, breaker=ldaplib.CircuitBreaker)
+    def ldap(self, d, ts, policy, breaker):
+        return ldaplib.LDAPService(
+            ts.now, ttl=2, rt=ldaplib._sample_settings,
+            ldap=SlowLDAP(d.records, self._latency.ldap, self._sleep),
+            flags=ldaplib.MockLDAP, policy=policy, breaker=breaker)
+
+    @provides((WebReadable, cas_auth.CONFIG_SECTION))
+    @inject(rt=(rtconfig.Options, cas_auth.CONFIG_SECTION))
+    def cas_server(self, rt):
+        return WebReadable(rt.base,
+                           TicketOpener(self._latency.http, self._sleep))
+
+
+def main(argv, stdout, mkdtemp, rmtree, openf):
+    # Don't require docopt except for command-line usage
+    from docopt import docopt
+
+    usage = __doc__.split('\n..')[0]
+    opts = docopt(usage, argv=argv[1:])
+    log.debug('docopt: %s', opts)
+
+    size = int(opts['--population'])
+    if size:
+        from admin_lib import synthetic
+        population = synthetic.Population(size, seed=int(opts['--seed']))
+        records = population.records
+    else:
+        population = None
+        records = ldaplib.MockDirectory.records
+    users = int(opts['--users'])
+    uids = [records[ix % len(records)]['cn'] for ix in range(users)]
+
+    latency = Latency(float(opts['--ldap-delay']),
+                      float(opts['--db-delay']),
+                      float(opts['--http-delay']))
+    workdir = mkdtemp()
+    try:
+        report = run(uids, threads=int(opts['--threads']),
+                     rounds=int(opts['--rounds']), latency=latency,
+                     population=population, workdir=workdir,
+                     label=opts['--label'])
+    finally:
+        rmtree(workdir)
+    stdout.write(report.format() + '\n')
+
+    save = opts['--save']
+    if save:
+        try:
+            with openf(save) as saved:
+                runs = [line for line in saved if line.strip()]
+        except IOError:
+            runs = []
+        if runs:
+            before = Report.from_json(runs[-1])
+            for complaint in report.regressions(
+                    before, float(opts['--tolerance'])):
+                stdout.write('REGRESSION: %s\n' % complaint)
+        with openf(save, 'a') as out:
+            out.write(report.to_json() + '\n')
+
+
+if __name__ == '__main__':  # pragma: nocover
+    def _privileged_main():
+        from __builtin__ import open as openf
+        from shutil import rmtree
+        from sys import argv, stdout
+        from tempfile import mkdtemp
+
+        logging.basicConfig(
+            level=logging.DEBUG if '--debug' in argv else logging.WARN)
+        main(argv, stdout, mkdtemp, rmtree, openf)
+
+    _privileged_main()
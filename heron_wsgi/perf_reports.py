@@ -4,12 +4,28 @@ import itertools
 import logging
 import math
 
+from injector import inject
+
 from admin_lib import heron_policy
+from admin_lib.cache_remote import CachePolicy
+from admin_lib.i2b2pm import AuthSweeper
+from admin_lib.jndi_util import DataSources
+from admin_lib.ldaplib import CircuitBreaker
 
 log = logging.getLogger(__name__)
 
 
 class PerformanceReports(object):
+    @inject(cache_policy=CachePolicy,
+            ldap_breaker=CircuitBreaker,
+            datasources=DataSources,
+            auth_sweeper=AuthSweeper)
+    def __init__(self, cache_policy, ldap_breaker, datasources,
+                 auth_sweeper):
+        self._cache_stats = cache_policy.stats
+        self._ldap_breaker = ldap_breaker
+        self._datasources = datasources
+        self._auth_sweeper = auth_sweeper
 
     def configure(self, config, mount_point):
         '''Connect this view to the rest of the application
@@ -22,6 +38,11 @@ class PerformanceReports(object):
                         request_method='GET', renderer='performance.html',
                         permission=heron_policy.PERM_STATS_REPORTER)
 
+        config.add_route('cache_stats', mount_point + 'cache')
+        config.add_view(self.show_cache_stats, route_name='cache_stats',
+                        request_method='GET', renderer='cache.html',
+                        permission=heron_policy.PERM_STATS_REPORTER)
+
     def show_performance(self, context, req):
         order = dict(INCOMPLETE=1,
                      COMPLETED=2,
@@ -38,6 +59,46 @@ class PerformanceReports(object):
                     log=math.log,
                     cycle=itertools.cycle)
 
+    def show_cache_stats(self, context, req):
+        '''Show cache effectiveness and remote query latency by label,
+        along with the state of the LDAP circuit breaker,
+        database connection pools, and expired password sweeps.
+
+        >>> from admin_lib import jndi_util
+        >>> hp, context, req = heron_policy.mock_context('john.smith')
+        >>> hp.grant(context, heron_policy.PERM_STATS_REPORTER)
+        >>> sources = DataSources(jndi_util._MockEngine)
+        >>> _ = sources.context(jndi_util._MockDeployDir.make()).lookup(
+        ...     'java:/QueryToolBLUEHERONDS')
+        >>> sweeper = AuthSweeper(None, interval=60)
+        >>> r = PerformanceReports(CachePolicy(), CircuitBreaker(), sources,
+        ...                        sweeper)
+        >>> r._cache_stats.count('LDAP', 'misses')
+        >>> r._cache_stats.latency('LDAP', 0.125)
+        >>> v = r.show_cache_stats(context, req)
+        >>> v['labels']
+        ... # doctest: +NORMALIZE_WHITESPACE
+        [LabelStats(label='LDAP', hits=0, misses=1, coalesced=0, stale=0,
+                    expirations=0, evictions=0, hit_ratio=0.0,
+                    p50=125.0, p90=125.0, p99=125.0)]
+
+        Check that this supplies everything the template expects::
+        >>> import genshi_render
+        >>> f = genshi_render.Factory({})
+        >>> pg = f(v, dict(renderer_name='cache.html'))
+        >>> 'LDAP' in pg and '125.0' in pg and 'closed' in pg
+        True
+        >>> 'QueryToolBLUEHERONDS' in pg
+        True
+        >>> v['auth_sweep']
+        SweepStats(interval=60, sweeps=0, last_revoked=None, total_revoked=0)
+        '''
+        return dict(labels=self._cache_stats.report(),
+                    ldap_breaker=self._ldap_breaker.state(),
+                    pools=self._datasources.pool_stats(),
+                    auth_sweep=self._auth_sweeper.stats(),
+                    cycle=itertools.cycle)
+
 
 def _json_val(x):
     '''
@@ -75,15 +75,11 @@ class Reports(object):
 
         query_volume = usage.query_volume()
 
-        def details(uid):
-            try:
-                a = browser.lookup(user_id)
-                return '%s, %s' % (a.title, a.ou)
-            except KeyError:
-                return ''
-
-        user_ids = set([row.user_id for row in query_volume])
-        roles = dict([(user_id, details(user_id))
+        user_ids = sorted(set([row.user_id for row in query_volume]))
+        found = browser.lookup_many(user_ids)
+        roles = dict([(user_id,
+                       '%s, %s' % (found[user_id].title, found[user_id].ou)
+                       if user_id in found else '')
                       for user_id in user_ids])
 
         return dict(total_number_of_queries=usage.total_number_of_queries(),
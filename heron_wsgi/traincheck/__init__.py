@@ -12,6 +12,13 @@ TRAINING_SECTION = 'training'
 
 
 def from_config(ini, create_engine):
+    latest, _latest_many = training_functions(ini, create_engine)
+    return latest
+
+
+def training_functions(ini, create_engine):
+    '''Look up training one user at a time and many at once.
+    '''
     cp = ConfigParser()
     cp.readfp(ini.open(), str(ini))
     u = make_url(cp.get(TRAINING_SECTION, 'url'))
@@ -24,4 +31,4 @@ def from_config(ini, create_engine):
 
     tr = TrainingRecordsRd(account)
 
-    return tr.__getitem__
+    return tr.__getitem__, tr.latest_many
@@ -135,6 +135,21 @@ But there's no training on file for Fred::
       ...
     KeyError: 'fred'
 
+To check many users at once, use one query; users with no training
+on file are left out::
+
+    >>> found = rd.latest_many(['sssstttt', 'fred', 'mp'])
+    >>> for who in sorted(found):
+    ...     print who, str(found[who].expired)[:10]
+    mp 2017-07-01
+    sssstttt 2000-02-04
+
+Usernames match regardless of case::
+
+    >>> found = rd.latest_many(['SSSStttt'])
+    >>> [(who, str(t.expired)[:10]) for (who, t) in found.items()]
+    [('SSSStttt', '2000-02-04')]
+
 
 Course Naming
 *************
@@ -458,7 +473,22 @@ def TrainingRecordsRd(acct):
 
         return record
 
-    return [__getitem__], dict(lookup_query=lookup)
+    def latest_many(_, instUserNames):
+        # Compare the bare (indexed) column; match case in Python
+        # and key results as asked.
+        asked = dict((name.lower(), name) for name in instUserNames)
+        conn = getConn()
+        with conn.begin():
+            result = conn.execute(
+                lookup.select(lookup.c.username.in_(
+                    sorted(set(asked) | set(instUserNames))))
+                .order_by(lookup.c.expired.desc()))
+            found = {}
+            for record in result.fetchall():
+                found.setdefault(asked[record.username.lower()], record)
+        return found
+
+    return [__getitem__, latest_many], dict(lookup_query=lookup)
 
 
 @maker